@@ -0,0 +1,8 @@
+"""
+Benchmarks for the full RPC path: each scenario starts a real server from this checkout
+against a stub executor, drives it through the same one-off jrpc client as the zsh
+client, and reports results as JSON so runs can be compared across versions.
+
+    python -m benchmarks run start-storm --clients 16 --output before.json
+    python -m benchmarks compare before.json after.json
+"""
@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import platform
+import shlex
+import subprocess
+import sys
+import time
+from typing import Any
+
+from .harness import BenchServer, ServerOptions
+from .micro import MICRO_BENCHMARKS
+from .scenarios import SCENARIOS, LoadOptions
+
+
+def _version() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _run_scenario(name: str, server_options: ServerOptions, load: LoadOptions) -> Any:
+    async with BenchServer(server_options) as server:
+        return await SCENARIOS[name](server, load)
+
+
+def _run(args: argparse.Namespace) -> int:
+    load = LoadOptions(
+        clients=args.clients,
+        jobs_per_client=args.jobs_per_client,
+        arg_bytes=args.arg_bytes,
+        job_duration_s=args.job_duration,
+        stdio=args.stdio,
+        history=args.history,
+        list_iterations=args.list_iterations,
+        reload_interval_s=args.reload_interval,
+    )
+    server_options = ServerOptions(
+        executor=args.executor,
+        max_concurrency=args.max_concurrency,
+        workers=args.workers,
+        client_command=shlex.split(args.client),
+    )
+
+    micro_sizes = {"journal-replay": args.records, "job-memory": args.memory_jobs}
+
+    results: dict[str, Any] = {}
+    for name in args.scenarios:
+        print(f"Running {name}", file=sys.stderr)
+        if name in MICRO_BENCHMARKS:
+            results[name] = MICRO_BENCHMARKS[name](micro_sizes[name])
+        else:
+            results[name] = asyncio.run(_run_scenario(name, server_options, load))
+
+    report = {
+        "version": _version(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "options": (
+            vars(load) | vars(server_options) | {
+                "records": args.records,
+                "memory_jobs": args.memory_jobs,
+            }
+        ),
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+def _flatten(value: Any, prefix: str = "") -> dict[str, float]:
+    if isinstance(value, dict):
+        flat: dict[str, float] = {}
+        for key, child in value.items():
+            flat |= _flatten(child, f"{prefix}{key}.")
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix.rstrip("."): value}
+    return {}
+
+
+def _format(value: float | None) -> str:
+    return "-" if value is None else f"{value:.6g}"
+
+
+def _compare(args: argparse.Namespace) -> int:
+    with open(args.baseline) as file:
+        baseline = _flatten(json.load(file)["results"])
+    with open(args.candidate) as file:
+        candidate = _flatten(json.load(file)["results"])
+
+    width = max((len(key) for key in baseline | candidate), default=0)
+    for key in sorted(baseline.keys() | candidate.keys()):
+        old = baseline.get(key)
+        new = candidate.get(key)
+        change = ""
+        if old is not None and new is not None and old != 0:
+            change = f"{(new - old) / abs(old):+.1%}"
+        print(f"{key:<{width}}  {_format(old):>12}  {_format(new):>12}  {change:>8}")
+    return 0
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    subparsers = parser.add_subparsers(required=True)
+
+    run = subparsers.add_parser("run", help="run scenarios and report the results as JSON")
+    run.set_defaults(func=_run)
+    run.add_argument("scenarios", nargs="+", choices=[*SCENARIOS, *MICRO_BENCHMARKS])
+    run.add_argument("--output", help="file to write the report to, instead of stdout")
+    run.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    run.add_argument("--jobs-per-client", type=int, default=50)
+    run.add_argument("--arg-bytes", type=int, default=0, help="size of a padding arg per job")
+    run.add_argument("--job-duration", type=float, default=0.0, help="seconds each job runs")
+    run.add_argument("--stdio", choices=["devnull", "fifo", "capture"], default="devnull")
+    run.add_argument("--history", type=int, default=10_000, help="jobs run before list-jobs")
+    run.add_argument("--list-iterations", type=int, default=20)
+    run.add_argument("--reload-interval", type=float, default=0.5)
+    run.add_argument("--records", type=int, default=1_000_000, help="journal-replay size")
+    run.add_argument("--memory-jobs", type=int, default=10_000, help="job-memory size")
+    run.add_argument("--executor", choices=["shell", "python"], default="shell")
+    run.add_argument("--max-concurrency", type=int, default=None)
+    run.add_argument("--workers", type=int, default=1, help="server worker processes")
+    run.add_argument("--client", default="jrpc-oneoff request", help="one-off client command")
+
+    compare = subparsers.add_parser("compare", help="compare two reports")
+    compare.set_defaults(func=_compare)
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,333 @@
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import shlex
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Any, Self
+
+_LOGGER = logging.getLogger("benchmarks")
+
+_REPO_ROOT = pathlib.Path(__file__).parent.parent
+STUB_EXECUTOR = pathlib.Path(__file__).parent.joinpath("stub-executor.sh")
+
+
+class RpcError(Exception):
+    pass
+
+
+@dataclass
+class RpcClient:
+    """
+    Makes requests the same way the zsh client does, by running a one-off jrpc client per
+    request, so latencies include everything a real caller pays for
+    """
+
+    socket: pathlib.Path
+    command: list[str] = field(default_factory=lambda: ["jrpc-oneoff", "request"])
+
+    async def request(self, method: str, params: dict[str, Any]) -> dict[str, Any]:
+        process = await asyncio.create_subprocess_exec(
+            *self.command,
+            str(self.socket),
+            method,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate(json.dumps(params).encode())
+        if process.returncode != 0:
+            raise RpcError(f"{method} failed ({process.returncode}): {stderr.decode().strip()}")
+
+        try:
+            return json.loads(stdout)
+        except json.JSONDecodeError as e:
+            raise RpcError(f"{method} returned invalid JSON: {stdout[:200]!r}") from e
+
+
+@dataclass
+class Latencies:
+    samples: list[float] = field(default_factory=list)
+
+    def record(self, start: float) -> None:
+        self.samples.append(time.perf_counter() - start)
+
+    def summary(self) -> dict[str, float | int | None]:
+        if not self.samples:
+            return {"count": 0, "p50_s": None, "p99_s": None, "max_s": None, "mean_s": None}
+
+        ordered = sorted(self.samples)
+        return {
+            "count": len(ordered),
+            "p50_s": _percentile(ordered, 0.50),
+            "p99_s": _percentile(ordered, 0.99),
+            "max_s": ordered[-1],
+            "mean_s": statistics.fmean(ordered),
+        }
+
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+@dataclass
+class ResourceSample:
+    threads: int
+    fds: int
+    rss_kb: int
+
+
+def sample_resources(pid: int) -> ResourceSample:
+    threads = 0
+    rss_kb = 0
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            key, _, value = line.partition(":")
+            if key == "Threads":
+                threads = int(value)
+            elif key == "VmRSS":
+                rss_kb = int(value.split()[0])
+
+    return ResourceSample(threads=threads, fds=len(os.listdir(f"/proc/{pid}/fd")), rss_kb=rss_kb)
+
+
+def _child_pids(pid: int) -> list[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as children:
+        return [int(child) for child in children.read().split()]
+
+
+class ResourceMonitor:
+    """
+    Samples the server's thread count, open FDs and RSS in the background. With
+    include_children, these are summed over the server and its child processes (its workers).
+    """
+
+    def __init__(self, pid: int, interval_s: float = 0.1, include_children: bool = False) -> None:
+        self._pid = pid
+        self._interval_s = interval_s
+        self._include_children = include_children
+        self._samples: list[ResourceSample] = []
+        self._task: asyncio.Task[None] | None = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self._samples.append(self._sample())
+            except (FileNotFoundError, ProcessLookupError):
+                return
+            await asyncio.sleep(self._interval_s)
+
+    def _sample(self) -> ResourceSample:
+        sample = sample_resources(self._pid)
+        if not self._include_children:
+            return sample
+
+        for child in _child_pids(self._pid):
+            try:
+                child_sample = sample_resources(child)
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+            sample.threads += child_sample.threads
+            sample.fds += child_sample.fds
+            sample.rss_kb += child_sample.rss_kb
+        return sample
+
+    def summary(self) -> dict[str, dict[str, int]]:
+        result: dict[str, dict[str, int]] = {}
+        for name in ("threads", "fds", "rss_kb"):
+            values = [getattr(sample, name) for sample in self._samples]
+            if values:
+                result[name] = {"max": max(values), "last": values[-1]}
+        return result
+
+    async def __aenter__(self) -> Self:
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+@dataclass
+class ServerOptions:
+    executor: str = "shell"
+    max_concurrency: int | None = None
+    workers: int = 1
+    extra_config: str = ""
+    client_command: list[str] = field(default_factory=lambda: ["jrpc-oneoff", "request"])
+
+
+class BenchServer:
+    """
+    A real server process, run from this checkout against the stub executor, with its
+    own socket and journal in a temporary directory
+    """
+
+    def __init__(self, options: ServerOptions) -> None:
+        self.options = options
+        self._tempdir = tempfile.TemporaryDirectory(prefix="command-server-bench.")
+        self.dir = pathlib.Path(self._tempdir.name)
+        self.socket = self.dir.joinpath("socket")
+        self.client = RpcClient(self.socket, options.client_command)
+        self._process: asyncio.subprocess.Process | None = None
+
+    @property
+    def pid(self) -> int:
+        assert self._process is not None
+        return self._process.pid
+
+    def monitor(self) -> ResourceMonitor:
+        return ResourceMonitor(self.pid, include_children=self.options.workers > 1)
+
+    def _write_config(self) -> pathlib.Path:
+        lines = [
+            "[core]",
+            f"journal_file = {self.dir.joinpath('journal.jsonl')}",
+        ]
+        if self.options.max_concurrency is not None:
+            lines.append(f"max_concurrency = {self.options.max_concurrency}")
+        lines += [
+            "",
+            "[executor]",
+            f"command = {STUB_EXECUTOR}",
+            f"args = {self.options.executor}",
+            "",
+            self.options.extra_config,
+        ]
+
+        path = self.dir.joinpath("server.conf")
+        path.write_text("\n".join(lines))
+        return path
+
+    async def start(self) -> None:
+        config_path = self._write_config()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(_REPO_ROOT), env.get("PYTHONPATH")]))
+        env["XDG_RUNTIME_DIR"] = str(self.dir)
+
+        self._process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "command_server.command_server",
+            f"--workers={self.options.workers}",
+            "--",
+            str(self.socket),
+            str(config_path),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+            env=env,
+        )
+
+        deadline = time.monotonic() + 10
+        while not self.socket.exists():
+            if self._process.returncode is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"Server did not start, see {self.dir}")
+            await asyncio.sleep(0.01)
+
+        await self.reload_executor()
+
+    async def reload_executor(self) -> dict[str, Any]:
+        response = await self.client.request(
+            "executor.reload",
+            {"stdio": devnull_stdio(), "config_overrides": {}},
+        )
+        return await self.client.request("executor.wait-ready", {"id": response["executor"]["id"]})
+
+    async def stop(self) -> None:
+        if self._process is None:
+            return
+
+        if self._process.returncode is None:
+            try:
+                await self.client.request("command_server.stop", {})
+                await asyncio.wait_for(self._process.wait(), 10)
+            except (RpcError, TimeoutError):
+                _LOGGER.warning("Server did not stop cleanly, killing it")
+                self._process.kill()
+                await self._process.wait()
+
+    async def __aenter__(self) -> Self:
+        try:
+            await self.start()
+        except BaseException:
+            await self.stop()
+            self._tempdir.cleanup()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        try:
+            await self.stop()
+        finally:
+            self._tempdir.cleanup()
+
+
+def devnull_stdio() -> dict[str, str]:
+    return {"stdin": "/dev/null", "stdout": "/dev/null", "stderr": "/dev/null"}
+
+
+@dataclass
+class FifoStdio:
+    """
+    Per-job FIFOs drained by the benchmark, like the zsh client's stdio forwarding
+    """
+
+    dir: pathlib.Path
+    name: str
+
+    def __post_init__(self) -> None:
+        self.stdout = self.dir.joinpath(f"{self.name}.out.pipe")
+        self.stderr = self.dir.joinpath(f"{self.name}.err.pipe")
+        os.mkfifo(self.stdout, 0o600)
+        os.mkfifo(self.stderr, 0o600)
+        self._drains = [
+            asyncio.create_task(asyncio.to_thread(_drain, self.stdout)),
+            asyncio.create_task(asyncio.to_thread(_drain, self.stderr)),
+        ]
+
+    def params(self) -> dict[str, str]:
+        return {"stdin": "/dev/null", "stdout": str(self.stdout), "stderr": str(self.stderr)}
+
+    def abandon(self) -> None:
+        for path in (self.stdout, self.stderr):
+            open(path, "wb").close()
+
+    async def close(self) -> int:
+        """
+        Waits for the job to close its output, returning the number of bytes read
+        """
+
+        sizes = await asyncio.gather(*self._drains)
+        os.unlink(self.stdout)
+        os.unlink(self.stderr)
+        return sum(sizes)
+
+
+def _drain(path: pathlib.Path) -> int:
+    size = 0
+    with open(path, "rb") as file:
+        while chunk := file.read(65536):
+            size += len(chunk)
+    return size
+
+
+def job_args(duration_s: float, arg_bytes: int) -> list[str]:
+    """
+    A stub job that sleeps for duration_s, padded with a dummy arg to arg_bytes
+    """
+
+    args = ["sleep", str(duration_s)] if duration_s > 0 else ["true"]
+    if arg_bytes > 0:
+        args = ["sh", "-c", f'{shlex.join(args)} # "$@"', "pad", "x" * arg_bytes]
+    return args
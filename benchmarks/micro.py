@@ -0,0 +1,128 @@
+import asyncio
+import gc
+import pathlib
+import resource
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+from command_server.job import FinishedJob, Job
+from command_server.journal import (
+    JournalEntry,
+    _dumps,
+    _exit_record,
+    _start_record,
+    replay,
+)
+from command_server.server_config import SignalTranslator
+from command_server.transport import _StreamChannel
+
+
+def journal_replay(records: int) -> dict[str, Any]:
+    """
+    Times rebuilding job state from a journal of start and exit records, as on a restart
+    """
+
+    with tempfile.TemporaryDirectory(prefix="command-server-bench.") as tempdir:
+        path = pathlib.Path(tempdir, "journal.jsonl")
+        with open(path, "w") as file:
+            for i in range(records // 2):
+                entry = JournalEntry(
+                    id=f"{i:08x}-0000-0000-0000-000000000000",
+                    profile="default",
+                    executor_id="00000000-0000-0000-0000-000000000000",
+                    pid=100_000 + i,
+                    cwd="/home/user/src/project",
+                    args=["make", "-C", "build", f"target{i}"],
+                    exit_fifo=f"/run/user/1000/command-server/{i}.job_exit.pipe",
+                    started_at=1_700_000_000.0 + i,
+                    finished=True,
+                    exit_code=0,
+                    resources={"user_cpu": "0.01", "sys_cpu": "0.01"},
+                    finished_at=1_700_000_001.0 + i,
+                )
+                file.write(_dumps(_start_record(entry)))
+                file.write(_dumps(_exit_record(entry)))
+
+        size = path.stat().st_size
+        started = time.perf_counter()
+        entries, num_records = replay(path)
+        elapsed_s = time.perf_counter() - started
+
+    return {
+        "records": num_records,
+        "jobs": len(entries),
+        "file_bytes": size,
+        "elapsed_s": elapsed_s,
+        "records_per_s": num_records / elapsed_s if elapsed_s > 0 else None,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _traced_bytes() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+async def _job_memory(num_jobs: int) -> dict[str, Any]:
+    translator = SignalTranslator({})
+    tracemalloc.start()
+    try:
+        baseline = _traced_bytes()
+
+        # Exits arrive over in-memory channels, so no FIFOs or threads are needed
+        channels = [_StreamChannel(str(i)) for i in range(num_jobs)]
+        jobs = [
+            Job(
+                id=f"{i:08x}-0000-0000-0000-000000000000",
+                profile="default",
+                executor_id="00000000-0000-0000-0000-000000000000",
+                pid=100_000 + i,
+                # Built per job, as decoding each request would
+                cwd="/".join(["/home/user/src", "project"]),
+                args=["make", "-C", "build", f"target{i}"],
+                signal_translator=translator,
+                exit_reader=channel,
+            ) for i, channel in enumerate(channels)
+        ]
+        await asyncio.sleep(0)
+        running = _traced_bytes() - baseline
+
+        for channel in channels:
+            channel.deliver(["0", "user_cpu=0.01", "sys_cpu=0.01", "max_rss_kb=2048"])
+            channel.deliver(None)
+        for job in jobs:
+            await job.wait()
+        del channels
+        exited = _traced_bytes() - baseline
+
+        archived_jobs = [FinishedJob.archive(job) for job in jobs]
+        del jobs
+        archived = _traced_bytes() - baseline
+        assert len(archived_jobs) == num_jobs
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "jobs": num_jobs,
+        "running_bytes_per_job": running / num_jobs,
+        "exited_bytes_per_job": exited / num_jobs,
+        "archived_bytes_per_job": archived / num_jobs,
+    }
+
+
+def job_memory(num_jobs: int) -> dict[str, Any]:
+    """
+    Measures the memory the server holds per job: while it runs, once it exits, and once
+    it has been archived
+    """
+
+    return asyncio.run(_job_memory(num_jobs))
+
+
+MICRO_BENCHMARKS: dict[str, Callable[[int], dict[str, Any]]] = {
+    "journal-replay": journal_replay,
+    "job-memory": job_memory,
+}
@@ -0,0 +1,219 @@
+import asyncio
+import time
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any
+
+from .harness import (
+    BenchServer,
+    FifoStdio,
+    Latencies,
+    RpcError,
+    devnull_stdio,
+    job_args,
+)
+
+
+@dataclass
+class LoadOptions:
+    clients: int = 8
+    jobs_per_client: int = 50
+    arg_bytes: int = 0
+    job_duration_s: float = 0.0
+    # devnull, fifo or capture
+    stdio: str = "devnull"
+    history: int = 10_000
+    list_iterations: int = 20
+    reload_interval_s: float = 0.5
+
+
+@dataclass
+class _Load:
+    start: Latencies
+    wait: Latencies
+    errors: Counter[str]
+    jobs: int = 0
+
+
+async def _run_job(
+    server: BenchServer,
+    options: LoadOptions,
+    name: str,
+    load: _Load,
+    priority: str = "NORMAL",
+) -> None:
+    fifo_stdio: FifoStdio | None = None
+    params: dict[str, Any] = {
+        "priority": priority,
+        "cwd": str(server.dir),
+        "args": job_args(options.job_duration_s, options.arg_bytes),
+        "stdio": devnull_stdio(),
+    }
+    match options.stdio:
+        case "fifo":
+            fifo_stdio = FifoStdio(server.dir, name)
+            params["stdio"] = fifo_stdio.params()
+        case "capture":
+            params["capture"] = True
+
+    job_started = False
+    try:
+        started = time.perf_counter()
+        try:
+            response = await server.client.request("job.start", params)
+        except RpcError:
+            load.errors["job.start"] += 1
+            return
+        job_started = True
+        load.start.record(started)
+
+        waited = time.perf_counter()
+        try:
+            await server.client.request("job.wait", {"id": response["job"]["id"]})
+        except RpcError:
+            load.errors["job.wait"] += 1
+            return
+        load.wait.record(waited)
+        load.jobs += 1
+    finally:
+        if fifo_stdio is not None:
+            if not job_started:
+                # Nothing else will open the FIFOs, so close them from this side
+                await asyncio.to_thread(fifo_stdio.abandon)
+            await fifo_stdio.close()
+
+
+async def _generate_load(
+    server: BenchServer, options: LoadOptions, jobs_per_client: int, priority: str = "NORMAL"
+) -> _Load:
+    load = _Load(Latencies(), Latencies(), Counter())
+
+    async def client(i: int) -> None:
+        for j in range(jobs_per_client):
+            await _run_job(server, options, f"{priority}.{i}.{j}", load, priority)
+
+    await asyncio.gather(*(client(i) for i in range(options.clients)))
+    return load
+
+
+def _load_summary(load: _Load, elapsed_s: float) -> dict[str, Any]:
+    return {
+        "jobs": load.jobs,
+        "errors": dict(load.errors),
+        "elapsed_s": elapsed_s,
+        "throughput_jobs_per_s": load.jobs / elapsed_s if elapsed_s > 0 else None,
+        "start_latency": load.start.summary(),
+        "wait_latency": load.wait.summary(),
+    }
+
+
+async def start_storm(server: BenchServer, options: LoadOptions) -> dict[str, Any]:
+    """
+    Every client starts and waits for jobs back to back
+    """
+
+    async with server.monitor() as monitor:
+        started = time.perf_counter()
+        load = await _generate_load(server, options, options.jobs_per_client)
+        elapsed_s = time.perf_counter() - started
+
+    return _load_summary(load, elapsed_s) | {"server": monitor.summary()}
+
+
+async def list_jobs(server: BenchServer, options: LoadOptions) -> dict[str, Any]:
+    """
+    Builds up a history of finished jobs, then times listing all of them
+    """
+
+    fill_options = LoadOptions(**vars(options) | {"job_duration_s": 0.0, "stdio": "devnull"})
+    started = time.perf_counter()
+    fill = await _generate_load(
+        server, fill_options, -(-options.history // max(1, options.clients))
+    )
+    fill_s = time.perf_counter() - started
+
+    latencies = Latencies()
+    num_jobs = 0
+    async with server.monitor() as monitor:
+        for _ in range(options.list_iterations):
+            started = time.perf_counter()
+            response = await server.client.request(
+                "command_server.list-jobs", {"include_completed": True}
+            )
+            latencies.record(started)
+            num_jobs = len(response["jobs"])
+
+    return {
+        "history_jobs": fill.jobs,
+        "history_fill_s": fill_s,
+        "listed_jobs": num_jobs,
+        "list_latency": latencies.summary(),
+        "server": monitor.summary(),
+    }
+
+
+async def reload_under_load(server: BenchServer, options: LoadOptions) -> dict[str, Any]:
+    """
+    Reloads the executor over and over while clients keep starting jobs
+    """
+
+    reloads = Latencies()
+    reload_errors = 0
+
+    async with server.monitor() as monitor:
+        started = time.perf_counter()
+        load_task = asyncio.create_task(_generate_load(server, options, options.jobs_per_client))
+        while not load_task.done():
+            reload_started = time.perf_counter()
+            try:
+                await server.reload_executor()
+                reloads.record(reload_started)
+            except RpcError:
+                reload_errors += 1
+            await asyncio.wait([load_task], timeout=options.reload_interval_s)
+        load = await load_task
+        elapsed_s = time.perf_counter() - started
+
+    return _load_summary(load, elapsed_s) | {
+        "reload_latency": reloads.summary(),
+        "reload_errors": reload_errors,
+        "server": monitor.summary(),
+    }
+
+
+async def priority_latency(server: BenchServer, options: LoadOptions) -> dict[str, Any]:
+    """
+    Keeps the server saturated with batch jobs, and times interactive starts queued
+    behind them. Needs max_concurrency to be set for anything to queue.
+    """
+
+    batch = LoadOptions(**vars(options) | {"clients": options.clients * 4})
+    interactive = _Load(Latencies(), Latencies(), Counter())
+
+    async def probe(i: int) -> None:
+        for j in range(options.jobs_per_client):
+            await _run_job(server, options, f"interactive.{i}.{j}", interactive, "INTERACTIVE")
+
+    async with server.monitor() as monitor:
+        started = time.perf_counter()
+        batch_task = asyncio.create_task(
+            _generate_load(server, batch, options.jobs_per_client, "BATCH")
+        )
+        await asyncio.gather(*(probe(i) for i in range(options.clients)))
+        batch_load = await batch_task
+        elapsed_s = time.perf_counter() - started
+
+    return {
+        "interactive": _load_summary(interactive, elapsed_s),
+        "batch": _load_summary(batch_load, elapsed_s),
+        "server": monitor.summary(),
+    }
+
+
+SCENARIOS: dict[str, Callable[[BenchServer, LoadOptions], Awaitable[dict[str, Any]]]] = {
+    "start-storm": start_storm,
+    "list-jobs": list_jobs,
+    "reload-under-load": reload_under_load,
+    "priority-latency": priority_latency,
+}
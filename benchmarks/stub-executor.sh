@@ -0,0 +1,19 @@
+#!/bin/sh
+
+# Executor for benchmarks, which runs jobs as-is. Takes the two FIFOs from the server,
+# followed by the loop to use: "shell" (the default) or "python".
+
+LOOP="${3-shell}"
+set -- "$1" "$2"
+
+case "$LOOP" in
+    python)
+        exec python3 "$COMMAND_SERVER_LIB/executor_loop.py" "$@"
+        ;;
+
+    *)
+        run () { "$@" & }
+        set -- run "$@"
+        . "$COMMAND_SERVER_LIB/posix-executor-loop.sh"
+        ;;
+esac
@@ -17,6 +17,11 @@ class Stdio(JsonTryLoadMixin):
     stderr: str
 
 
+class OutputStream(StrEnum):
+    STDOUT = auto()
+    STDERR = auto()
+
+
 class Signal(Enum):
     TERM = Signals.SIGTERM
     INT = Signals.SIGINT
@@ -41,10 +46,19 @@ class ExecutorState(JsonTryLoadMixin):
 @dataclass
 class ExecutorInfo(JsonTryLoadMixin):
     id: str
+    profile: str
     cwd: str
     command: str
     args: list[str]
     state: ExecutorState
+    # Started from a saved environment instead of running the executor's setup
+    from_snapshot: bool = False
+
+
+class JobPriority(StrEnum):
+    INTERACTIVE = auto()
+    NORMAL = auto()
+    BATCH = auto()
 
 
 class JobStatus(StrEnum):
@@ -56,6 +70,15 @@ class JobStatus(StrEnum):
 class JobState(JsonTryLoadMixin):
     status: JobStatus = field(metadata=config(mm_field=fields.Enum(JobStatus)))
     exit_code: int | None
+    timed_out: bool = False
+
+
+@dataclass
+class JobUsage(JsonTryLoadMixin):
+    wall_time_s: float
+    user_cpu_s: float | None
+    sys_cpu_s: float | None
+    max_rss_kb: int | None
 
 
 @dataclass
@@ -65,6 +88,8 @@ class JobInfo(JsonTryLoadMixin):
     cwd: str
     args: list[str]
     state: JobState
+    usage: JobUsage | None = None
+    cached: bool = False
 
 
 @dataclass
@@ -77,6 +102,7 @@ class ExecutorConfigOverrides(JsonTryLoadMixin):
 class ReloadExecutorParams(JsonTryLoadMixin):
     stdio: Stdio
     config_overrides: ExecutorConfigOverrides
+    profile: str | None = None
 
 
 @dataclass
@@ -98,6 +124,7 @@ class CancelReloadResult(JsonTryLoadMixin):
 @dataclass
 class WaitForReloadParams(JsonTryLoadMixin):
     id: str | None
+    profile: str | None = None
 
 
 @dataclass
@@ -110,6 +137,19 @@ class StartJobParams(JsonTryLoadMixin):
     cwd: str
     args: list[str]
     stdio: Stdio
+    profile: str | None = None
+    priority: JobPriority = field(
+        default=JobPriority.NORMAL, metadata=config(mm_field=fields.Enum(JobPriority))
+    )
+    timeout_s: float | None = None
+    kill_after_s: float | None = None
+    capture: bool = False
+    cacheable: bool = False
+    # CPUs the job may run on, its nice value, and its I/O priority class ("idle", or
+    # "be/<level>" or "rt/<level>" with levels 0-7). Unset ones come from the profile.
+    cpu_set: list[int] | None = None
+    nice: int | None = None
+    ioprio: str | None = None
 
 
 @dataclass
@@ -117,6 +157,30 @@ class StartJobResult(JsonTryLoadMixin):
     job: JobInfo
 
 
+@dataclass
+class StartPipelineParams(JsonTryLoadMixin):
+    cwd: str
+    # Each stage's stdout is connected to the next stage's stdin
+    stages: list[list[str]]
+    stdio: Stdio
+    profile: str | None = None
+    priority: JobPriority = field(
+        default=JobPriority.NORMAL, metadata=config(mm_field=fields.Enum(JobPriority))
+    )
+    timeout_s: float | None = None
+    kill_after_s: float | None = None
+    # Applied to every stage, as for job.start
+    cpu_set: list[int] | None = None
+    nice: int | None = None
+    ioprio: str | None = None
+
+
+@dataclass
+class StartPipelineResult(JsonTryLoadMixin):
+    id: str
+    jobs: list[JobInfo]
+
+
 @dataclass
 class SignalJobParams(JsonTryLoadMixin):
     id: str
@@ -136,6 +200,43 @@ class WaitForJobParams(JsonTryLoadMixin):
 @dataclass
 class WaitForJobResult(JsonTryLoadMixin):
     exit_code: int
+    timed_out: bool = False
+    # Every stage's exit code, for pipelines
+    exit_codes: list[int] | None = None
+
+
+@dataclass
+class ReadOutputParams(JsonTryLoadMixin):
+    id: str
+    stream: OutputStream = field(
+        default=OutputStream.STDOUT, metadata=config(mm_field=fields.Enum(OutputStream))
+    )
+    offset: int = 0
+    max_bytes: int = 65536
+    wait: bool = False
+
+
+@dataclass
+class ReadOutputResult(JsonTryLoadMixin):
+    offset: int
+    next_offset: int
+    data_base64: str
+    eof: bool
+
+
+@dataclass
+class AttachJobParams(JsonTryLoadMixin):
+    id: str
+    stdout: str
+    stderr: str
+    stdout_offset: int = 0
+    stderr_offset: int = 0
+
+
+@dataclass
+class AttachJobResult(JsonTryLoadMixin):
+    stdout_offset: int
+    stderr_offset: int
 
 
 @dataclass
@@ -148,6 +249,30 @@ class StopServerResult(JsonTryLoadMixin):
     pass
 
 
+@dataclass
+class ReloadConfigParams(JsonTryLoadMixin):
+    stdio: Stdio | None = None
+
+
+@dataclass
+class ReloadConfigResult(JsonTryLoadMixin):
+    changed: list[str]
+    ignored: list[str]
+    executors: dict[str, ExecutorInfo]
+
+
+@dataclass
+class DumpTraceParams(JsonTryLoadMixin):
+    path: str | None = None
+    clear: bool = False
+
+
+@dataclass
+class DumpTraceResult(JsonTryLoadMixin):
+    path: str
+    num_events: int
+
+
 @dataclass
 class ListJobsParams(JsonTryLoadMixin):
     include_completed: bool
@@ -168,6 +293,122 @@ class ListExecutorsResult(JsonTryLoadMixin):
     executors: dict[str, ExecutorInfo]
 
 
+@dataclass
+class FdUsageParams(JsonTryLoadMixin):
+    pass
+
+
+@dataclass
+class FdUsageResult(JsonTryLoadMixin):
+    open_fds: int
+    limit: int
+    reserve: int
+    # Held by running jobs' exit channels, and by executors' transports
+    jobs: int
+    executors: int
+
+
+@dataclass
+class ConcurrencyParams(JsonTryLoadMixin):
+    pass
+
+
+@dataclass
+class ConcurrencyDecision(JsonTryLoadMixin):
+    # Unix time of the reading
+    at: float
+    # "some" avg10 of each watched resource, in percent
+    pressure: dict[str, float]
+    # increase, decrease or hold
+    action: str
+    limit: float
+    max_running: int
+
+
+@dataclass
+class ConcurrencyResult(JsonTryLoadMixin):
+    # None if starts aren't limited
+    max_running: int | None
+    running: int
+    queued: int
+    # Whether max_running follows pressure, and the controller's latest decisions
+    adaptive: bool
+    decisions: list[ConcurrencyDecision]
+
+
+@dataclass
+class ProfileParams(JsonTryLoadMixin):
+    duration_s: float = 5.0
+    # Of CPU time used by the server
+    interval_s: float = 0.01
+
+
+@dataclass
+class ProfileResult(JsonTryLoadMixin):
+    duration_s: float
+    samples: int
+    # Number of samples per stack, in collapsed form ("module:function;..." from the
+    # outermost frame), as taken by flamegraph.pl and speedscope
+    stacks: dict[str, int]
+
+
+@dataclass
+class MemorySnapshotParams(JsonTryLoadMixin):
+    # How long to trace allocations for, unless tracemalloc is already tracing
+    duration_s: float = 10.0
+    # Number of allocation sites and object types to report
+    limit: int = 20
+
+
+@dataclass
+class AllocationSite(JsonTryLoadMixin):
+    # file:line
+    site: str
+    size_bytes: int
+    count: int
+
+
+@dataclass
+class MemorySnapshotResult(JsonTryLoadMixin):
+    # Of allocations made while tracing which are still alive
+    traced_bytes: int
+    peak_bytes: int
+    sites: list[AllocationSite]
+    # Number of objects by type, for the most common types and every server type
+    objects: dict[str, int]
+
+
+@dataclass
+class LoopLagParams(JsonTryLoadMixin):
+    # Clears the histogram and stalls once they are returned
+    reset: bool = False
+
+
+@dataclass
+class LoopStall(JsonTryLoadMixin):
+    # Unix time the stall was noticed
+    at: float
+    # How late the monitor's timer ran
+    lag_s: float
+    # The task the loop was stuck in, and its stack ("file:line in function", outermost
+    # first). Only known if the stall lasted long enough to be caught while it happened.
+    task: str | None
+    stack: list[str]
+
+
+@dataclass
+class LoopLagResult(JsonTryLoadMixin):
+    enabled: bool
+    interval_s: float
+    threshold_s: float
+    samples: int
+    mean_s: float
+    max_s: float
+    # Number of samples by lag, keyed by each bucket's upper bound in seconds
+    histogram: dict[str, int]
+    stalls: list[LoopStall]
+
+
 class JobMethod:
     START_JOB = MethodDescriptor(
         name="job.start",
@@ -175,6 +416,12 @@ class JobMethod:
         result_converter=JsonTryConverter(StartJobResult),
         error_converter=ERROR_CONVERTER,
     )
+    START_PIPELINE = MethodDescriptor(
+        name="job.start-pipeline",
+        params_converter=JsonTryConverter(StartPipelineParams),
+        result_converter=JsonTryConverter(StartPipelineResult),
+        error_converter=ERROR_CONVERTER,
+    )
     SIGNAL_JOB = MethodDescriptor(
         name="job.signal",
         params_converter=JsonTryConverter(SignalJobParams),
@@ -187,6 +434,18 @@ class JobMethod:
         result_converter=JsonTryConverter(WaitForJobResult),
         error_converter=ERROR_CONVERTER,
     )
+    READ_OUTPUT = MethodDescriptor(
+        name="job.read-output",
+        params_converter=JsonTryConverter(ReadOutputParams),
+        result_converter=JsonTryConverter(ReadOutputResult),
+        error_converter=ERROR_CONVERTER,
+    )
+    ATTACH_JOB = MethodDescriptor(
+        name="job.attach",
+        params_converter=JsonTryConverter(AttachJobParams),
+        result_converter=JsonTryConverter(AttachJobResult),
+        error_converter=ERROR_CONVERTER,
+    )
 
     RELOAD_EXECUTOR = MethodDescriptor(
         name="executor.reload",
@@ -213,6 +472,18 @@ class JobMethod:
         result_converter=JsonTryConverter(StopServerResult),
         error_converter=ERROR_CONVERTER,
     )
+    RELOAD_CONFIG = MethodDescriptor(
+        name="command_server.reload-config",
+        params_converter=JsonTryConverter(ReloadConfigParams),
+        result_converter=JsonTryConverter(ReloadConfigResult),
+        error_converter=ERROR_CONVERTER,
+    )
+    DUMP_TRACE = MethodDescriptor(
+        name="command_server.dump-trace",
+        params_converter=JsonTryConverter(DumpTraceParams),
+        result_converter=JsonTryConverter(DumpTraceResult),
+        error_converter=ERROR_CONVERTER,
+    )
     LIST_JOBS = MethodDescriptor(
         name="command_server.list-jobs",
         params_converter=JsonTryConverter(ListJobsParams),
@@ -225,3 +496,33 @@ class JobMethod:
         result_converter=JsonTryConverter(ListExecutorsResult),
         error_converter=ERROR_CONVERTER,
     )
+    FD_USAGE = MethodDescriptor(
+        name="command_server.fd-usage",
+        params_converter=JsonTryConverter(FdUsageParams),
+        result_converter=JsonTryConverter(FdUsageResult),
+        error_converter=ERROR_CONVERTER,
+    )
+    CONCURRENCY = MethodDescriptor(
+        name="command_server.concurrency",
+        params_converter=JsonTryConverter(ConcurrencyParams),
+        result_converter=JsonTryConverter(ConcurrencyResult),
+        error_converter=ERROR_CONVERTER,
+    )
+    PROFILE = MethodDescriptor(
+        name="command_server.profile",
+        params_converter=JsonTryConverter(ProfileParams),
+        result_converter=JsonTryConverter(ProfileResult),
+        error_converter=ERROR_CONVERTER,
+    )
+    MEMORY_SNAPSHOT = MethodDescriptor(
+        name="command_server.memory-snapshot",
+        params_converter=JsonTryConverter(MemorySnapshotParams),
+        result_converter=JsonTryConverter(MemorySnapshotResult),
+        error_converter=ERROR_CONVERTER,
+    )
+    LOOP_LAG = MethodDescriptor(
+        name="command_server.loop-lag",
+        params_converter=JsonTryConverter(LoopLagParams),
+        result_converter=JsonTryConverter(LoopLagResult),
+        error_converter=ERROR_CONVERTER,
+    )
@@ -0,0 +1,90 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from .server_config import CacheConfig
+
+_LOGGER = logging.getLogger("cache")
+
+# (executor id, cwd, args)
+CacheKey = tuple[str, str, tuple[str, ...]]
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    exit_code: int
+    stdout: bytes
+    stderr: bytes
+    stored_at: float
+
+    @property
+    def size(self) -> int:
+        return len(self.stdout) + len(self.stderr)
+
+
+class ResultCache:
+    """
+    Results of cacheable jobs, evicted least recently used first once there are more than
+    max_entries or the output adds up to more than max_bytes. Entries older than ttl_s are
+    treated as missing.
+    """
+
+    def __init__(self, config: CacheConfig) -> None:
+        self.config = config
+        self._entries: OrderedDict[CacheKey, CachedResult] = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: CacheKey) -> CachedResult | None:
+        result = self._entries.get(key)
+        if result is not None and time.monotonic() - result.stored_at > self.config.ttl_s:
+            self._remove(key)
+            result = None
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: CacheKey, exit_code: int, stdout: bytes, stderr: bytes) -> None:
+        result = CachedResult(exit_code, stdout, stderr, time.monotonic())
+        if result.size > self.config.max_bytes:
+            _LOGGER.debug("Not caching %s, its output is %d bytes", key, result.size)
+            return
+
+        self._remove(key)
+        self._entries[key] = result
+        self._size += result.size
+        self.trim()
+
+    def trim(self) -> None:
+        """
+        Evicts entries until the cache is within its limits
+        """
+
+        while self._entries and (
+            len(self._entries) > self.config.max_entries or self._size > self.config.max_bytes
+        ):
+            _, result = self._entries.popitem(last=False)
+            self._size -= result.size
+
+    def remove_executor(self, executor_id: str) -> None:
+        """
+        Drops the results of one executor's jobs
+        """
+
+        for key in [key for key in self._entries if key[0] == executor_id]:
+            self._remove(key)
+
+    def _remove(self, key: CacheKey) -> None:
+        result = self._entries.pop(key, None)
+        if result is not None:
+            self._size -= result.size
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import pathlib
+from dataclasses import dataclass
+
+from result import Err, Ok, Result
+
+from .server_config import CgroupConfig
+
+_LOGGER = logging.getLogger("cgroups")
+
+
+def _create(config: CgroupConfig, path: pathlib.Path, pid: int) -> None:
+    path.mkdir()
+    try:
+        if config.cpu_max is not None:
+            path.joinpath("cpu.max").write_text(config.cpu_max)
+        if config.memory_max is not None:
+            path.joinpath("memory.max").write_text(config.memory_max)
+        path.joinpath("cgroup.procs").write_text(str(pid))
+    except Exception:
+        path.rmdir()
+        raise
+
+
+def _collect(path: pathlib.Path) -> dict[str, str]:
+    resources: dict[str, str] = dict()
+    try:
+        cpu_stat = dict(line.split() for line in path.joinpath("cpu.stat").read_text().splitlines())
+        resources["user_cpu"] = str(int(cpu_stat["user_usec"]) / 1_000_000)
+        resources["sys_cpu"] = str(int(cpu_stat["system_usec"]) / 1_000_000)
+    except (OSError, KeyError, ValueError) as e:
+        _LOGGER.warning("Could not read cpu.stat for %s: %r", path, e)
+
+    try:
+        resources["max_rss_kb"] = str(int(path.joinpath("memory.peak").read_text()) // 1024)
+    except (OSError, ValueError):
+        # memory.peak is only available on newer kernels
+        pass
+
+    try:
+        path.rmdir()
+    except OSError as e:
+        _LOGGER.warning("Could not remove cgroup %s: %r", path, e)
+
+    return resources
+
+
+@dataclass
+class JobCgroup:
+    path: pathlib.Path
+
+    async def collect(self) -> dict[str, str]:
+        """
+        Reads the final resource usage of the cgroup, then removes it
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, _collect, self.path)
+
+
+async def make_job_cgroup(
+    config: CgroupConfig, job_id: str, pid: int
+) -> Result[JobCgroup, OSError]:
+    path = config.parent.joinpath(f"job-{job_id}")
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, _create, config, path, pid)
+        return Ok(JobCgroup(path))
+    except ProcessLookupError as e:
+        # Short jobs can be done before they are attached
+        _LOGGER.debug("Job %d exited before joining cgroup %s", pid, path)
+        return Err(e)
+    except OSError as e:
+        _LOGGER.error("Failed to create cgroup %s for %d: %r", path, pid, e)
+        return Err(e)
@@ -11,27 +11,41 @@ from functools import partial
 
 import jrpc
 
-from . import server_config
+from . import fds, server_config, sharding, workers
+from .files import track_connection
 from .impl import JobApiImpl
+from .logs import configure_logging, stop_logging
 from .server_config import CommandServerConfig
 
 _LOGGER = logging.getLogger(__name__)
 
 
 async def run_command_server(config: CommandServerConfig, term_future: Future[int]) -> int:
-    logging.basicConfig(level=config.log_level, filename=config.log_file)
+    configure_logging(config)
 
-    _LOGGER.error(f"=== Starting server instance {os.getpid()} ===")
+    _LOGGER.error("=== Starting server instance %d ===", os.getpid())
+    fds.raise_limit()
 
     stop_event = Event()
 
     impl = JobApiImpl(config, stop_event)
-    connection_callback = jrpc.connection.client_connected_callback(impl.method_set())
+    if config.worker is not None:
+        return await _run_worker(config, impl, stop_event, term_future)
+
+    connection_callback = track_connection(
+        jrpc.connection.client_connected_callback(impl.method_set())
+    )
 
     server = await asyncio.start_unix_server(connection_callback, path=config.socket_path)
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGHUP, partial(_handle_reload_signal, impl=impl)
+    )
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGUSR1, partial(_handle_trace_signal, impl=impl)
+    )
     try:
         async with impl:
-            _LOGGER.info(f"Server listening on {config.socket_path}")
+            _LOGGER.info("Server listening on %s", config.socket_path)
             try:
                 await asyncio.wait(
                     [asyncio.create_task(stop_event.wait()), term_future],
@@ -52,11 +66,49 @@ async def run_command_server(config: CommandServerConfig, term_future: Future[in
             pass
 
 
+async def _run_worker(
+    config: CommandServerConfig, impl: JobApiImpl, stop_event: Event, term_future: Future[int]
+) -> int:
+    assert config.worker is not None
+
+    workers.set_worker(config.worker)
+    channel = workers.WorkerChannel.from_env()
+    api = sharding.ShardedJobApi(impl, config.worker, config.workers, channel.request_stop)
+    connection_callback = track_connection(
+        jrpc.connection.client_connected_callback(api.method_set())
+    )
+
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGHUP, partial(_handle_reload_signal, impl=impl)
+    )
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGUSR1, partial(_handle_trace_signal, impl=impl)
+    )
+    async with impl:
+        peer_server = await sharding.serve_peers(impl, config.worker)
+        _LOGGER.info("Worker %d serving connections", config.worker)
+        try:
+            await asyncio.wait(
+                [
+                    asyncio.create_task(stop_event.wait()),
+                    asyncio.create_task(channel.serve(connection_callback)),
+                    term_future,
+                ],
+                return_when=FIRST_COMPLETED,
+            )
+        finally:
+            _LOGGER.info("Worker %d shutting down", config.worker)
+            sharding.stop_serving_peers(peer_server, config.worker)
+
+        if term_future.done():
+            return term_future.result()
+        return 0
+
+
 _TERMINATING_SIGNALS = [
     signal.SIGTERM,
     signal.SIGINT,
     signal.SIGQUIT,
-    signal.SIGHUP,
 ]
 
 
@@ -64,10 +116,20 @@ def _handle_terminating_signals(
     signal: int,
     future: asyncio.Future[int],
 ):
-    _LOGGER.info(f"Received {signal}, closing the server")
+    _LOGGER.info("Received %s, closing the server", signal)
     future.set_result(signal)
 
 
+def _handle_reload_signal(impl: JobApiImpl):
+    _LOGGER.info("Received SIGHUP, reloading config")
+    impl.request_config_reload()
+
+
+def _handle_trace_signal(impl: JobApiImpl):
+    _LOGGER.info("Received SIGUSR1, dumping trace")
+    impl.request_trace_dump()
+
+
 async def main(config: CommandServerConfig) -> int:
     term_future: asyncio.Future[int] = asyncio.Future()
     for term_signal in _TERMINATING_SIGNALS:
@@ -80,10 +142,19 @@ async def main(config: CommandServerConfig) -> int:
             ),
         )
 
+    if config.workers > 1 and config.worker is None:
+        configure_logging(config)
+        _LOGGER.error("=== Starting server instance %d ===", os.getpid())
+        return await workers.run_front(config, term_future)
+
     return await run_command_server(config, term_future)
 
 
 if __name__ == "__main__":
     config = server_config.parse_config(sys.argv)
     os.environ["COMMAND_SERVER_LIB"] = str(pathlib.Path(__file__).parent.joinpath("lib"))
-    sys.exit(asyncio.run(main(config)))
+    try:
+        exit_code = asyncio.run(main(config))
+    finally:
+        stop_logging()
+    sys.exit(exit_code)
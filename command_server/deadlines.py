@@ -0,0 +1,103 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+_LOGGER = logging.getLogger("deadlines")
+
+
+@dataclass(order=True)
+class Deadline:
+    when: float
+    seq: int
+    callback: Callable[[], None] | None = field(compare=False)
+    # Told when a pending deadline is cancelled; cleared once it fires
+    on_cancel: Callable[[], None] | None = field(default=None, compare=False, repr=False)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.callback is None
+
+    def cancel(self) -> None:
+        # Drop the callback right away, along with whatever it holds onto
+        self.callback = None
+        if self.on_cancel is not None:
+            on_cancel, self.on_cancel = self.on_cancel, None
+            on_cancel()
+
+
+class DeadlineQueue:
+    """
+    Runs callbacks at deadlines (in event loop time) using a single heap and a single
+    loop timer armed for the earliest deadline, rather than a timer or task per deadline.
+    Cancelled deadlines are dropped lazily when they reach the top of the heap, or all at
+    once when they make up most of it.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[Deadline] = []
+        self._cancelled = 0
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> Deadline:
+        loop = asyncio.get_running_loop()
+        deadline = Deadline(
+            loop.time() + delay, next(self._seq), callback, self._deadline_cancelled
+        )
+        heapq.heappush(self._heap, deadline)
+        if self._heap[0] is deadline:
+            self._arm(loop)
+        return deadline
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._heap.clear()
+        self._cancelled = 0
+
+    def _deadline_cancelled(self) -> None:
+        self._cancelled += 1
+        if self._cancelled * 2 > len(self._heap):
+            # The timer may stay armed for a dropped deadline, which just fires early
+            self._heap = [deadline for deadline in self._heap if not deadline.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+
+    def _pop(self) -> Deadline:
+        deadline = heapq.heappop(self._heap)
+        if deadline.cancelled:
+            self._cancelled -= 1
+        deadline.on_cancel = None
+        return deadline
+
+    def _arm(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._heap and self._heap[0].cancelled:
+            self._pop()
+
+        if self._heap:
+            self._timer = loop.call_at(self._heap[0].when, self._fire)
+
+    def _fire(self) -> None:
+        self._timer = None
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        while self._heap and self._heap[0].when <= now:
+            callback = self._pop().callback
+            if callback is None:
+                continue
+            try:
+                callback()
+            except Exception as e:
+                _LOGGER.error("Deadline callback failed", exc_info=e)
+        self._arm(loop)
@@ -21,6 +21,15 @@ class JobApiErrorCode(IntEnum):
     FILE_ERROR = 33007
     JOB_START_FAILED = 33008
     INVALID_EXECUTOR_CONFIG = 33009
+    INVALID_SERVER_CONFIG = 33010
+    PROFILE_NOT_FOUND = 33011
+    OUTPUT_NOT_CAPTURED = 33012
+    WORKER_NOT_RUNNING = 33013
+    INVALID_PIPELINE = 33014
+    FD_BUDGET_EXHAUSTED = 33015
+    INVALID_SCHEDULING = 33016
+    PROFILING_FAILED = 33017
+    INVALID_TIMEOUT = 33018
 
 
 _registry_by_code: dict[int, Callable[[ParsedJson], Any]] = {}
@@ -201,3 +210,113 @@ register_error_type(
     "Executor config was invalid",
     InvalidExecutorConfig,
 )
+
+
+@dataclass
+class InvalidServerConfig(JsonTryLoadMixin):
+    detailed_message: str
+
+
+register_error_type(
+    JobApiErrorCode.INVALID_SERVER_CONFIG,
+    "Server config was invalid",
+    InvalidServerConfig,
+)
+
+
+@dataclass
+class ProfileNotFound(JsonTryLoadMixin):
+    profile: str
+
+
+register_error_type(
+    JobApiErrorCode.PROFILE_NOT_FOUND,
+    "Executor profile not found",
+    ProfileNotFound,
+)
+
+
+@dataclass
+class OutputNotCaptured(JsonTryLoadMixin):
+    id: str
+
+
+register_error_type(
+    JobApiErrorCode.OUTPUT_NOT_CAPTURED,
+    "Job output was not captured",
+    OutputNotCaptured,
+)
+
+
+@dataclass
+class WorkerNotRunning(JsonTryLoadMixin):
+    index: int
+
+
+register_error_type(
+    JobApiErrorCode.WORKER_NOT_RUNNING,
+    "Worker process not running",
+    WorkerNotRunning,
+)
+
+
+@dataclass
+class InvalidPipeline(JsonTryLoadMixin):
+    reason: str
+
+
+register_error_type(
+    JobApiErrorCode.INVALID_PIPELINE,
+    "Invalid pipeline",
+    InvalidPipeline,
+)
+
+
+@dataclass
+class FdBudgetExhausted(JsonTryLoadMixin):
+    open_fds: int
+    limit: int
+    reserve: int
+
+
+register_error_type(
+    JobApiErrorCode.FD_BUDGET_EXHAUSTED,
+    "File descriptor budget exhausted",
+    FdBudgetExhausted,
+)
+
+
+@dataclass
+class InvalidScheduling(JsonTryLoadMixin):
+    reason: str
+
+
+register_error_type(
+    JobApiErrorCode.INVALID_SCHEDULING,
+    "Invalid scheduling attributes",
+    InvalidScheduling,
+)
+
+
+@dataclass
+class ProfilingFailed(JsonTryLoadMixin):
+    reason: str
+
+
+register_error_type(
+    JobApiErrorCode.PROFILING_FAILED,
+    "Profiling failed",
+    ProfilingFailed,
+)
+
+
+@dataclass
+class InvalidTimeout(JsonTryLoadMixin):
+    reason: str
+
+
+register_error_type(
+    JobApiErrorCode.INVALID_TIMEOUT,
+    "Invalid timeout",
+    InvalidTimeout,
+)
@@ -2,7 +2,6 @@ import asyncio
 import logging
 import os
 import pathlib
-import uuid
 from dataclasses import dataclass
 from pathlib import Path
 from signal import Signals
@@ -10,24 +9,30 @@ from typing import Self
 
 from result import Err, Ok, Result
 
-from . import token_io
+from . import snapshots, tracing, workers
 from .api import ExecutorInfo, ExecutorState, ExecutorStatus, Stdio
 from .errors import ExecutorNotRunning, JobStartFailed
 from .files import (
-    AsyncFileList,
     FifoCreateFailed,
     FileOpenFailed,
     Mode,
-    TempFifo,
-    mkfifo,
+    SealedFile,
+    make_sealed_file,
     try_open_multiple,
 )
 from .job import Job
 from .server_config import ExecutorConfig, SignalTranslator
-from .token_io import TokenReader, TokenWriter
+from .transport import ExecutorTransport, JobChannel, TransportFailed, make_transport
 
 _LOGGER = logging.getLogger("executor")
 
+
+def _control_request(args: list[str]) -> list[str]:
+    # Requests with no working dir are handled by the executor loop itself, and answered
+    # with 0 on success. With no args, it's a ping.
+    return ["", "", "", "", "", str(len(args))] + args
+
+
 os.environ["COMMAND_SERVER_LIB"] = str(Path(__file__).parent.joinpath("lib"))
 
 
@@ -39,25 +44,28 @@ class ExecutorNeverReady:
 @dataclass
 class ExecutorLoadFailed:
     exit_code: int
-    cause: FileOpenFailed | ExecutorNeverReady
+    cause: FileOpenFailed | TransportFailed | ExecutorNeverReady
 
 
 @dataclass
 class Executor:
     id: str
+    profile: str
     cwd: pathlib.Path
     command: str
     args: list[str]
     subprocess: asyncio.subprocess.Process
-    stdio_files: AsyncFileList
     signal_translator: SignalTranslator
-    read_fifo: TempFifo
-    write_fifo: TempFifo
+    transport: ExecutorTransport
+    snapshot_inputs: list[Path] | None = None
+    from_snapshot: bool = False
+    arg_file_bytes: int | None = None
 
     def __post_init__(self) -> None:
-        self._reader: TokenReader | None = None
-        self._writer: TokenWriter | None = None
         self._jobs: dict[str, Job] = dict()
+        # The executor handles one request at a time, and answers them in order
+        self._request_lock = asyncio.Lock()
+        self._signal_tasks: set[asyncio.Task[None]] = set()
 
         self._init_task = asyncio.create_task(self._lazy_init())
         self._teardown_task = asyncio.create_task(self._lazy_teardown())
@@ -85,50 +93,148 @@ class Executor:
     def status(self) -> ExecutorStatus:
         return self.state.status
 
+    @property
+    def config(self) -> ExecutorConfig:
+        return ExecutorConfig(
+            profile=self.profile,
+            cwd=self.cwd,
+            command=self.command,
+            args=self.args,
+            signal_translator=self.signal_translator,
+            snapshot_inputs=self.snapshot_inputs,
+            transport=self.transport.config,
+            arg_file_bytes=self.arg_file_bytes,
+        )
+
+    @property
+    def held_fds(self) -> int:
+        return self.transport.held_fds
+
     @property
     def info(self) -> ExecutorInfo:
         return ExecutorInfo(
             id=self.id,
+            profile=self.profile,
             cwd=str(self.cwd),
             command=self.command,
             args=self.args,
             state=self.state,
+            from_snapshot=self.from_snapshot,
         )
 
+    async def _arg_tokens(self, args: list[str]) -> tuple[list[str], list[SealedFile]]:
+        """
+        The num-args and arg tokens of a request. Args of at least arg_file_bytes go in
+        sealed in-memory files, which the executor reads directly, rather than being
+        escaped and pushed through the transport. Their indices follow the number of args,
+        e.g. 3:0,2, and their tokens are the paths of the files.
+        """
+
+        threshold = self.arg_file_bytes
+        if threshold is None or not self.transport.local:
+            return [str(len(args))] + args, []
+
+        tokens: list[str] = []
+        indices: list[str] = []
+        files: list[SealedFile] = []
+        for index, arg in enumerate(args):
+            # A char is at most 4 bytes, so most args can skip the encode
+            if len(arg) * 4 >= threshold and len(data := arg.encode()) >= threshold:
+                match await make_sealed_file(data):
+                    case Ok(file):
+                        files.append(file)
+                        indices.append(str(index))
+                        tokens.append(file.path)
+                        continue
+                    case Err(e):
+                        _LOGGER.warning(
+                            "Failed to pass arg %d in a file, sending it inline: %r",
+                            index,
+                            e,
+                            extra={"executor_id": self.id},
+                        )
+            tokens.append(arg)
+
+        num_args = f"{len(args)}:{','.join(indices)}" if indices else str(len(args))
+        return [num_args] + tokens, files
+
     async def start_job(
         self, cwd: str, args: list[str], stdio: Stdio
     ) -> Result[Job, FifoCreateFailed | FileOpenFailed | ExecutorNotRunning | JobStartFailed]:
-        if self.status != ExecutorStatus.RUNNING or self._reader is None or self._writer is None:
+        if self.status != ExecutorStatus.RUNNING:
             return Err(ExecutorNotRunning())
 
-        match await mkfifo("job_exit"):
-            case Ok(exit_fifo):
+        match await self.transport.open_job_channel():
+            case Ok(exit_channel):
                 pass
             case Err() as err:
                 return err
 
-        _LOGGER.info(f"Starting job: {cwd=}, {stdio=}, {exit_fifo.path}, {args=}")
-
-        await self._writer.write(
-            [
-                str(cwd),
-                stdio.stdin,
-                stdio.stdout,
-                stdio.stderr,
-                str(exit_fifo.path),
-                str(len(args)),
-            ]
-            + args
+        arg_tokens, arg_files = await self._arg_tokens(args)
+        try:
+            return await self._send_job(cwd, args, stdio, exit_channel, arg_tokens)
+        finally:
+            # The executor has read them by the time it answers
+            for file in arg_files:
+                file.close()
+
+    async def _send_job(
+        self,
+        cwd: str,
+        args: list[str],
+        stdio: Stdio,
+        exit_channel: JobChannel,
+        arg_tokens: list[str],
+    ) -> Result[Job, FifoCreateFailed | FileOpenFailed | ExecutorNotRunning | JobStartFailed]:
+        _LOGGER.info(
+            "Starting job: cwd=%r, stdio=%r, %s, args=%r",
+            cwd,
+            stdio,
+            exit_channel.request_token,
+            args,
+            extra={"executor_id": self.id},
         )
 
-        match await token_io.open_pipe_reader(exit_fifo):
-            case Ok(exit_reader):
-                pass
-            case Err() as err:
-                await exit_fifo.unlink()
-                return err
-
-        match await self._reader.read_int():
+        async with self._request_lock:
+            try:
+                with (
+                    tracing.span("executor.write_request", executor_id=self.id)
+                    if tracing.TRACER.enabled
+                    else tracing.NULL_SPAN
+                ):
+                    await self.transport.send(
+                        [
+                            str(cwd),
+                            stdio.stdin,
+                            stdio.stdout,
+                            stdio.stderr,
+                            exit_channel.request_token,
+                        ]
+                        + arg_tokens
+                    )
+            except OSError as e:
+                # The executor exited, and the teardown hasn't caught up yet
+                _LOGGER.warning(
+                    "Failed to send job to executor: %r", e, extra={"executor_id": self.id}
+                )
+                await exit_channel.discard()
+                return Err(ExecutorNotRunning())
+
+            match await exit_channel.open():
+                case Ok(exit_reader):
+                    pass
+                case Err() as err:
+                    return err
+
+            # Covers the executor loop picking up the request and spawning the job
+            with (
+                tracing.span("executor.read_pid", executor_id=self.id)
+                if tracing.TRACER.enabled
+                else tracing.NULL_SPAN
+            ):
+                pid_result = await self.transport.read_response()
+
+        match pid_result:
             case Ok(pid):
                 pass
             case Err():
@@ -137,16 +243,56 @@ class Executor:
 
         return Ok(
             Job(
-                id=str(uuid.uuid4()),
+                id=workers.new_id(),
+                profile=self.profile,
                 executor_id=self.id,
                 cwd=cwd,
                 pid=pid,
                 args=args,
                 exit_reader=exit_reader,
                 signal_translator=self.signal_translator,
+                send_signal=os.kill if self.transport.local else self._send_signal,
             )
         )
 
+    async def _control(self, args: list[str], timeout_s: float | None = None) -> bool:
+        if self.status != ExecutorStatus.RUNNING:
+            return False
+
+        async with self._request_lock:
+            # Only the executor's answer is timed, not waiting for other requests' answers
+            try:
+                async with asyncio.timeout(timeout_s):
+                    await self.transport.send(_control_request(args))
+                    return await self.transport.read_response() == Ok(0)
+            except (TimeoutError, OSError):
+                return False
+
+    async def ping(self, timeout_s: float) -> bool:
+        """
+        Checks that the executor is still answering requests. While another request is in
+        flight the executor is busy with it, so the ping is skipped until the next one.
+        """
+
+        if self._request_lock.locked():
+            return True
+        return await self._control([], timeout_s)
+
+    def _send_signal(self, pid: int, sig: int) -> None:
+        # The job isn't in our pid namespace, so the executor loop has to send it
+        async def send() -> None:
+            if not await self._control(["signal", str(pid), str(sig)]):
+                _LOGGER.warning(
+                    "Executor failed to send signal %d to %d",
+                    sig,
+                    pid,
+                    extra={"executor_id": self.id},
+                )
+
+        task = asyncio.create_task(send())
+        self._signal_tasks.add(task)
+        task.add_done_callback(self._signal_tasks.discard)
+
     async def wait_ready(self) -> Result[None, int]:
         await asyncio.wait(
             [self._init_task, self._teardown_task],
@@ -163,7 +309,11 @@ class Executor:
 
     async def cleanup(self, signal: Signals = Signals.SIGTERM, kill_jobs: bool = False) -> int:
         if self.status != ExecutorStatus.CLOSED:
-            self.subprocess.send_signal(signal)
+            try:
+                self.subprocess.send_signal(signal)
+            except ProcessLookupError:
+                # Already exited, and the teardown is catching up
+                pass
 
         async with asyncio.TaskGroup() as tg:
             exit_task = tg.create_task(self.wait_closed())
@@ -180,29 +330,18 @@ class Executor:
         await self.cleanup(kill_jobs=True)
 
     async def _lazy_init(self) -> Result[None, ExecutorLoadFailed]:
-        match await token_io.open_pipe_reader(self.read_fifo):
-            case Ok(reader):
-                self._reader = reader
-            case Err(file_open_error):
-                return Err(
-                    ExecutorLoadFailed(
-                        exit_code=await self.cleanup(),
-                        cause=file_open_error,
-                    )
-                )
-
-        match await token_io.open_pipe_writer(self.write_fifo):
-            case Ok(writer):
-                self._writer = writer
-            case Err(file_open_error):
+        match await self.transport.connect():
+            case Ok():
+                pass
+            case Err(connect_error):
                 return Err(
                     ExecutorLoadFailed(
                         exit_code=await self.cleanup(),
-                        cause=file_open_error,
+                        cause=connect_error,
                     )
                 )
 
-        ready_status = (await self._reader.read_int()).unwrap_or(None)
+        ready_status = (await self.transport.read_response()).unwrap_or(None)
         if ready_status == 0:
             return Ok(None)
 
@@ -215,66 +354,85 @@ class Executor:
 
     async def _lazy_teardown(self) -> int:
         exit_code = await self.subprocess.wait()
-
-        async with asyncio.TaskGroup() as tg:
-            if self._writer is not None:
-                tg.create_task(self._writer.close())
-            if self._reader is not None:
-                tg.create_task(self._reader.close())
-
+        await self.transport.close()
         return exit_code
 
 
 async def make_executor(
-    config: ExecutorConfig, stdio: Stdio
-) -> Result[Executor, FileOpenFailed | FifoCreateFailed]:
+    config: ExecutorConfig,
+    stdio: Stdio,
+    open_timeout_s: float | None = None,
+    abort: asyncio.Event | None = None,
+) -> Result[Executor, FileOpenFailed | FifoCreateFailed | TransportFailed]:
     match await try_open_multiple(
-        (Path(stdio.stdin), Mode.R), (Path(stdio.stdout), Mode.W), (Path(stdio.stderr), Mode.W)
+        (Path(stdio.stdin), Mode.R),
+        (Path(stdio.stdout), Mode.W),
+        (Path(stdio.stderr), Mode.W),
+        timeout_s=open_timeout_s,
+        abort=abort,
+        blocking=True,
     ):
         case Ok(stdio_files):
             pass
         case Err() as err:
             return err
 
-    match await mkfifo("executor_reader"):
-        case Ok(read_fifo):
+    match await make_transport(config.transport):
+        case Ok(transport):
             pass
         case Err() as err:
             await stdio_files.close_all()
             return err
 
-    match await mkfifo("executor_writer"):
-        case Ok(write_fifo):
-            pass
-        case Err() as err:
-            async with asyncio.TaskGroup() as tg:
-                tg.create_task(stdio_files.close_all())
-                tg.create_task(read_fifo.unlink())
-            return err
-
-    _LOGGER.debug(f"{config.command} {write_fifo.path} {read_fifo.path} {config.args}")
-
-    subprocess = await asyncio.subprocess.create_subprocess_exec(
-        config.command,
-        str(write_fifo.path),
-        str(read_fifo.path),
-        *config.args,
-        cwd=config.cwd,
-        stdin=stdio_files.files[0].fd,
-        stdout=stdio_files.files[1].fd,
-        stderr=stdio_files.files[2].fd,
-    )
+    command = [config.command, *transport.executor_args, *config.args]
+    env: dict[str, str] | None = None
+    from_snapshot = False
+    if config.snapshot_inputs is not None and not snapshots.uses_python_loop(config):
+        # A restored executor would run jobs in the Python loop instead of the command
+        _LOGGER.warning(
+            "Not snapshotting profile %s: only the bundled Python executor loop can be"
+            " restored, not %s",
+            config.profile,
+            config.command,
+        )
+    elif config.snapshot_inputs is not None:
+        snapshot = await snapshots.find_snapshot(config)
+        if snapshot.exists:
+            command = snapshot.restore_command(transport.executor_args)
+            from_snapshot = True
+        else:
+            env = snapshot.save_env()
+
+    _LOGGER.debug("%r", command)
+
+    try:
+        subprocess = await asyncio.subprocess.create_subprocess_exec(
+            *command,
+            cwd=config.cwd,
+            env=env,
+            stdin=stdio_files.files[0].fd,
+            stdout=stdio_files.files[1].fd,
+            stderr=stdio_files.files[2].fd,
+        )
+    except BaseException:
+        await transport.close()
+        raise
+    finally:
+        # The executor has its own copies
+        await stdio_files.close_all()
 
     return Ok(
         Executor(
-            id=str(uuid.uuid4()),
+            id=workers.new_id(),
+            profile=config.profile,
             cwd=config.cwd,
             command=config.command,
             args=config.args,
-            stdio_files=stdio_files,
             signal_translator=config.signal_translator,
-            read_fifo=read_fifo,
-            write_fifo=write_fifo,
+            transport=transport,
             subprocess=subprocess,
+            snapshot_inputs=config.snapshot_inputs,
+            from_snapshot=from_snapshot,
+            arg_file_bytes=config.arg_file_bytes,
         )
     )
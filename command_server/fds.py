@@ -0,0 +1,71 @@
+import logging
+import os
+import resource
+
+from result import Err, Ok, Result
+
+from .errors import FdBudgetExhausted
+
+_LOGGER = logging.getLogger("fds")
+
+# Most fds a single job start holds: its exit FIFO, plus both ends of the stdout and stderr
+# FIFOs if its output is captured
+START_FDS = 5
+
+
+def raise_limit() -> int:
+    """
+    Raises the soft RLIMIT_NOFILE to the hard limit, returning the new soft limit
+    """
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft >= hard:
+        return soft
+
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError) as e:
+        _LOGGER.warning("Failed to raise the fd limit from %d to %d: %r", soft, hard, e)
+        return soft
+
+    _LOGGER.info("Raised the fd limit from %d to %d", soft, hard)
+    return hard
+
+
+def limit() -> int:
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def open_fds() -> int:
+    """
+    Number of fds the server has open, including client connections and everything else
+    it doesn't track itself
+    """
+
+    # Only reads procfs, so it doesn't block. The listing's own fd is in the count.
+    return len(os.listdir("/proc/self/fd")) - 1
+
+
+class FdBudget:
+    """
+    Keeps job starts from using the fds the server needs to keep working, e.g. to accept
+    connections and write its journal, so that they fail cleanly rather than with EMFILE
+    somewhere along the way
+    """
+
+    def __init__(self, reserve: int) -> None:
+        self.reserve = reserve
+
+    def check(self, num_starts: int = 1) -> Result[None, FdBudgetExhausted]:
+        """
+        Checks that num_starts job starts fit in the budget
+        """
+
+        soft_limit = limit()
+        if soft_limit == resource.RLIM_INFINITY:
+            return Ok(None)
+
+        in_use = open_fds()
+        if in_use + num_starts * START_FDS + self.reserve > soft_limit:
+            return Err(FdBudgetExhausted(in_use, soft_limit, self.reserve))
+        return Ok(None)
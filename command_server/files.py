@@ -1,14 +1,20 @@
 import asyncio
 import enum
+import errno
+import fcntl
 import logging
 import os
 import pathlib
 import random
+import stat
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
 from dataclasses import dataclass
-from typing import Literal, Self
+from typing import Any, Literal, Self
 
 from result import Err, Ok, Result
 
+from command_server import tracing
 from command_server.errors import FileError, FileErrorType
 
 _LOGGER = logging.getLogger("files")
@@ -18,6 +24,46 @@ _RUNDIR = os.getenv("XDG_RUNTIME_DIR", f"{_HOME}/.cache") + "/command-server"
 os.makedirs(_RUNDIR, exist_ok=True)
 
 
+# How long a FIFO open waits between attempts while the other end isn't open
+_OPEN_RETRY_MIN_S = 0.001
+_OPEN_RETRY_MAX_S = 0.05
+
+# Set while a client connection is served, to an event set once it closes
+_connection_closed: ContextVar[asyncio.Event | None] = ContextVar("connection_closed", default=None)
+
+
+def run_dir_path(name: str) -> pathlib.Path:
+    return pathlib.Path(_RUNDIR).joinpath(name)
+
+
+def track_connection(
+    callback: Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[Any]],
+) -> Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]]:
+    """
+    Wraps a connection callback, so opens made for the connection's requests can give up
+    once it closes
+    """
+
+    async def tracked(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        closed = asyncio.Event()
+        token = _connection_closed.set(closed)
+        try:
+            await callback(reader, writer)
+        finally:
+            closed.set()
+            _connection_closed.reset(token)
+
+    return tracked
+
+
+def connection_closed() -> asyncio.Event | None:
+    """
+    The event set once the connection of the request being handled closes, if there is one
+    """
+
+    return _connection_closed.get()
+
+
 @dataclass
 class FifoCreateFailed:
     path: pathlib.Path
@@ -56,6 +102,27 @@ class TempFifo:
                 pass
             self.deleted = True
 
+    async def hold_open(self) -> int:
+        """
+        Opens both ends of the FIFO, so that opening either end elsewhere doesn't block
+        until the returned fd is closed
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(
+            None, os.open, self.path, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC
+        )
+
+    async def release(self) -> None:
+        """
+        Unlinks the FIFO once the process on one end has exited, first letting anyone
+        blocked opening the other end through, so they see EOF (or EPIPE) instead of
+        waiting forever
+        """
+
+        if not self.deleted:
+            await asyncio.get_running_loop().run_in_executor(None, _release_fifo, self.path)
+            self.deleted = True
+
     async def __aenter__(self) -> Self:
         return self
 
@@ -63,15 +130,35 @@ class TempFifo:
         await self.unlink()
 
 
+def _release_fifo(path: pathlib.Path) -> None:
+    try:
+        # Opening both ends never blocks, and completes any open waiting on the other end
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+    except FileNotFoundError:
+        return
+
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    finally:
+        os.close(fd)
+
+
 async def mkfifo(name_hint: str) -> Result[TempFifo, FifoCreateFailed]:
     path = pathlib.Path(f"{_RUNDIR}/{os.getpid()}.{random.random()}.{name_hint}.pipe")
     try:
-        await asyncio.get_running_loop().run_in_executor(
-            None,
-            os.mkfifo,
-            path,
-        )
-        _LOGGER.debug(f"Made fifo {path}")
+        with (
+            tracing.span("files.mkfifo", name=name_hint)
+            if tracing.TRACER.enabled
+            else tracing.NULL_SPAN
+        ):
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                os.mkfifo,
+                path,
+            )
+        _LOGGER.debug("Made fifo %s", path)
         return Ok(TempFifo(path))
 
     except Exception as mkfifo_exception:
@@ -84,41 +171,146 @@ async def mkfifo(name_hint: str) -> Result[TempFifo, FifoCreateFailed]:
         except FileNotFoundError:
             pass
         except Exception as unlink_exception:
-            _LOGGER.error(f"Could not unlink fifo {path}", exc_info=unlink_exception)
+            _LOGGER.error("Could not unlink fifo %s", path, exc_info=unlink_exception)
 
         return Err(FifoCreateFailed(path, mkfifo_exception))
 
 
+def _write_sealed(data: bytes) -> int:
+    fd = os.memfd_create("command-server", os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+        fcntl.fcntl(
+            fd,
+            fcntl.F_ADD_SEALS,
+            fcntl.F_SEAL_SEAL | fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_GROW | fcntl.F_SEAL_WRITE,
+        )
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+@dataclass
+class SealedFile:
+    """
+    An in-memory file which can no longer be changed. Local processes of the same user can
+    open it by path for as long as it is held open.
+    """
+
+    fd: int
+
+    @property
+    def path(self) -> str:
+        return f"/proc/{os.getpid()}/fd/{self.fd}"
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+async def make_sealed_file(data: bytes) -> Result[SealedFile, OSError]:
+    try:
+        with (
+            tracing.span("files.make_sealed_file", size=len(data))
+            if tracing.TRACER.enabled
+            else tracing.NULL_SPAN
+        ):
+            fd = await asyncio.get_running_loop().run_in_executor(None, _write_sealed, data)
+        return Ok(SealedFile(fd))
+    except OSError as e:
+        return Err(e)
+
+
 @dataclass
 class AsyncFile:
     fd: int
+    # Non-blocking FIFOs (and sockets) wait for readiness on the event loop, anything else
+    # is read and written in the default executor
+    pollable: bool = False
+    # Set for a FIFO opened for reading before any writer, which reads as EOF until one
+    # opens it. Readiness is only signalled once a writer has opened it since.
+    await_writer: bool = False
 
     def __post_init__(self) -> None:
         self._close_future: asyncio.Future[None] | None = None
+        self._waiters: dict[bool, asyncio.Future[None]] = {}
+
+    @property
+    def closed(self) -> bool:
+        return self._close_future is not None
+
+    async def _wait_ready(self, writable: bool) -> None:
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters[writable] = waiter
+        if writable:
+            loop.add_writer(self.fd, waiter.set_result, None)
+        else:
+            loop.add_reader(self.fd, waiter.set_result, None)
+        try:
+            await waiter
+        finally:
+            del self._waiters[writable]
+            # A close has already removed it, and the fd may have been reused since
+            if not self.closed:
+                if writable:
+                    loop.remove_writer(self.fd)
+                else:
+                    loop.remove_reader(self.fd)
 
     async def read(self, length: int = 2048) -> bytes:
-        return await asyncio.get_running_loop().run_in_executor(
-            None,
-            os.read,
-            self.fd,
-            length,
-        )
+        if not self.pollable:
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                os.read,
+                self.fd,
+                length,
+            )
+
+        if self.await_writer:
+            await self._wait_ready(writable=False)
+            self.await_writer = False
+
+        while not self.closed:
+            try:
+                return os.read(self.fd, length)
+            except BlockingIOError:
+                await self._wait_ready(writable=False)
+        return b""
 
     async def write(self, data: bytes) -> int:
-        return await asyncio.get_running_loop().run_in_executor(
-            None,
-            os.write,
-            self.fd,
-            data,
-        )
+        if not self.pollable:
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                os.write,
+                self.fd,
+                data,
+            )
+
+        while not self.closed:
+            try:
+                return os.write(self.fd, data)
+            except BlockingIOError:
+                await self._wait_ready(writable=True)
+        raise BrokenPipeError(errno.EPIPE, "File was closed")
 
     async def close(self) -> None:
         if self._close_future is None:
-            self._close_future = asyncio.get_running_loop().run_in_executor(
+            loop = asyncio.get_running_loop()
+            if self.pollable:
+                # Before the fd is closed and can be reused
+                loop.remove_reader(self.fd)
+                loop.remove_writer(self.fd)
+            self._close_future = loop.run_in_executor(
                 None,
                 os.close,
                 self.fd,
             )
+            for waiter in self._waiters.values():
+                if not waiter.done():
+                    waiter.set_result(None)
         await self._close_future
 
     async def __aenter__(self) -> Self:
@@ -152,17 +344,161 @@ class Mode(enum.Flag):
                 return "r+b"
 
 
-async def try_open(path: pathlib.Path, mode: Mode) -> Result[AsyncFile, FileOpenFailed]:
+def _open_nonblocking(path: pathlib.Path, flags: int) -> tuple[int, bool]:
+    try:
+        fd = os.open(path, flags | os.O_NONBLOCK | os.O_CLOEXEC)
+    except OSError as e:
+        # Opening a FIFO for writing fails with ENXIO until it has a reader, but so does
+        # opening a socket, which never will
+        if e.errno == errno.ENXIO and stat.S_ISFIFO(os.stat(path).st_mode):
+            raise BlockingIOError(errno.EAGAIN, "FIFO has no reader yet") from e
+        raise
+
+    try:
+        pollable = stat.S_ISFIFO(os.fstat(fd).st_mode)
+        if not pollable:
+            os.set_blocking(fd, True)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd, pollable
+
+
+async def _unblock_reader_open(path: pathlib.Path, open_future: asyncio.Future[int]) -> None:
+    """
+    Ends a blocking read open of the FIFO by opening it for writing, then closes both ends
+    """
+
+    delay = _OPEN_RETRY_MIN_S
+    writer_fd: int | None = None
+    try:
+        while writer_fd is None and not open_future.done():
+            try:
+                writer_fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+            except OSError as e:
+                # The open hasn't started yet, so has no reader to find
+                if e.errno != errno.ENXIO:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _OPEN_RETRY_MAX_S)
+        try:
+            os.close(await asyncio.shield(open_future))
+        except OSError:
+            pass
+    finally:
+        if writer_fd is not None:
+            os.close(writer_fd)
+
+
+async def _open_fifo_reader(
+    path: pathlib.Path, deadline: float | None, abort: asyncio.Event | None
+) -> int:
+    """
+    Opens a FIFO for reading once it has a writer, as a blocking open does. Unlike a
+    non-blocking open, the fd doesn't read as EOF while the writer is still on its way.
+    """
+
+    loop = asyncio.get_running_loop()
+    open_future = loop.run_in_executor(None, os.open, path, os.O_RDONLY | os.O_CLOEXEC)
+    abort_task = asyncio.create_task(abort.wait()) if abort is not None else None
     try:
-        fd = await asyncio.get_running_loop().run_in_executor(
-            None,
-            os.open,
-            path,
-            mode.to_flag(),
+        await asyncio.wait(
+            [open_future] if abort_task is None else [open_future, abort_task],
+            timeout=deadline - loop.time() if deadline is not None else None,
+            return_when=asyncio.FIRST_COMPLETED,
         )
-        return Ok(AsyncFile(fd))
+    except BaseException:
+        await _unblock_reader_open(path, open_future)
+        raise
+    finally:
+        if abort_task is not None:
+            abort_task.cancel()
+
+    if open_future.done():
+        return open_future.result()
+    await _unblock_reader_open(path, open_future)
+    if abort is not None and abort.is_set():
+        raise ConnectionAbortedError(errno.ECONNABORTED, "Request was abandoned")
+    raise TimeoutError(errno.ETIMEDOUT, "Nothing opened the FIFO for writing")
+
+
+async def _open(
+    path: pathlib.Path,
+    mode: Mode,
+    deadline: float | None,
+    abort: asyncio.Event | None,
+    blocking: bool = False,
+) -> AsyncFile:
+    """
+    Opens the file without blocking on the other end of a FIFO: reads wait for a writer
+    instead, and write opens are retried until a reader opens it, the deadline (in event
+    loop time) passes, or abort is set.
+
+    A blocking file is for a child process, which can't wait for a writer the way reads
+    do here, so a FIFO opened for reading has one by the time it is returned.
+    """
+
+    loop = asyncio.get_running_loop()
+    if blocking and mode == Mode.R:
+        path_stat = await loop.run_in_executor(None, os.stat, path)
+        if stat.S_ISFIFO(path_stat.st_mode):
+            return AsyncFile(await _open_fifo_reader(path, deadline, abort))
+
+    delay = _OPEN_RETRY_MIN_S
+    while True:
+        try:
+            fd, pollable = await loop.run_in_executor(None, _open_nonblocking, path, mode.to_flag())
+            break
+        except BlockingIOError:
+            pass
+
+        if deadline is not None and loop.time() + delay > deadline:
+            raise TimeoutError(errno.ETIMEDOUT, "Nothing opened the other end of the FIFO")
+        if abort is None:
+            await asyncio.sleep(delay)
+        else:
+            try:
+                await asyncio.wait_for(abort.wait(), delay)
+                raise ConnectionAbortedError(errno.ECONNABORTED, "Request was abandoned")
+            except TimeoutError:
+                pass
+        delay = min(delay * 2, _OPEN_RETRY_MAX_S)
+
+    if not blocking:
+        return AsyncFile(fd, pollable=pollable, await_writer=pollable and mode == Mode.R)
+    os.set_blocking(fd, True)
+    return AsyncFile(fd)
+
+
+def _deadline(timeout_s: float | None) -> float | None:
+    return asyncio.get_running_loop().time() + timeout_s if timeout_s is not None else None
+
+
+async def try_open(
+    path: pathlib.Path,
+    mode: Mode,
+    timeout_s: float | None = None,
+    abort: asyncio.Event | None = None,
+) -> Result[AsyncFile, FileOpenFailed]:
+    return await _try_open(path, mode, _deadline(timeout_s), abort)
+
+
+async def _try_open(
+    path: pathlib.Path,
+    mode: Mode,
+    deadline: float | None,
+    abort: asyncio.Event | None,
+    blocking: bool = False,
+) -> Result[AsyncFile, FileOpenFailed]:
+    try:
+        with (
+            tracing.span("files.try_open", path=path, mode=mode)
+            if tracing.TRACER.enabled
+            else tracing.NULL_SPAN
+        ):
+            return Ok(await _open(path, mode, deadline, abort, blocking))
     except Exception as open_exception:
-        _LOGGER.error(f"Failed to open file {path} in {mode}: {open_exception}")
+        _LOGGER.error("Failed to open file %s in %s: %s", path, mode, open_exception)
         return Err(FileOpenFailed(path, open_exception))
 
 
@@ -187,8 +523,17 @@ class AsyncFileList:
 
 
 async def try_open_multiple(
-    *args: tuple[pathlib.Path, Mode]
+    *args: tuple[pathlib.Path, Mode],
+    timeout_s: float | None = None,
+    abort: asyncio.Event | None = None,
+    blocking: bool = False,
 ) -> Result[AsyncFileList, FileOpenFailed]:
+    """
+    Opens every file, or none of them. The timeout covers all of the opens. Blocking files
+    are for handing to a child process.
+    """
+
+    deadline = _deadline(timeout_s)
     mode_by_path: dict[pathlib.Path, Mode] = dict()
     for arg in args:
         if arg[0] not in mode_by_path:
@@ -198,7 +543,7 @@ async def try_open_multiple(
 
     file_by_path: dict[pathlib.Path, AsyncFile] = dict()
     for path, mode in mode_by_path.items():
-        match await try_open(path, mode):
+        match await _try_open(path, mode, deadline, abort, blocking):
             case Ok(file):
                 file_by_path[path] = file
             case Err() as err:
@@ -1,7 +1,15 @@
 import asyncio
+import base64
 import logging
+import os
+import pathlib
+import time
 from asyncio import Event, Task
-from dataclasses import dataclass
+from collections import deque
+from collections.abc import Iterable
+from dataclasses import dataclass, replace
+from functools import cache, partial
+from signal import Signals
 from typing import Self
 
 from jrpc.service import MethodSet, implements, make_method_set
@@ -9,22 +17,48 @@ from result import Err, Ok, Result
 
 from command_server.files import FifoCreateFailed, FileOpenFailed
 
+from . import fds, placement, profiling, server_config, token_io, tracing, workers
 from .api import (
+    AttachJobParams,
+    AttachJobResult,
     CancelReloadParams,
     CancelReloadResult,
+    ConcurrencyParams,
+    ConcurrencyResult,
+    DumpTraceParams,
+    DumpTraceResult,
+    ExecutorConfigOverrides,
+    ExecutorInfo,
     ExecutorStatus,
+    FdUsageParams,
+    FdUsageResult,
     JobMethod,
     JobStatus,
     ListExecutorsParams,
     ListExecutorsResult,
     ListJobsParams,
     ListJobsResult,
+    LoopLagParams,
+    LoopLagResult,
+    MemorySnapshotParams,
+    MemorySnapshotResult,
+    OutputStream,
+    ProfileParams,
+    ProfileResult,
+    ReadOutputParams,
+    ReadOutputResult,
+    ReloadConfigParams,
+    ReloadConfigResult,
     ReloadExecutorParams,
     ReloadExecutorResult,
+    Signal,
     SignalJobParams,
     SignalJobResult,
     StartJobParams,
     StartJobResult,
+    StartPipelineParams,
+    StartPipelineResult,
+    Stdio,
     StopServerParams,
     StopServerResult,
     WaitForJobParams,
@@ -32,82 +66,642 @@ from .api import (
     WaitForReloadParams,
     WaitForReloadResult,
 )
+from .cache import CachedResult, CacheKey, ResultCache
+from .cgroups import JobCgroup, make_job_cgroup
+from .deadlines import DeadlineQueue
 from .errors import (
     ExecutorAlreadyLoaded,
     ExecutorNotFound,
     ExecutorNotRunning,
     ExecutorReloadActive,
     ExecutorReloadFailed,
+    FileError,
+    FileErrorType,
+    InvalidPipeline,
+    InvalidTimeout,
     JobApiError,
+    JobApiErrorCode,
     JobNotFound,
+    JobStartFailed,
+    OutputNotCaptured,
+    ProfileNotFound,
 )
 from .executor import Executor, make_executor
-from .job import Job
-from .server_config import CommandServerConfig
+from .fds import FdBudget
+from .files import (
+    Mode,
+    TempFifo,
+    connection_closed,
+    mkfifo,
+    run_dir_path,
+    try_open_multiple,
+)
+from .job import CachedJob, FinishedJob, FinishedPipeline, Job, Pipeline
+from .journal import JobJournal, JournalEntry
+from .logs import configure_logging
+from .loop_monitor import LoopMonitor
+from .output import JobOutput, copy_output, make_job_output, write_all
+from .placement import Placer
+from .pressure import ConcurrencyController
+from .scheduler import JobScheduler
+from .server_config import (
+    DEFAULT_PROFILE,
+    BaseExecutorConfig,
+    CgroupConfig,
+    CommandServerConfig,
+    ExecutorConfig,
+    JobScheduling,
+    SignalTranslator,
+)
+
+_DEV_NULL_STDIO = Stdio(stdin="/dev/null", stdout="/dev/null", stderr="/dev/null")
 
 _LOGGER = logging.getLogger("job-impl")
 
 
+# Process start times are only known to a clock tick, and the boot time to a second
+_START_TIME_SLACK_S = 2.0
+
+
+@cache
+def _boot_time() -> float:
+    # Only reads procfs, so it doesn't block
+    with open("/proc/stat") as f:
+        for line in f:
+            if line.startswith("btime "):
+                return float(line.split()[1])
+    raise OSError("No btime in /proc/stat")
+
+
+def _process_start_time(pid: int) -> float | None:
+    try:
+        # Only reads procfs, so it doesn't block
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+        # Fields after the command name, which may contain spaces, start at the 3rd
+        start_ticks = int(stat[stat.rindex(")") + 2 :].split()[19])
+        return _boot_time() + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _is_running(pid: int, started_at: float) -> bool:
+    """
+    Whether the job started at started_at is still running, rather than having exited
+    and its pid been reused by a later process
+    """
+
+    start_time = _process_start_time(pid)
+    return start_time is not None and start_time <= started_at + _START_TIME_SLACK_S
+
+
+def _journal_entry(job: Job | FinishedJob) -> JournalEntry:
+    state = job.state
+    return JournalEntry(
+        id=job.id,
+        profile=job.profile,
+        executor_id=job.executor_id,
+        pid=job.pid,
+        cwd=job.cwd,
+        args=list(job.args),
+        exit_fifo=(
+            str(job.exit_reader.fifo.path)
+            if isinstance(job, Job) and job.exit_reader.fifo is not None
+            else ""
+        ),
+        started_at=job.started_at,
+        finished=state.status == JobStatus.DONE,
+        exit_code=state.exit_code,
+        timed_out=job.timed_out,
+        resources=job.resources,
+        finished_at=job.finished_at,
+    )
+
+
+def _check_timeout(
+    timeout_s: float | None, kill_after_s: float | None
+) -> Result[None, InvalidTimeout]:
+    if timeout_s is not None and timeout_s <= 0:
+        return Err(InvalidTimeout("timeout_s must be positive"))
+    if kill_after_s is not None:
+        if timeout_s is None:
+            return Err(InvalidTimeout("kill_after_s needs a timeout_s"))
+        if kill_after_s < 0:
+            return Err(InvalidTimeout("kill_after_s must not be negative"))
+    return Ok(None)
+
+
+def _log_reload_failure(task: Task[Result[ReloadConfigResult, JobApiError]]) -> None:
+    # Nobody awaits a reload requested by a signal
+    if task.cancelled():
+        return
+    if (e := task.exception()) is not None:
+        _LOGGER.error("Config reload failed", exc_info=e)
+        return
+    match task.result():
+        case Err(error):
+            _LOGGER.error("Config reload failed: %s", error)
+
+
 @dataclass
 class JobApiImpl:
     config: CommandServerConfig
     stop_event: Event
 
     def __post_init__(self) -> None:
-        self._current_executor: Executor | None = None
+        self._current_executors: dict[str, Executor] = {}
         self._reload_lock = asyncio.Lock()
         self._executors: dict[str, Executor] = {}
-        self._jobs: dict[str, Job] = {}
-        self._next_executor_id: str | None = None
-        self._executor_change_task: Task[None] | None = None
+        self._jobs: dict[str, Job | FinishedJob | CachedJob] = {}
+        self._pipelines: dict[str, Pipeline | FinishedPipeline] = {}
+        # When each finished job and pipeline finished, oldest first
+        self._finished: deque[tuple[float, str]] = deque()
+        # Finished jobs whose captured output is still kept, oldest first
+        self._outputs: deque[tuple[float, str]] = deque()
+        self._next_executor_ids: dict[str, str] = {}
+        self._executor_change_tasks: dict[str, Task[None]] = {}
+        self._executor_overrides: dict[str, ExecutorConfigOverrides] = {}
+        self._supervisors: dict[str, Task[None]] = {}
+        # Set (and replaced) each time a profile's current executor changes
+        self._executor_changed: dict[str, Event] = {}
+        self._restart_attempts: dict[str, int] = {}
+        self._closing = False
+        self._config_reload_task: Task[Result[ReloadConfigResult, JobApiError]] | None = None
+        self._trace_dump_task: Task[Result[DumpTraceResult, JobApiError]] | None = None
+        self._scheduler = JobScheduler(self.config.priority_weights, self.config.max_concurrency)
+        self._concurrency_controller: ConcurrencyController | None = None
+        self._concurrency_task: Task[None] | None = None
+        self._fd_budget = FdBudget(self.config.fd_reserve)
+        self._placer = Placer(self.config.placement) if self.config.placement else None
+        self._deadlines = DeadlineQueue()
+        self._cache = ResultCache(self.config.cache)
+        self._loop_monitor = LoopMonitor(self.config.loop_monitor)
+        tracing.TRACER.configure(self.config.tracing.enabled, self.config.tracing.capacity)
+        self._output_forwarders: dict[str, Task[None]] = {}
+        self._journal: JobJournal | None = None
+        if self.config.journal_file is not None:
+            self._journal = JobJournal(self.config.journal_file, self._journal_snapshot)
 
     async def __aenter__(self) -> Self:
+        if self._journal is not None:
+            finished: list[tuple[float, str]] = []
+            for entry in self._journal.open().values():
+                job = await self._restore_job(entry)
+                self._jobs[entry.id] = job
+                if isinstance(job, FinishedJob):
+                    finished.append((job.finished_at or job.started_at, job.id))
+            self._finished.extend(sorted(finished))
+            if self._prune_finished():
+                # Don't replay the dropped jobs again on the next restart
+                self._journal.compact()
+        self._configure_concurrency()
+        self._loop_monitor.start()
         return self
 
     async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._closing = True
+        self._loop_monitor.stop()
+        if self._concurrency_task is not None:
+            self._concurrency_task.cancel()
+        for supervisor in list(self._supervisors.values()):
+            supervisor.cancel()
+        self._deadlines.close()
         async with asyncio.TaskGroup() as tg:
             for executor in self._executors.values():
                 tg.create_task(executor.cleanup(kill_jobs=True))
+        if self._journal is not None:
+            self._journal.close()
+
+    def _configure_concurrency(self) -> None:
+        """
+        Hands max_running to a pressure controller if one is configured, or sets it to
+        max_concurrency if not
+        """
+
+        if self._concurrency_task is not None:
+            self._concurrency_task.cancel()
+            self._concurrency_task = None
+
+        if self.config.pressure is None:
+            self._concurrency_controller = None
+            self._scheduler.max_running = self.config.max_concurrency
+            return
+
+        # A reload shouldn't undo what the controller learned about the host
+        previous = self._concurrency_controller
+        self._concurrency_controller = ConcurrencyController(
+            self.config.pressure,
+            self._scheduler,
+            self.config.max_concurrency,
+            limit=previous.limit if previous is not None else None,
+        )
+        self._concurrency_task = asyncio.create_task(self._concurrency_controller.run())
+
+    def _journal_snapshot(self) -> Iterable[JournalEntry]:
+        self._prune_finished()
+        # Cached jobs never ran, so there is nothing to recover
+        return (
+            _journal_entry(job) for job in self._jobs.values() if not isinstance(job, CachedJob)
+        )
+
+    def _record_exit(self, job: Job) -> None:
+        if self._journal is not None:
+            self._journal.record_exit(_journal_entry(job))
+
+    def _archive_job(self, job: Job) -> None:
+        # Waiters and forwarders hold on to the job itself, for as long as they need it
+        if self._jobs.get(job.id) is job:
+            self._jobs[job.id] = FinishedJob.archive(job)
+            self._retire(job.id)
+            if job.output is not None:
+                if (forwarder := self._output_forwarders.get(job.id)) is not None:
+                    # The output is only up for release once it has been forwarded
+                    forwarder.add_done_callback(lambda _: self._retain_output(job.id))
+                else:
+                    self._retain_output(job.id)
+
+    def _archive_pipeline(self, pipeline: Pipeline) -> None:
+        if self._pipelines.get(pipeline.id) is pipeline:
+            self._pipelines[pipeline.id] = FinishedPipeline.archive(pipeline)
+            self._retire(pipeline.id)
+
+    def _retire(self, id: str, finished_at: float | None = None) -> None:
+        self._finished.append((finished_at or time.time(), id))
+        self._prune_finished()
+
+    def _prune_finished(self) -> int:
+        """
+        Drops the finished jobs and pipelines past the retention limits, returning how many
+        """
+
+        cutoff = time.time() - self.config.finished_job_ttl_s
+        pruned = 0
+        while self._finished and (
+            len(self._finished) > self.config.max_finished_jobs or self._finished[0][0] < cutoff
+        ):
+            _, id = self._finished.popleft()
+            job = self._jobs.pop(id, None)
+            if isinstance(job, FinishedJob) and job.output is not None:
+                job.output.release()
+            self._pipelines.pop(id, None)
+            pruned += 1
+
+        self._prune_outputs()
+        return pruned
+
+    def _retain_output(self, id: str) -> None:
+        self._outputs.append((time.time(), id))
+        self._prune_outputs()
+
+    def _prune_outputs(self) -> None:
+        """
+        Frees the output captured from finished jobs past the [capture] retention limits
+        """
+
+        retained: dict[str, FinishedJob] = dict()
+        for _, id in self._outputs:
+            job = self._jobs.get(id)
+            if isinstance(job, FinishedJob) and job.output is not None:
+                retained[id] = job
+        retained_bytes = sum(job.output.size_bytes for job in retained.values() if job.output)
+
+        capture = self.config.capture
+        cutoff = time.time() - capture.retain_s
+        while self._outputs:
+            finished_at, id = self._outputs[0]
+            if id in retained and (
+                len(retained) <= capture.retain_count
+                and retained_bytes <= capture.retain_bytes
+                and finished_at >= cutoff
+            ):
+                break
+
+            self._outputs.popleft()
+            if (job := retained.pop(id, None)) is not None and job.output is not None:
+                retained_bytes -= job.output.size_bytes
+                job.output.release()
+                job.output = None
+
+    async def _restore_job(self, entry: JournalEntry) -> Job | FinishedJob:
+        if (
+            not entry.finished
+            and _is_running(entry.pid, entry.started_at)
+            and os.path.exists(entry.exit_fifo)
+        ):
+            match await token_io.reopen_pipe_reader(TempFifo(pathlib.Path(entry.exit_fifo))):
+                case Ok(exit_reader):
+                    base_config = self.config.executor_configs.get(entry.profile)
+                    job = Job(
+                        id=entry.id,
+                        profile=entry.profile,
+                        executor_id=entry.executor_id,
+                        pid=entry.pid,
+                        cwd=entry.cwd,
+                        args=entry.args,
+                        exit_reader=exit_reader,
+                        signal_translator=(
+                            base_config.signal_translator if base_config else SignalTranslator({})
+                        ),
+                    )
+                    job.started_at = entry.started_at
+                    job.add_done_callback(self._record_exit)
+                    job.add_done_callback(self._archive_job)
+                    _LOGGER.info(
+                        "Adopted running job %s (%s)", job.id, job.pid, extra={"job_id": job.id}
+                    )
+                    return job
+
+        finished_job = FinishedJob.create(
+            id=entry.id,
+            profile=entry.profile,
+            executor_id=entry.executor_id,
+            pid=entry.pid,
+            cwd=entry.cwd,
+            args=entry.args,
+            exit_code=entry.exit_code,
+            timed_out=entry.timed_out,
+            resources=entry.resources,
+            started_at=entry.started_at,
+            finished_at=entry.finished_at,
+        )
+        if not entry.finished and self._journal is not None:
+            _LOGGER.warning(
+                "Job %s exited while the server was down", entry.id, extra={"job_id": entry.id}
+            )
+            self._journal.record_exit(_journal_entry(finished_job))
+        return finished_job
 
     async def _try_change_executor(self, executor: Executor) -> None:
         match await executor.wait_ready():
             case Ok():
-                self._current_executor = executor
-        self._next_executor_id = None
+                previous = self._current_executors.get(executor.profile)
+                self._current_executors[executor.profile] = executor
+                if previous is not None:
+                    # Results are keyed by executor, so the old one's can never be hit again
+                    self._cache.remove_executor(previous.id)
+                self._executor_changed.pop(executor.profile, Event()).set()
+                supervisor = asyncio.create_task(self._supervise(executor))
+                self._supervisors[executor.id] = supervisor
+                supervisor.add_done_callback(lambda _: self._supervisors.pop(executor.id))
+        del self._next_executor_ids[executor.profile]
 
-    def check_executor(self) -> Result[Executor, ExecutorNotRunning]:
-        if (
-            self._current_executor is None
-            or self._current_executor.status != ExecutorStatus.RUNNING
-        ):
+    async def _supervise(self, executor: Executor) -> None:
+        """
+        Pings the profile's current executor until it is replaced or exits, killing it if
+        it stops answering. An executor that exits on its own is restarted with the same
+        config, backing off exponentially if the restarts keep failing.
+        """
+
+        profile = executor.profile
+        ready_at = time.monotonic()
+        closed = asyncio.ensure_future(executor.wait_closed())
+        changed = asyncio.ensure_future(self._executor_changed.setdefault(profile, Event()).wait())
+        try:
+            while not closed.done() and not changed.done():
+                await asyncio.wait(
+                    [closed, changed],
+                    timeout=self.config.supervisor.ping_interval_s or None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if closed.done() or changed.done():
+                    break
+
+                if not await executor.ping(self.config.supervisor.ping_timeout_s):
+                    _LOGGER.warning(
+                        "Executor %s stopped answering pings, killing it",
+                        executor.id,
+                        extra={"executor_id": executor.id},
+                    )
+                    await executor.cleanup(signal=Signals.SIGKILL)
+        finally:
+            closed.cancel()
+            changed.cancel()
+
+        if self._closing or self._current_executors.get(profile) is not executor:
+            return
+
+        _LOGGER.warning(
+            "Executor %s for profile %s exited with %s",
+            executor.id,
+            profile,
+            executor.state.exit_code,
+            extra={"executor_id": executor.id},
+        )
+        if not self.config.supervisor.restart:
+            return
+
+        # An executor that stayed up for a while starts the backoff over
+        if time.monotonic() - ready_at >= self.config.supervisor.backoff_max_s:
+            self._restart_attempts.pop(profile, None)
+
+        await self._restart_executor(executor)
+
+    async def _restart_executor(self, executor: Executor) -> None:
+        profile = executor.profile
+        while not self._closing and self._current_executors.get(profile) is executor:
+            attempt = self._restart_attempts.get(profile, 0)
+            self._restart_attempts[profile] = attempt + 1
+            if attempt > 0:
+                await asyncio.sleep(
+                    min(
+                        self.config.supervisor.backoff_initial_s * 2 ** (attempt - 1),
+                        self.config.supervisor.backoff_max_s,
+                    )
+                )
+                if self._closing or self._current_executors.get(profile) is not executor:
+                    return
+
+            _LOGGER.info("Restarting executor for profile %s (attempt %d)", profile, attempt + 1)
+            match await self._start_executor(executor.config, _DEV_NULL_STDIO):
+                case Ok(new_executor):
+                    await asyncio.shield(self._executor_change_tasks[profile])
+                    if self._current_executors.get(profile) is new_executor:
+                        return
+                    _LOGGER.warning(
+                        "Restarted executor %s for profile %s never became ready",
+                        new_executor.id,
+                        profile,
+                        extra={"executor_id": new_executor.id},
+                    )
+                case Err(error) if error.code == JobApiErrorCode.EXECUTOR_RELOAD_ACTIVE:
+                    # Someone else is already replacing it
+                    return
+                case Err(error):
+                    _LOGGER.error(
+                        "Failed to restart executor for profile %s: %s", profile, error.message
+                    )
+
+    async def _wait_for_executor(self, profile: str) -> Result[Executor, ExecutorNotRunning]:
+        """
+        Like check_executor, but if the executor has exited and its supervisor is restarting
+        it, waits up to start_wait_s for the new one
+        """
+
+        executor = self._current_executors.get(profile)
+        if executor is not None and executor.status == ExecutorStatus.CLOSED:
+            supervisor = self._supervisors.get(executor.id)
+            if supervisor is not None:
+                changed = asyncio.ensure_future(
+                    self._executor_changed.setdefault(profile, Event()).wait()
+                )
+                with tracing.span("executor.wait_restart", profile=profile):
+                    await asyncio.wait(
+                        [changed, supervisor],
+                        timeout=self.config.supervisor.start_wait_s,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                changed.cancel()
+
+        return self.check_executor(profile)
+
+    def _base_executor_config(self, profile: str | None) -> Result[BaseExecutorConfig, JobApiError]:
+        profile = profile or DEFAULT_PROFILE
+        if profile not in self.config.executor_configs:
+            return Err(JobApiError.from_data(ProfileNotFound(profile)))
+        return Ok(self.config.executor_configs[profile])
+
+    def check_executor(
+        self, profile: str = DEFAULT_PROFILE
+    ) -> Result[Executor, ExecutorNotRunning]:
+        executor = self._current_executors.get(profile)
+        if executor is None or executor.status != ExecutorStatus.RUNNING:
             return Err(ExecutorNotRunning())
-        return Ok(self._current_executor)
+        return Ok(executor)
+
+    async def _start_executor(
+        self, executor_config: ExecutorConfig, stdio: Stdio
+    ) -> Result[Executor, JobApiError]:
+        profile = executor_config.profile
+        async with self._reload_lock:
+            if profile in self._next_executor_ids:
+                return Err(
+                    JobApiError.from_data(ExecutorReloadActive(self._next_executor_ids[profile]))
+                )
+
+            match await make_executor(
+                executor_config, stdio, self.config.open_timeout_s, connection_closed()
+            ):
+                case Ok(executor):
+                    self._executors[executor.id] = executor
+                    self._next_executor_ids[profile] = executor.id
+                    self._executor_change_tasks[profile] = asyncio.create_task(
+                        self._try_change_executor(executor)
+                    )
+                    return Ok(executor)
+                case Err(e):
+                    return Err(JobApiError.from_data(e.to_file_error()))
 
     @implements(JobMethod.RELOAD_EXECUTOR)
     async def reload_executor(
         self, params: ReloadExecutorParams
     ) -> Result[ReloadExecutorResult, JobApiError]:
-        match self.config.base_executor_config.apply_overrides(params.config_overrides):
+        match self._base_executor_config(params.profile):
+            case Ok(base_config):
+                pass
+            case Err() as err:
+                return err
+
+        match base_config.apply_overrides(params.config_overrides):
             case Ok(executor_config):
                 pass
             case Err(invalid_config):
                 return Err(JobApiError.from_data(invalid_config))
 
-        async with self._reload_lock:
-            if self._next_executor_id is not None:
-                return Err(JobApiError.from_data(ExecutorReloadActive(self._next_executor_id)))
+        match await self._start_executor(executor_config, params.stdio):
+            case Ok(executor):
+                self._executor_overrides[executor.profile] = params.config_overrides
+                return Ok(ReloadExecutorResult(executor.info))
+            case Err() as err:
+                return err
+
+    @implements(JobMethod.RELOAD_CONFIG)
+    async def reload_config(
+        self, params: ReloadConfigParams
+    ) -> Result[ReloadConfigResult, JobApiError]:
+        match server_config.reload_config(self.config):
+            case Ok(new_config):
+                pass
+            case Err(invalid_config):
+                return Err(JobApiError.from_data(invalid_config))
+
+        changed = server_config.diff_config(self.config, new_config)
+        ignored = [name for name in changed if name in server_config.RESTART_FIELDS]
+        for name in ignored:
+            _LOGGER.warning("Ignoring change to %s, a restart is required to apply it", name)
+            changed.remove(name)
+
+        # The config keeps describing what is actually running
+        old_config = self.config
+        for name in server_config.RESTART_FIELDS:
+            setattr(new_config, name, getattr(old_config, name))
+
+        # Jobs and executors hold a reference to the translator, so it is updated in place,
+        # once the reload can no longer fail
+        translations: list[tuple[SignalTranslator, dict[Signal, Signal]]] = []
+        for profile, base_config in new_config.executor_configs.items():
+            if profile in old_config.executor_configs:
+                translator = old_config.executor_configs[profile].signal_translator
+                translations.append((translator, base_config.signal_translator.mapping))
+                base_config.signal_translator = translator
 
-            match await make_executor(executor_config, params.stdio):
+        executor_configs: list[ExecutorConfig] = []
+        for profile in server_config.profiles_needing_executor(old_config, new_config):
+            if profile not in self._current_executors:
+                continue
+
+            overrides = self._executor_overrides.get(profile, ExecutorConfigOverrides())
+            match new_config.executor_configs[profile].apply_overrides(overrides):
+                case Ok(executor_config):
+                    executor_configs.append(executor_config)
+                case Err(invalid_config):
+                    return Err(JobApiError.from_data(invalid_config))
+
+        started: list[Executor] = []
+        for executor_config in executor_configs:
+            match await self._start_executor(executor_config, params.stdio or _DEV_NULL_STDIO):
                 case Ok(executor):
-                    self._executors[executor.id] = executor
-                    self._next_executor_id = executor.id
-                    self._executor_change_task = asyncio.create_task(
-                        self._try_change_executor(executor)
-                    )
-                    return Ok(ReloadExecutorResult(executor.info))
-                case Err(e):
-                    self._next_executor_task = None
-                    return Err(JobApiError.from_data(e.to_file_error()))
+                    started.append(executor)
+                case Err(error) as err:
+                    # Keep running with the old config, and the executors it started
+                    for executor in started:
+                        await executor.cleanup()
+                    _LOGGER.error("Failed to reload config, keeping the old one: %s", error)
+                    return err
+
+        for translator, mapping in translations:
+            translator.mapping = mapping
+        self.config = new_config
+        _LOGGER.info("Reloaded config, changed=%r", changed)
+
+        if any(name.startswith("log_") for name in changed):
+            configure_logging(new_config)
+
+        self._configure_concurrency()
+        self._fd_budget.reserve = new_config.fd_reserve
+        self._prune_finished()
+        # Jobs placed by the old placer give their places back to it
+        self._placer = Placer(new_config.placement) if new_config.placement else None
+        self._scheduler.weights = new_config.priority_weights
+        self._cache.config = new_config.cache
+        self._cache.trim()
+        tracing.TRACER.configure(new_config.tracing.enabled, new_config.tracing.capacity)
+        if new_config.loop_monitor != old_config.loop_monitor:
+            self._loop_monitor.configure(new_config.loop_monitor)
+
+        executors = {executor.profile: executor.info for executor in started}
+        return Ok(ReloadConfigResult(changed=changed, ignored=ignored, executors=executors))
+
+    def request_config_reload(self) -> None:
+        """
+        Schedules a config reload in the background, e.g. in response to SIGHUP
+        """
+
+        if self._config_reload_task is not None and not self._config_reload_task.done():
+            _LOGGER.info("Config reload already in progress")
+            return
+
+        self._config_reload_task = asyncio.create_task(self.reload_config(ReloadConfigParams()))
+        self._config_reload_task.add_done_callback(_log_reload_failure)
 
     @implements(JobMethod.CANCEL_RELOAD)
     async def cancel_reload(
@@ -127,7 +721,7 @@ class JobApiImpl:
     async def wait_for_reload(
         self, params: WaitForReloadParams
     ) -> Result[WaitForReloadResult, JobApiError]:
-        id = params.id or self._next_executor_id
+        id = params.id or self._next_executor_ids.get(params.profile or DEFAULT_PROFILE)
         if id not in self._executors:
             return Err(JobApiError.from_data(ExecutorNotFound(id)))
 
@@ -140,28 +734,492 @@ class JobApiImpl:
 
     @implements(JobMethod.START_JOB)
     async def start_job(self, params: StartJobParams) -> Result[StartJobResult, JobApiError]:
-        match self.check_executor():
+        with tracing.request(JobMethod.START_JOB.name):
+            return await self._start_job(params)
+
+    async def _start_job(self, params: StartJobParams) -> Result[StartJobResult, JobApiError]:
+        match _check_timeout(params.timeout_s, params.kill_after_s):
+            case Err(invalid):
+                return Err(JobApiError.from_data(invalid))
+
+        match self._base_executor_config(params.profile):
+            case Ok(base_config):
+                pass
+            case Err() as err:
+                return err
+
+        match placement.job_scheduling(
+            params.cpu_set, params.nice, params.ioprio, base_config.job_scheduling
+        ):
+            case Ok(scheduling):
+                pass
+            case Err(invalid):
+                return Err(JobApiError.from_data(invalid))
+
+        match await self._wait_for_executor(base_config.profile):
             case Ok(executor):
                 pass
             case Err(not_running):
                 return Err(JobApiError.from_data(not_running))
 
-        match await executor.start_job(
+        cache_key: CacheKey = (executor.id, params.cwd, tuple(params.args))
+        if params.cacheable and not params.capture:
+            if (cached := self._cache.get(cache_key)) is not None:
+                return await self._start_cached_job(executor, params, cached)
+
+        with (
+            tracing.span("scheduler.dispatch", priority=params.priority.value)
+            if tracing.TRACER.enabled
+            else tracing.NULL_SPAN
+        ):
+            dispatched = await self._scheduler.dispatch(
+                base_config.profile,
+                params.priority,
+                partial(self._dispatch_job, base_config.profile, params, scheduling),
+                # Unique to the client's connection
+                connection_closed(),
+            )
+
+        match dispatched:
+            case Ok(job):
+                self._track_job(job, params.timeout_s, params.kill_after_s)
+                if params.cacheable:
+                    forwarder = asyncio.create_task(self._forward_and_cache(job, cache_key, params))
+                    self._output_forwarders[job.id] = forwarder
+                    forwarder.add_done_callback(lambda _: self._output_forwarders.pop(job.id))
+                return Ok(StartJobResult(job.info))
+            case Err() as err:
+                return err
+
+    def _track_job(self, job: Job, timeout_s: float | None, kill_after_s: float | None) -> None:
+        self._jobs[job.id] = job
+        if self._journal is not None:
+            self._journal.record_start(_journal_entry(job))
+            job.add_done_callback(self._record_exit)
+        if timeout_s is not None:
+            deadline = self._deadlines.call_later(
+                timeout_s, partial(self._time_out_job, job, kill_after_s)
+            )
+            job.add_done_callback(lambda _: deadline.cancel())
+        job.add_done_callback(self._archive_job)
+
+    @implements(JobMethod.START_PIPELINE)
+    async def start_pipeline(
+        self, params: StartPipelineParams
+    ) -> Result[StartPipelineResult, JobApiError]:
+        with tracing.request(JobMethod.START_PIPELINE.name):
+            return await self._start_pipeline(params)
+
+    async def _start_pipeline(
+        self, params: StartPipelineParams
+    ) -> Result[StartPipelineResult, JobApiError]:
+        if not params.stages or not all(params.stages):
+            return Err(JobApiError.from_data(InvalidPipeline("Every stage needs a command")))
+
+        match _check_timeout(params.timeout_s, params.kill_after_s):
+            case Err(invalid):
+                return Err(JobApiError.from_data(invalid))
+
+        match self._base_executor_config(params.profile):
+            case Ok(base_config):
+                pass
+            case Err() as err:
+                return err
+
+        match placement.job_scheduling(
+            params.cpu_set, params.nice, params.ioprio, base_config.job_scheduling
+        ):
+            case Ok(scheduling):
+                pass
+            case Err(invalid):
+                return Err(JobApiError.from_data(invalid))
+
+        match await self._wait_for_executor(base_config.profile):
+            case Ok():
+                pass
+            case Err(not_running):
+                return Err(JobApiError.from_data(not_running))
+
+        # The stages would deadlock if some were started and others queued, so the
+        # pipeline takes a single slot
+        with (
+            tracing.span("scheduler.dispatch", priority=params.priority.value)
+            if tracing.TRACER.enabled
+            else tracing.NULL_SPAN
+        ):
+            dispatched = await self._scheduler.dispatch(
+                base_config.profile,
+                params.priority,
+                partial(self._dispatch_pipeline, base_config.profile, params, scheduling),
+                # Unique to the client's connection
+                connection_closed(),
+            )
+
+        match dispatched:
+            case Ok(pipeline):
+                for job in pipeline.jobs:
+                    self._track_job(job, params.timeout_s, params.kill_after_s)
+                self._pipelines[pipeline.id] = pipeline
+                pipeline.add_done_callback(self._archive_pipeline)
+                return Ok(StartPipelineResult(pipeline.id, [job.info for job in pipeline.jobs]))
+            case Err() as err:
+                return err
+
+    async def _dispatch_pipeline(
+        self, profile: str, params: StartPipelineParams, scheduling: JobScheduling
+    ) -> Result[Pipeline, JobApiError]:
+        match self._fd_budget.check(len(params.stages)):
+            case Err(exhausted):
+                return Err(JobApiError.from_data(exhausted))
+
+        executor = self._current_executors.get(profile)
+        if executor is not None and not executor.transport.local:
+            # The server can only tell the stages have opened their FIFOs by their pids
+            return Err(
+                JobApiError.from_data(
+                    InvalidPipeline("Pipelines need an executor with a local transport")
+                )
+            )
+
+        fifos: list[TempFifo] = []
+        held_fds: list[int] = []
+        jobs: list[Job] = []
+
+        async def abort(error: JobApiError) -> Result[Pipeline, JobApiError]:
+            for job in jobs:
+                try:
+                    job.kill()
+                except ProcessLookupError:
+                    pass
+            for fifo in fifos:
+                await fifo.release()
+            return Err(error)
+
+        try:
+            for _ in params.stages[1:]:
+                match await mkfifo("pipeline"):
+                    case Ok(fifo):
+                        fifos.append(fifo)
+                    case Err(fifo_error):
+                        return await abort(JobApiError.from_data(fifo_error.to_file_error()))
+
+                # Executors may open a job's stdio before answering with its pid, so
+                # opens can't wait for the next stage until they've all been started.
+                # The pipeline keeps holding them until the stages have opened them.
+                try:
+                    held_fds.append(await fifo.hold_open())
+                except OSError as e:
+                    return await abort(
+                        JobApiError.from_data(
+                            FileError(FileErrorType.OPEN_FAILED, str(fifo.path), repr(e))
+                        )
+                    )
+
+            for index, args in enumerate(params.stages):
+                stage_params = StartJobParams(
+                    cwd=params.cwd,
+                    args=args,
+                    stdio=Stdio(
+                        stdin=str(fifos[index - 1].path) if index > 0 else params.stdio.stdin,
+                        stdout=(
+                            str(fifos[index].path) if index < len(fifos) else params.stdio.stdout
+                        ),
+                        stderr=params.stdio.stderr,
+                    ),
+                    profile=params.profile,
+                )
+                match await self._start_on_executor(profile, stage_params, stage_params.stdio):
+                    case Ok(job):
+                        self._apply_scheduling(job, scheduling)
+                        self._attach_cgroup(job)
+                        jobs.append(job)
+                    case Err(FileOpenFailed() | FifoCreateFailed() as file_error):
+                        return await abort(JobApiError.from_data(file_error.to_file_error()))
+                    case Err(e):
+                        return await abort(JobApiError.from_data(e))
+
+            pipeline = Pipeline(id=workers.new_id(), jobs=jobs, fifos=fifos, held_fds=held_fds)
+            held_fds = []
+            return Ok(pipeline)
+        finally:
+            for fd in held_fds:
+                os.close(fd)
+
+    async def _start_cached_job(
+        self, executor: Executor, params: StartJobParams, cached: CachedResult
+    ) -> Result[StartJobResult, JobApiError]:
+        match self._fd_budget.check():
+            case Err(exhausted):
+                return Err(JobApiError.from_data(exhausted))
+
+        match await try_open_multiple(
+            (pathlib.Path(params.stdio.stdout), Mode.W),
+            (pathlib.Path(params.stdio.stderr), Mode.W),
+            timeout_s=self.config.open_timeout_s,
+            abort=connection_closed(),
+        ):
+            case Ok(stdio_files):
+                pass
+            case Err(file_error):
+                return Err(JobApiError.from_data(file_error.to_file_error()))
+
+        async def replay() -> None:
+            async with stdio_files:
+                stdout_file, stderr_file = stdio_files.files
+                if await write_all(stdout_file, cached.stdout) == len(cached.stdout):
+                    await write_all(stderr_file, cached.stderr)
+
+        job = CachedJob(
+            id=workers.new_id(),
+            profile=executor.profile,
+            executor_id=executor.id,
             cwd=params.cwd,
-            stdio=params.stdio,
             args=params.args,
+            exit_code=cached.exit_code,
+            replay_task=asyncio.create_task(replay()),
+        )
+        self._jobs[job.id] = job
+        job.replay_task.add_done_callback(lambda _: self._retire(job.id))
+        return Ok(StartJobResult(job.info))
+
+    async def _forward_and_cache(self, job: Job, key: CacheKey, params: StartJobParams) -> None:
+        """
+        Copies a cacheable job's output to the client (unless it asked for the output to be
+        captured), and caches the result once the job exits
+        """
+
+        output = job.output
+        assert output is not None
+        stdout = output.buffer(OutputStream.STDOUT)
+        stderr = output.buffer(OutputStream.STDERR)
+
+        if not params.capture:
+            # Not abandoned with the connection, the client may well close it once the job
+            # has started
+            match await try_open_multiple(
+                (pathlib.Path(params.stdio.stdout), Mode.W),
+                (pathlib.Path(params.stdio.stderr), Mode.W),
+                timeout_s=self.config.open_timeout_s,
+            ):
+                case Ok(stdio_files):
+                    async with stdio_files, asyncio.TaskGroup() as tg:
+                        tg.create_task(copy_output(stdout, 0, stdio_files.files[0]))
+                        tg.create_task(copy_output(stderr, 0, stdio_files.files[1]))
+                case Err(file_error):
+                    _LOGGER.error(
+                        "Failed to forward output of job %s: %s",
+                        job.id,
+                        file_error,
+                        extra={"job_id": job.id},
+                    )
+
+        exit_code = await job.wait()
+        await stdout.wait_closed()
+        await stderr.wait_closed()
+
+        # Only cache complete runs from the current executor. Exit codes past 128 are
+        # signals, which says more about who sent them than about the command.
+        current_executor = self._current_executors.get(job.profile)
+        if (
+            exit_code is None
+            or exit_code >= 128
+            or job.timed_out
+            or stdout.start_offset > 0
+            or stderr.start_offset > 0
+            or current_executor is None
+            or current_executor.id != job.executor_id
         ):
+            return
+
+        self._cache.put(
+            key,
+            exit_code,
+            stdout.read(0, stdout.end_offset)[1],
+            stderr.read(0, stderr.end_offset)[1],
+        )
+
+    def _time_out_job(self, job: Job, kill_after_s: float | None) -> None:
+        if job.status == JobStatus.DONE:
+            return
+
+        _LOGGER.info("Job %s timed out", job.id, extra={"job_id": job.id})
+        try:
+            job.time_out()
+        except ProcessLookupError:
+            return
+
+        if kill_after_s is not None:
+            deadline = self._deadlines.call_later(kill_after_s, partial(self._kill_job, job))
+            job.add_done_callback(lambda _: deadline.cancel())
+
+    def _kill_job(self, job: Job) -> None:
+        if job.status == JobStatus.DONE:
+            return
+
+        _LOGGER.info(
+            "Job %s did not exit after timing out, killing it", job.id, extra={"job_id": job.id}
+        )
+        try:
+            job.kill()
+        except ProcessLookupError:
+            pass
+
+    async def _start_on_executor(
+        self, profile: str, params: StartJobParams, stdio: Stdio, retry: bool = True
+    ) -> Result[Job, FifoCreateFailed | FileOpenFailed | ExecutorNotRunning | JobStartFailed]:
+        # The executor may have changed (or be restarting) while the start was queued
+        match await self._wait_for_executor(profile):
+            case Ok(executor):
+                pass
+            case Err() as err:
+                return err
+
+        match await executor.start_job(cwd=params.cwd, stdio=stdio, args=params.args):
+            case Err(ExecutorNotRunning()) if retry:
+                # It died before taking the request, so its replacement can have it
+                await executor.wait_closed()
+                return await self._start_on_executor(profile, params, stdio, retry=False)
+            case result:
+                return result
+
+    async def _dispatch_job(
+        self, profile: str, params: StartJobParams, scheduling: JobScheduling
+    ) -> Result[Job, JobApiError]:
+        match self._fd_budget.check():
+            case Err(exhausted):
+                return Err(JobApiError.from_data(exhausted))
+
+        output: JobOutput | None = None
+        stdio = params.stdio
+        if params.capture or params.cacheable:
+            with tracing.span("output.setup"):
+                made_output = await make_job_output(
+                    self.config.capture.memory_bytes, self.config.capture.max_bytes
+                )
+            match made_output:
+                case Ok(output):
+                    stdio = Stdio(
+                        stdin=params.stdio.stdin,
+                        stdout=output.path(OutputStream.STDOUT),
+                        stderr=output.path(OutputStream.STDERR),
+                    )
+                case Err(file_error):
+                    return Err(JobApiError.from_data(file_error.to_file_error()))
+
+        match await self._start_on_executor(profile, params, stdio):
             case Ok(job):
-                self._jobs[job.id] = job
-                return Ok(StartJobResult(job.info))
+                self._apply_scheduling(job, scheduling)
+                self._attach_cgroup(job)
+                if output is not None:
+                    job.output = output
+                    job.add_done_callback(lambda _: output.job_exited())
+                return Ok(job)
             case Err(e):
+                if output is not None:
+                    output.release()
                 match e:
                     case FileOpenFailed() | FifoCreateFailed() as file_error:
                         return Err(JobApiError.from_data(file_error.to_file_error()))
                 return Err(JobApiError.from_data(e))
 
+    def _apply_scheduling(self, job: Job, scheduling: JobScheduling) -> None:
+        if not self._executors[job.executor_id].transport.local:
+            return
+
+        if scheduling.cpu_set is None and (placer := self._placer) is not None:
+            group, cpu_set = placer.place()
+            job.add_done_callback(lambda _: placer.release(group))
+            scheduling = replace(scheduling, cpu_set=cpu_set)
+
+        if scheduling != JobScheduling():
+            with tracing.span("placement.apply"):
+                placement.apply(job.pid, scheduling)
+
+    def _attach_cgroup(self, job: Job) -> None:
+        if self.config.cgroup is not None and self._executors[job.executor_id].transport.local:
+            job.attach_cgroup(self._make_cgroup(self.config.cgroup, job))
+
+    async def _make_cgroup(self, config: CgroupConfig, job: Job) -> JobCgroup | None:
+        with tracing.span("cgroup.attach"):
+            return (await make_job_cgroup(config, job.id, job.pid)).unwrap_or(None)
+
+    def _job_output(self, id: str) -> Result[JobOutput, JobApiError]:
+        if id not in self._jobs:
+            return Err(JobApiError.from_data(JobNotFound(id)))
+
+        job = self._jobs[id]
+        if isinstance(job, CachedJob) or job.output is None:
+            return Err(JobApiError.from_data(OutputNotCaptured(id)))
+        return Ok(job.output)
+
+    @implements(JobMethod.READ_OUTPUT)
+    async def read_output(self, params: ReadOutputParams) -> Result[ReadOutputResult, JobApiError]:
+        match self._job_output(params.id):
+            case Ok(output):
+                buffer = output.buffer(params.stream)
+            case Err() as err:
+                return err
+
+        offset = params.offset
+        if offset < 0:
+            offset = max(buffer.end_offset + offset, buffer.start_offset)
+        if params.wait:
+            await buffer.wait_for(offset)
+
+        offset, data = buffer.read(offset, params.max_bytes)
+        next_offset = offset + len(data)
+        return Ok(
+            ReadOutputResult(
+                offset=offset,
+                next_offset=next_offset,
+                data_base64=base64.b64encode(data).decode(),
+                eof=buffer.closed and next_offset == buffer.end_offset,
+            )
+        )
+
+    @implements(JobMethod.ATTACH_JOB)
+    async def attach_job(self, params: AttachJobParams) -> Result[AttachJobResult, JobApiError]:
+        match self._job_output(params.id):
+            case Ok(output):
+                pass
+            case Err() as err:
+                return err
+
+        match await try_open_multiple(
+            (pathlib.Path(params.stdout), Mode.W),
+            (pathlib.Path(params.stderr), Mode.W),
+            timeout_s=self.config.open_timeout_s,
+            abort=connection_closed(),
+        ):
+            case Ok(stdio_files):
+                pass
+            case Err(file_error):
+                return Err(JobApiError.from_data(file_error.to_file_error()))
+
+        async with stdio_files:
+            async with asyncio.TaskGroup() as tg:
+                stdout_task = tg.create_task(
+                    copy_output(
+                        output.buffer(OutputStream.STDOUT),
+                        params.stdout_offset,
+                        stdio_files.files[0],
+                    )
+                )
+                stderr_task = tg.create_task(
+                    copy_output(
+                        output.buffer(OutputStream.STDERR),
+                        params.stderr_offset,
+                        stdio_files.files[1],
+                    )
+                )
+
+        return Ok(AttachJobResult(stdout_task.result(), stderr_task.result()))
+
     @implements(JobMethod.SIGNAL_JOB)
     async def signal_job(self, params: SignalJobParams) -> Result[SignalJobResult, JobApiError]:
+        if params.id in self._pipelines:
+            return Ok(SignalJobResult(self._pipelines[params.id].signal(params.signal)))
+
         if params.id not in self._jobs:
             return Err(JobApiError.from_data(JobNotFound(params.id)))
 
@@ -169,22 +1227,61 @@ class JobApiImpl:
 
     @implements(JobMethod.WAIT_FOR_JOB)
     async def wait_for_job(self, params: WaitForJobParams) -> Result[WaitForJobResult, JobApiError]:
+        if params.id in self._pipelines:
+            pipeline = self._pipelines[params.id]
+            exit_codes = [-1 if code is None else code for code in await pipeline.wait()]
+            # Like a shell, the pipeline's exit code is its last stage's
+            return Ok(
+                WaitForJobResult(
+                    exit_codes[-1], timed_out=pipeline.timed_out, exit_codes=exit_codes
+                )
+            )
+
         if params.id not in self._jobs:
             return Err(JobApiError.from_data(JobNotFound(params.id)))
 
-        exit_code = await self._jobs[params.id].wait()
+        job = self._jobs[params.id]
+        exit_code = await job.wait()
+        if (forwarder := self._output_forwarders.get(params.id)) is not None:
+            await asyncio.shield(forwarder)
         if exit_code is None:
             exit_code = -1
-        return Ok(WaitForJobResult(exit_code))
+        return Ok(WaitForJobResult(exit_code, timed_out=job.timed_out))
 
     @implements(JobMethod.STOP_SERVER)
     async def stop_server(self, _: StopServerParams) -> Result[StopServerResult, JobApiError]:
         self.stop_event.set()
         return Ok(StopServerResult())
 
+    @implements(JobMethod.DUMP_TRACE)
+    async def dump_trace(self, params: DumpTraceParams) -> Result[DumpTraceResult, JobApiError]:
+        path = pathlib.Path(
+            params.path or run_dir_path(f"trace.{os.getpid()}.{int(time.time())}.json")
+        )
+        try:
+            num_events = await asyncio.get_running_loop().run_in_executor(
+                None, tracing.TRACER.dump, path, params.clear
+            )
+        except OSError as e:
+            _LOGGER.error("Failed to dump trace to %s: %r", path, e)
+            return Err(
+                JobApiError.from_data(FileError(FileErrorType.CREATE_FAILED, str(path), repr(e)))
+            )
+
+        _LOGGER.info("Dumped %d trace events to %s", num_events, path)
+        return Ok(DumpTraceResult(str(path), num_events))
+
+    def request_trace_dump(self) -> None:
+        """
+        Dumps the trace to the default path in the background, e.g. in response to SIGUSR1
+        """
+
+        self._trace_dump_task = asyncio.create_task(self.dump_trace(DumpTraceParams()))
+
     @implements(JobMethod.LIST_JOBS)
     async def list_jobs(self, params: ListJobsParams) -> Result[ListJobsResult, JobApiError]:
         if params.include_completed:
+            self._prune_finished()
             return Ok(ListJobsResult({job.id: job.info for job in self._jobs.values()}))
 
         return Ok(
@@ -214,5 +1311,55 @@ class JobApiImpl:
             )
         )
 
+    @implements(JobMethod.FD_USAGE)
+    async def fd_usage(self, _: FdUsageParams) -> Result[FdUsageResult, JobApiError]:
+        return Ok(
+            FdUsageResult(
+                open_fds=fds.open_fds(),
+                limit=fds.limit(),
+                reserve=self._fd_budget.reserve,
+                jobs=sum(job.held_fds for job in self._jobs.values()),
+                executors=sum(executor.held_fds for executor in self._executors.values()),
+            )
+        )
+
+    @implements(JobMethod.CONCURRENCY)
+    async def concurrency(self, _: ConcurrencyParams) -> Result[ConcurrencyResult, JobApiError]:
+        controller = self._concurrency_controller
+        return Ok(
+            ConcurrencyResult(
+                max_running=self._scheduler.max_running,
+                running=self._scheduler.running,
+                queued=sum(self._scheduler.queued.values()),
+                adaptive=controller is not None,
+                decisions=list(controller.decisions) if controller is not None else [],
+            )
+        )
+
+    @implements(JobMethod.LOOP_LAG)
+    async def loop_lag(self, params: LoopLagParams) -> Result[LoopLagResult, JobApiError]:
+        result = self._loop_monitor.result()
+        if params.reset:
+            self._loop_monitor.reset()
+        return Ok(result)
+
+    @implements(JobMethod.PROFILE)
+    async def profile(self, params: ProfileParams) -> Result[ProfileResult, JobApiError]:
+        match await profiling.profile(params.duration_s, params.interval_s):
+            case Ok(result):
+                return Ok(result)
+            case Err(e):
+                return Err(JobApiError.from_data(e))
+
+    @implements(JobMethod.MEMORY_SNAPSHOT)
+    async def memory_snapshot(
+        self, params: MemorySnapshotParams
+    ) -> Result[MemorySnapshotResult, JobApiError]:
+        match await profiling.memory_snapshot(params.duration_s, params.limit):
+            case Ok(result):
+                return Ok(result)
+            case Err(e):
+                return Err(JobApiError.from_data(e))
+
     def method_set(self) -> MethodSet:
         return make_method_set(JobApiImpl, self)
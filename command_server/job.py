@@ -1,25 +1,123 @@
 import asyncio
+import logging
 import os
+import re
+import sys
+import time
+from collections.abc import Callable, Coroutine, Iterable
 from dataclasses import dataclass
-from typing import Self
+from functools import partial
+from signal import Signals
+from typing import Any, Self
 
-from .api import JobInfo, JobState, JobStatus, Signal
+from result import Result
+
+from .api import JobInfo, JobState, JobStatus, JobUsage, Signal
+from .cgroups import JobCgroup
+from .files import TempFifo
+from .output import JobOutput
 from .server_config import SignalTranslator
-from .token_io import TokenReader
+from .token_io import TokenSource
+
+_LOGGER = logging.getLogger("job")
+
+# Format of the POSIX shell's `times` builtin, e.g. 1m2.500000s
+_SHELL_TIME = re.compile(r"(\d+)m(\d+(?:\.\d*)?)s")
+
+
+def _parse_seconds(value: str | None) -> float | None:
+    if not value:
+        return None
+
+    if match := _SHELL_TIME.fullmatch(value):
+        return int(match[1]) * 60 + float(match[2])
+
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _parse_int(value: str | None) -> int | None:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def _usage(started_at: float, finished_at: float | None, resources: dict[str, str]) -> JobUsage:
+    return JobUsage(
+        wall_time_s=(finished_at or time.time()) - started_at,
+        user_cpu_s=_parse_seconds(resources.get("user_cpu")),
+        sys_cpu_s=_parse_seconds(resources.get("sys_cpu")),
+        max_rss_kb=_parse_int(resources.get("max_rss_kb")),
+    )
 
 
 @dataclass
 class Job:
     id: str
+    profile: str
     executor_id: str
     pid: int
     cwd: str
     args: list[str]
     signal_translator: SignalTranslator
-    exit_reader: TokenReader
+    exit_reader: TokenSource
+    # How signals reach the job, which is the executor's job if it's on another host
+    send_signal: Callable[[int, int], None] = os.kill
 
     def __post_init__(self) -> None:
-        self._exit_task = asyncio.create_task(self.exit_reader.read_int())
+        self.started_at = time.time()
+        self.finished_at: float | None = None
+        self.resources: dict[str, str] = dict()
+        self.cgroup: JobCgroup | None = None
+        self._cgroup_attach: asyncio.Future[JobCgroup | None] | None = None
+        self.output: JobOutput | None = None
+        self.timed_out = False
+        self._exit_task = asyncio.create_task(self._read_exit())
+
+    async def _read_exit(self) -> Result[int, str]:
+        """
+        Reads the exit code, followed by any key=value resource usage tokens
+        """
+
+        try:
+            exit_code = await self.exit_reader.read_int()
+            self.finished_at = time.time()
+
+            resources: dict[str, str] = dict()
+            try:
+                if self._cgroup_attach is not None:
+                    # The job can exit before it has been moved into its cgroup
+                    self.cgroup = await self._cgroup_attach
+                if self.cgroup is not None:
+                    resources |= await self.cgroup.collect()
+            except Exception as e:
+                # The job's exit is still reported, only without the cgroup's usage
+                _LOGGER.error(
+                    "Failed to collect the cgroup of job %s: %r",
+                    self.id,
+                    e,
+                    extra={"job_id": self.id},
+                )
+            while token := await self.exit_reader.read():
+                key, _, value = token.partition("=")
+                resources[key] = value
+            self.resources = resources
+        finally:
+            # Nothing else is sent on the channel, so its FIFO can go right away
+            await self.exit_reader.close()
+
+        return exit_code
+
+    def attach_cgroup(self, attach: Coroutine[Any, Any, JobCgroup | None]) -> None:
+        """
+        Moves the job into the cgroup attach makes. Its exit is only handled once that is
+        done, so the cgroup is always collected.
+        """
+
+        self._cgroup_attach = asyncio.ensure_future(attach)
 
     @property
     def state(self) -> JobState:
@@ -27,17 +125,23 @@ class Job:
             return JobState(
                 status=JobStatus.DONE,
                 exit_code=self._exit_task.result().unwrap_or(None),
+                timed_out=self.timed_out,
             )
 
         return JobState(
             status=JobStatus.RUNNING,
             exit_code=None,
+            timed_out=self.timed_out,
         )
 
     @property
     def status(self) -> JobStatus:
         return self.state.status
 
+    @property
+    def usage(self) -> JobUsage:
+        return _usage(self.started_at, self.finished_at, self.resources)
+
     @property
     def info(self) -> JobInfo:
         return JobInfo(
@@ -46,17 +150,45 @@ class Job:
             cwd=self.cwd,
             args=self.args,
             state=self.state,
+            usage=self.usage,
         )
 
+    @property
+    def held_fds(self) -> int:
+        # The exit FIFO until the exit has been read from it, and any captured output's
+        held = int(not self._exit_task.done() and self.exit_reader.fifo is not None)
+        if self.output is not None:
+            held += self.output.held_fds
+        return held
+
+    def add_done_callback(self, callback: Callable[["Job"], None]) -> None:
+        def on_exit(task: asyncio.Task[Result[int, str]]) -> None:
+            # The read is only cancelled when the server shuts down, not when the job exits
+            if not task.cancelled():
+                callback(self)
+
+        self._exit_task.add_done_callback(on_exit)
+
     async def wait(self) -> int | None:
         result = await asyncio.shield(self._exit_task)
         return result.unwrap_or(None)
 
     def signal(self, sig: Signal) -> Signal:
         actual_signal = self.signal_translator.translate(sig)
-        os.kill(self.pid, actual_signal.value)
+        self.send_signal(self.pid, actual_signal.value)
         return actual_signal
 
+    def time_out(self) -> Signal:
+        """
+        Marks the job as timed out and asks it to terminate
+        """
+
+        self.timed_out = True
+        return self.signal(Signal.TERM)
+
+    def kill(self) -> None:
+        self.send_signal(self.pid, Signals.SIGKILL)
+
     async def close(self) -> int | None:
         if self.status == JobStatus.RUNNING:
             # TODO force killing?
@@ -69,3 +201,351 @@ class Job:
 
     async def __aexit__(self, exc_type, exc, tb) -> None:
         await self.close()
+
+
+def _open_fifo_ids(pid: int) -> set[tuple[int, int]]:
+    """
+    The (device, inode) of every file a process has open
+    """
+
+    # Only reads procfs, so it doesn't block
+    ids: set[tuple[int, int]] = set()
+    try:
+        names = os.listdir(f"/proc/{pid}/fd")
+    except OSError:
+        return ids
+
+    for name in names:
+        try:
+            stat = os.stat(f"/proc/{pid}/fd/{name}")
+        except OSError:
+            continue
+        ids.add((stat.st_dev, stat.st_ino))
+    return ids
+
+
+# How often a pipeline checks whether its stages have opened their FIFOs
+_OPEN_POLL_MIN_S = 0.001
+_OPEN_POLL_MAX_S = 0.1
+
+
+@dataclass
+class Pipeline:
+    """
+    Jobs started together, with a FIFO from each one's stdout to the next one's stdin
+    """
+
+    id: str
+    jobs: list[Job]
+    fifos: list[TempFifo]
+    # Hold both ends of each FIFO open, so neither stage blocks opening it, and output
+    # written before the next stage opens it isn't thrown away. Each is closed (-1) once
+    # both of its FIFO's stages have opened their end, or exited.
+    held_fds: list[int]
+
+    def __post_init__(self) -> None:
+        self._unlink_tasks: set[asyncio.Task[None]] = set()
+        self._timed_out = False
+        self._fifo_ids = [(stat.st_dev, stat.st_ino) for stat in map(os.fstat, self.held_fds)]
+        for index, job in enumerate(self.jobs):
+            job.add_done_callback(partial(self._job_exited, index))
+        self._release_task = asyncio.create_task(self._release_held())
+        self._exit_task = asyncio.create_task(self._wait_all())
+
+    def _close_opened(self) -> None:
+        open_ids: dict[int, set[tuple[int, int]]] = {}
+
+        def has_opened(job: Job, fifo_id: tuple[int, int]) -> bool:
+            if job.status != JobStatus.RUNNING:
+                return True
+            if job.pid not in open_ids:
+                open_ids[job.pid] = _open_fifo_ids(job.pid)
+            return fifo_id in open_ids[job.pid]
+
+        for index, fd in enumerate(self.held_fds):
+            if fd >= 0 and all(
+                has_opened(job, self._fifo_ids[index]) for job in self.jobs[index : index + 2]
+            ):
+                os.close(fd)
+                self.held_fds[index] = -1
+
+    async def _release_held(self) -> None:
+        # Executors answer with a stage's pid before it opens its stdio, so the only way
+        # to tell it has is to look at its fds
+        delay = _OPEN_POLL_MIN_S
+        while True:
+            self._close_opened()
+            if all(fd < 0 for fd in self.held_fds):
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _OPEN_POLL_MAX_S)
+
+    def _job_exited(self, index: int, _: Job) -> None:
+        self._close_opened()
+        # A FIFO is only unlinked once nothing can still open it
+        for fifo_index in (index - 1, index):
+            if 0 <= fifo_index < len(self.fifos) and all(
+                job.status != JobStatus.RUNNING for job in self.jobs[fifo_index : fifo_index + 2]
+            ):
+                task = asyncio.create_task(self.fifos[fifo_index].unlink())
+                self._unlink_tasks.add(task)
+                task.add_done_callback(self._unlink_tasks.discard)
+
+    async def _wait_all(self) -> list[int | None]:
+        exit_codes = list(await asyncio.gather(*(job.wait() for job in self.jobs)))
+        await self._release_task
+        # The stages are archived on their own, so only their outcome is kept here
+        self._timed_out = any(job.timed_out for job in self.jobs)
+        self.jobs = []
+        self.fifos = []
+        return exit_codes
+
+    @property
+    def timed_out(self) -> bool:
+        return self._timed_out or any(job.timed_out for job in self.jobs)
+
+    @property
+    def exit_codes(self) -> list[int | None]:
+        return self._exit_task.result()
+
+    def add_done_callback(self, callback: Callable[["Pipeline"], None]) -> None:
+        def on_exit(task: asyncio.Task[list[int | None]]) -> None:
+            if not task.cancelled():
+                callback(self)
+
+        self._exit_task.add_done_callback(on_exit)
+
+    async def wait(self) -> list[int | None]:
+        return await asyncio.shield(self._exit_task)
+
+    def signal(self, sig: Signal) -> Signal:
+        actual_signal = sig
+        for job in self.jobs:
+            if job.status == JobStatus.RUNNING:
+                try:
+                    actual_signal = job.signal(sig)
+                except ProcessLookupError:
+                    pass
+        return actual_signal
+
+
+@dataclass(slots=True)
+class FinishedPipeline:
+    """
+    A pipeline whose stages have all exited, which can still be waited for
+    """
+
+    id: str
+    exit_codes: tuple[int | None, ...]
+    timed_out: bool
+    finished_at: float
+
+    @staticmethod
+    def archive(pipeline: Pipeline) -> "FinishedPipeline":
+        return FinishedPipeline(
+            id=pipeline.id,
+            exit_codes=tuple(pipeline.exit_codes),
+            timed_out=pipeline.timed_out,
+            finished_at=time.time(),
+        )
+
+    async def wait(self) -> list[int | None]:
+        return list(self.exit_codes)
+
+    def signal(self, sig: Signal) -> Signal:
+        return sig
+
+
+@dataclass(slots=True)
+class FinishedJob:
+    """
+    A job which has exited, either archived when it did or restored from the journal. It
+    only keeps what's needed to describe the job, since the server holds on to every one.
+    """
+
+    id: str
+    profile: str
+    executor_id: str
+    pid: int
+    cwd: str
+    args: tuple[str, ...]
+    exit_code: int | None
+    timed_out: bool
+    started_at: float
+    finished_at: float | None
+    user_cpu_s: float | None = None
+    sys_cpu_s: float | None = None
+    max_rss_kb: int | None = None
+    # Output captured by the server, which can still be read back
+    output: JobOutput | None = None
+
+    @staticmethod
+    def create(
+        *,
+        id: str,
+        profile: str,
+        executor_id: str,
+        pid: int,
+        cwd: str,
+        args: Iterable[str],
+        exit_code: int | None,
+        timed_out: bool,
+        resources: dict[str, str],
+        started_at: float,
+        finished_at: float | None,
+        output: JobOutput | None = None,
+    ) -> "FinishedJob":
+        # Most jobs share their profile, executor, working dir and many of their args
+        return FinishedJob(
+            id=id,
+            profile=sys.intern(profile),
+            executor_id=sys.intern(executor_id),
+            pid=pid,
+            cwd=sys.intern(cwd),
+            args=tuple(sys.intern(arg) for arg in args),
+            exit_code=exit_code,
+            timed_out=timed_out,
+            started_at=started_at,
+            finished_at=finished_at,
+            user_cpu_s=_parse_seconds(resources.get("user_cpu")),
+            sys_cpu_s=_parse_seconds(resources.get("sys_cpu")),
+            max_rss_kb=_parse_int(resources.get("max_rss_kb")),
+            output=output,
+        )
+
+    @staticmethod
+    def archive(job: Job) -> "FinishedJob":
+        return FinishedJob.create(
+            id=job.id,
+            profile=job.profile,
+            executor_id=job.executor_id,
+            pid=job.pid,
+            cwd=job.cwd,
+            args=job.args,
+            exit_code=job.state.exit_code,
+            timed_out=job.timed_out,
+            resources=job.resources,
+            started_at=job.started_at,
+            finished_at=job.finished_at,
+            output=job.output,
+        )
+
+    @property
+    def resources(self) -> dict[str, str]:
+        resources: dict[str, str] = dict()
+        if self.user_cpu_s is not None:
+            resources["user_cpu"] = str(self.user_cpu_s)
+        if self.sys_cpu_s is not None:
+            resources["sys_cpu"] = str(self.sys_cpu_s)
+        if self.max_rss_kb is not None:
+            resources["max_rss_kb"] = str(self.max_rss_kb)
+        return resources
+
+    @property
+    def held_fds(self) -> int:
+        # Captured output can still be draining
+        return self.output.held_fds if self.output is not None else 0
+
+    @property
+    def state(self) -> JobState:
+        return JobState(
+            status=JobStatus.DONE,
+            exit_code=self.exit_code,
+            timed_out=self.timed_out,
+        )
+
+    @property
+    def status(self) -> JobStatus:
+        return JobStatus.DONE
+
+    @property
+    def usage(self) -> JobUsage:
+        return JobUsage(
+            wall_time_s=(self.finished_at or time.time()) - self.started_at,
+            user_cpu_s=self.user_cpu_s,
+            sys_cpu_s=self.sys_cpu_s,
+            max_rss_kb=self.max_rss_kb,
+        )
+
+    @property
+    def info(self) -> JobInfo:
+        return JobInfo(
+            id=self.id,
+            executor_id=self.executor_id,
+            cwd=self.cwd,
+            args=list(self.args),
+            state=self.state,
+            usage=self.usage,
+        )
+
+    async def wait(self) -> int | None:
+        return self.exit_code
+
+    def signal(self, sig: Signal) -> Signal:
+        # There is nothing left to signal
+        return sig
+
+    async def close(self) -> None:
+        pass
+
+
+@dataclass
+class CachedJob:
+    """
+    A job answered from the result cache, without running anything. It finishes once the
+    cached output has been replayed to the client's stdio.
+    """
+
+    id: str
+    profile: str
+    executor_id: str
+    cwd: str
+    args: list[str]
+    exit_code: int
+    replay_task: asyncio.Task[None]
+
+    def __post_init__(self) -> None:
+        self.started_at = time.time()
+        self.timed_out = False
+
+    @property
+    def state(self) -> JobState:
+        return JobState(
+            status=JobStatus.DONE if self.replay_task.done() else JobStatus.RUNNING,
+            exit_code=self.exit_code if self.replay_task.done() else None,
+        )
+
+    @property
+    def status(self) -> JobStatus:
+        return self.state.status
+
+    @property
+    def info(self) -> JobInfo:
+        return JobInfo(
+            id=self.id,
+            executor_id=self.executor_id,
+            cwd=self.cwd,
+            args=self.args,
+            state=self.state,
+            cached=True,
+        )
+
+    @property
+    def held_fds(self) -> int:
+        return 0
+
+    async def wait(self) -> int | None:
+        try:
+            await asyncio.shield(self.replay_task)
+        except asyncio.CancelledError:
+            # Closing stops the replay, but the job's result stands
+            if not self.replay_task.cancelled():
+                raise
+        return self.exit_code
+
+    def signal(self, sig: Signal) -> Signal:
+        # There is no process to signal
+        return sig
+
+    async def close(self) -> None:
+        self.replay_task.cancel()
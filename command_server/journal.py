@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import os
+import pathlib
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from typing import Any, TextIO
+
+_LOGGER = logging.getLogger("journal")
+
+_START = "start"
+_EXIT = "exit"
+
+
+@dataclass
+class JournalEntry:
+    id: str
+    profile: str
+    executor_id: str
+    pid: int
+    cwd: str
+    args: list[str]
+    exit_fifo: str
+    started_at: float
+    finished: bool = False
+    exit_code: int | None = None
+    timed_out: bool = False
+    resources: dict[str, str] = field(default_factory=dict)
+    finished_at: float | None = None
+
+
+def _dumps(record: dict[str, Any]) -> str:
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def _start_record(entry: JournalEntry) -> dict[str, Any]:
+    return {
+        "t": _START,
+        "id": entry.id,
+        "profile": entry.profile,
+        "executor_id": entry.executor_id,
+        "pid": entry.pid,
+        "cwd": entry.cwd,
+        "args": entry.args,
+        "exit_fifo": entry.exit_fifo,
+        "started_at": entry.started_at,
+    }
+
+
+def _exit_record(entry: JournalEntry) -> dict[str, Any]:
+    return {
+        "t": _EXIT,
+        "id": entry.id,
+        "exit_code": entry.exit_code,
+        "timed_out": entry.timed_out,
+        "resources": entry.resources,
+        "finished_at": entry.finished_at,
+    }
+
+
+def replay(path: pathlib.Path) -> tuple[dict[str, JournalEntry], int]:
+    """
+    Rebuilds the state of every job in the journal, returning it with the number of
+    records read. A truncated last line (from a crash mid-write) is skipped.
+    """
+
+    entries: dict[str, JournalEntry] = dict()
+    num_records = 0
+    try:
+        file = open(path, "r")
+    except FileNotFoundError:
+        return entries, 0
+
+    with file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                _LOGGER.warning("Skipping corrupt journal record in %s", path)
+                continue
+
+            num_records += 1
+            match record.pop("t", None):
+                case "start":
+                    entries[record["id"]] = JournalEntry(**record)
+                case "exit":
+                    if (entry := entries.get(record["id"])) is not None:
+                        entry.finished = True
+                        entry.exit_code = record["exit_code"]
+                        entry.timed_out = record["timed_out"]
+                        entry.resources = record["resources"]
+                        entry.finished_at = record["finished_at"]
+
+    return entries, num_records
+
+
+def _write_snapshot(path: pathlib.Path, entries: list[JournalEntry]) -> None:
+    tmp_path = path.with_name(path.name + ".compact")
+    with open(tmp_path, "w") as file:
+        for entry in entries:
+            file.write(_dumps(_start_record(entry)))
+            if entry.finished:
+                file.write(_dumps(_exit_record(entry)))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class JobJournal:
+    """
+    Append-only JSONL log of job starts and exits, so a restarted server can answer for
+    jobs started by its predecessor. Once the log holds more than twice as many records as
+    are needed to describe the current jobs, it is compacted in the background by writing
+    a snapshot from `snapshot` and swapping it in.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        snapshot: Callable[[], Iterable[JournalEntry]],
+        min_compact_records: int = 10_000,
+    ) -> None:
+        self.path = path
+        self._snapshot = snapshot
+        self._min_compact_records = min_compact_records
+        self._num_records = 0
+        self._compact_at = min_compact_records
+        self._file: TextIO | None = None
+        self._pending: list[str] | None = None
+        self._compact_task: asyncio.Task[None] | None = None
+
+    def open(self) -> dict[str, JournalEntry]:
+        entries, self._num_records = replay(self.path)
+        self._compact_at = max(self._min_compact_records, 2 * self._num_records)
+        self._file = open(self.path, "a", buffering=1)
+        _LOGGER.info("Replayed %d records for %d jobs", self._num_records, len(entries))
+        return entries
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def record_start(self, entry: JournalEntry) -> None:
+        self._append(_start_record(entry))
+
+    def record_exit(self, entry: JournalEntry) -> None:
+        self._append(_exit_record(entry))
+
+    def compact(self) -> None:
+        """
+        Compacts the journal in the background now, e.g. once many of its jobs were dropped
+        """
+
+        if self._file is not None and self._compact_task is None:
+            self._compact_task = asyncio.create_task(self._compact())
+
+    def _append(self, record: dict[str, Any]) -> None:
+        if self._file is None:
+            return
+
+        line = _dumps(record)
+        # Records are small, and the run dir is usually a tmpfs, so write them directly
+        self._file.write(line)
+        if self._pending is not None:
+            self._pending.append(line)
+
+        self._num_records += 1
+        if self._num_records >= self._compact_at and self._compact_task is None:
+            self._compact_task = asyncio.create_task(self._compact())
+
+    async def _compact(self) -> None:
+        entries = list(self._snapshot())
+        self._pending = []
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, _write_snapshot, self.path, entries
+            )
+        except Exception as e:
+            _LOGGER.error("Failed to compact journal %s", self.path, exc_info=e)
+            self._compact_at = 2 * self._num_records
+            return
+        finally:
+            pending, self._pending = self._pending, None
+            self._compact_task = None
+
+        # Records written during compaction went to the old file
+        self.close()
+        self._file = open(self.path, "a", buffering=1)
+        self._file.writelines(pending)
+
+        num_records = sum(2 if entry.finished else 1 for entry in entries) + len(pending)
+        _LOGGER.info("Compacted journal from %d to %d records", self._num_records, num_records)
+        self._num_records = num_records
+        self._compact_at = max(self._min_compact_records, 2 * num_records)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+"""
+Python implementation of the executor loop.
+
+Unlike posix-executor-loop.sh, jobs are children of this process and are reaped with
+os.wait4, so their full resource usage is reported on the completion FIFO. It expects the
+first two positional arguments passed to the executor:
+
+    exec python3 "$COMMAND_SERVER_LIB/executor_loop.py" "$1" "$2"
+
+These are normally two FIFOs. For the tcp and vsock transports, they are instead the
+address to connect back to the server on (tcp:<host>:<port> or vsock:<cid>:<port>) and the
+key to identify itself with, and every response is framed with the channel it's for.
+
+This file is run in the executor's environment, so it only depends on the standard library.
+"""
+
+import os
+import selectors
+import signal
+import socket
+import sys
+from typing import Any
+
+import executor_snapshot
+
+_HEADER_TOKENS = 6
+
+
+def _unescape(token: str) -> str:
+    result = []
+    i = 0
+    while i < len(token):
+        c = token[i]
+        i += 1
+        if c != "\\" or i >= len(token):
+            result.append(c)
+        else:
+            c = token[i]
+            i += 1
+            result.append("\n" if c == "n" else c)
+    return "".join(result)
+
+
+def _encode(tokens: list[str]) -> bytes:
+    return "".join(
+        token.replace("\\", "\\\\").replace("\n", "\\n") + "\n" for token in tokens
+    ).encode()
+
+
+def _write(fd: int, tokens: list[str]) -> None:
+    data = _encode(tokens)
+    while data:
+        data = data[os.write(fd, data) :]
+
+
+def _is_control(request: list[str]) -> bool:
+    # Requests from the server to the loop itself, e.g. pings, have no working dir
+    return not request[0]
+
+
+def _exit_code(status: int) -> int:
+    # Match the shell convention for jobs killed by a signal
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.waitstatus_to_exitcode(status)
+
+
+class _FifoLink:
+    """
+    Requests and responses over two FIFOs, and each job's exit over the FIFO named in its
+    request
+    """
+
+    def __init__(self, input_path: str, output_path: str) -> None:
+        self._input_path = input_path
+        self._output_path = output_path
+        self._output_fd = -1
+
+    def open_output(self) -> None:
+        self._output_fd = os.open(self._output_path, os.O_WRONLY | os.O_CLOEXEC)
+
+    def open_input(self) -> int:
+        return os.open(self._input_path, os.O_RDONLY | os.O_CLOEXEC)
+
+    def fds(self) -> list[int]:
+        return [self._output_fd] if self._output_fd >= 0 else []
+
+    def respond(self, tokens: list[str]) -> None:
+        _write(self._output_fd, tokens)
+
+    def open_status(self, token: str) -> int:
+        return os.open(token, os.O_WRONLY | os.O_CLOEXEC)
+
+    def report(self, status: int, tokens: list[str]) -> None:
+        try:
+            _write(status, tokens)
+        finally:
+            os.close(status)
+
+    def close_status(self, status: int) -> None:
+        os.close(status)
+
+
+class _SocketLink:
+    """
+    Everything over one connection back to the server, with each response framed as
+    <channel> <num-tokens> <token>..., where the channel is empty for responses to requests
+    and the status token of the request for a job's exit
+    """
+
+    def __init__(self, address: str, key: str) -> None:
+        self._address = address
+        self._key = key
+        self._socket: socket.socket | None = None
+
+    def open_output(self) -> None:
+        kind, _, rest = self._address.partition(":")
+        host, _, port = rest.rpartition(":")
+        if kind == "vsock":
+            self._socket = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+            self._socket.connect((int(host), int(port)))
+        else:
+            self._socket = socket.create_connection((host.strip("[]"), int(port)))
+        self._socket.sendall(_encode([self._key]))
+
+    def open_input(self) -> int:
+        assert self._socket is not None
+        return self._socket.fileno()
+
+    def fds(self) -> list[int]:
+        return [self._socket.fileno()] if self._socket is not None else []
+
+    def _send(self, channel: str, tokens: list[str]) -> None:
+        assert self._socket is not None
+        self._socket.sendall(_encode([channel, str(len(tokens))] + tokens))
+
+    def respond(self, tokens: list[str]) -> None:
+        self._send("", tokens)
+
+    def open_status(self, token: str) -> str:
+        return token
+
+    def report(self, status: str, tokens: list[str]) -> None:
+        self._send(status, tokens)
+
+    def close_status(self, status: str) -> None:
+        pass
+
+
+def _make_link(first_arg: str, second_arg: str) -> _FifoLink | _SocketLink:
+    if first_arg.startswith(("tcp:", "vsock:")):
+        return _SocketLink(first_arg, second_arg)
+    return _FifoLink(first_arg, second_arg)
+
+
+class ExecutorLoop:
+    def __init__(self, first_arg: str, second_arg: str) -> None:
+        self._link = _make_link(first_arg, second_arg)
+        self._buffer = b""
+        self._tokens: list[str] = []
+        self._statuses: dict[int, Any] = {}
+        self._fds: list[int] = []
+
+    def _next_request(self) -> list[str] | None:
+        while b"\n" in self._buffer:
+            line, self._buffer = self._buffer.split(b"\n", 1)
+            self._tokens.append(_unescape(line.decode()))
+
+        if len(self._tokens) < _HEADER_TOKENS:
+            return None
+        num_args = int(self._tokens[_HEADER_TOKENS - 1].partition(":")[0])
+        if len(self._tokens) < _HEADER_TOKENS + num_args:
+            return None
+
+        request = self._tokens[: _HEADER_TOKENS + num_args]
+        self._tokens = self._tokens[_HEADER_TOKENS + num_args :]
+        return request
+
+    def _spawn(self, request: list[str]) -> int:
+        cwd, stdin, stdout, stderr, status_token, num_args = request[:_HEADER_TOKENS]
+        args = request[_HEADER_TOKENS:]
+
+        # Large args are passed as the paths of files to read them from, listed by index
+        # after the number of args
+        for index in filter(None, num_args.partition(":")[2].split(",")):
+            with open(args[int(index)], "rb") as arg_file:
+                args[int(index)] = arg_file.read().decode()
+
+        status = self._link.open_status(status_token)
+        try:
+            pid = os.fork()
+        except OSError:
+            self._link.close_status(status)
+            raise
+        if pid == 0:
+            try:
+                # Only the loop reports the job's exit
+                self._link.close_status(status)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                # Python ignores SIGPIPE, but the writing end of a pipeline relies on it
+                signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+                os.chdir(cwd)
+                for target, path, flags in [
+                    (0, stdin, os.O_RDONLY),
+                    (1, stdout, os.O_WRONLY),
+                    (2, stderr, os.O_WRONLY),
+                ]:
+                    fd = os.open(path, flags)
+                    os.dup2(fd, target)
+                    os.close(fd)
+                self._exec(args)
+            except BaseException as e:
+                try:
+                    os.write(2, f"command-server: {args[0] if args else ''}: {e}\n".encode())
+                finally:
+                    os._exit(127)
+
+        self._statuses[pid] = status
+        return pid
+
+    def _exec(self, args: list[str]) -> None:
+        """
+        Runs the job in the forked child, once its working dir and stdio are set up
+        """
+
+        os.execvp(args[0], args)
+
+    def _close_loop_fds(self) -> None:
+        """
+        Closes the loop's own fds in a forked child which won't exec
+        """
+
+        signal.set_wakeup_fd(-1)
+        for status in self._statuses.values():
+            self._link.close_status(status)
+        for fd in self._link.fds() + self._fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _control(self, args: list[str]) -> int:
+        match args:
+            case []:
+                # Ping
+                return 0
+            case ["signal", pid, sig] if int(pid) in self._statuses:
+                try:
+                    os.kill(int(pid), int(sig))
+                    return 0
+                except OSError:
+                    return -1
+            case _:
+                return -1
+
+    def _reap(self) -> None:
+        while self._statuses:
+            try:
+                pid, status, rusage = os.wait4(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            if pid not in self._statuses:
+                continue
+
+            try:
+                self._link.report(
+                    self._statuses.pop(pid),
+                    [
+                        str(_exit_code(status)),
+                        f"user_cpu={rusage.ru_utime}",
+                        f"sys_cpu={rusage.ru_stime}",
+                        f"max_rss_kb={rusage.ru_maxrss}",
+                    ],
+                )
+            except OSError:
+                # The server is no longer listening
+                pass
+
+    def run(self) -> int:
+        wakeup_read, wakeup_write = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self._fds += [wakeup_read, wakeup_write]
+        signal.set_wakeup_fd(wakeup_write)
+        signal.signal(signal.SIGCHLD, lambda *_: None)
+
+        null_fd = os.open(os.devnull, os.O_RDWR)
+        for target in range(3):
+            os.dup2(null_fd, target)
+        os.close(null_fd)
+
+        self._link.open_output()
+
+        # The server asked for the environment to be saved, for later reloads to restore
+        if snapshot_path := os.environ.pop(executor_snapshot.SNAPSHOT_VAR, None):
+            try:
+                executor_snapshot.save(snapshot_path)
+            except OSError:
+                pass
+
+        # Alert that loading was successful, and we can process requests
+        self._link.respond(["0"])
+
+        input_fd = self._link.open_input()
+
+        selector = selectors.DefaultSelector()
+        self._fds += [input_fd, selector.fileno()]
+        selector.register(input_fd, selectors.EVENT_READ)
+        selector.register(wakeup_read, selectors.EVENT_READ)
+
+        input_open = True
+        while input_open or self._statuses:
+            for key, _ in selector.select():
+                if key.fd == wakeup_read:
+                    try:
+                        os.read(wakeup_read, 4096)
+                    except BlockingIOError:
+                        pass
+                    self._reap()
+                    continue
+
+                chunk = os.read(input_fd, 65536)
+                if not chunk:
+                    input_open = False
+                    selector.unregister(input_fd)
+                    continue
+
+                self._buffer += chunk
+                while (request := self._next_request()) is not None:
+                    if _is_control(request):
+                        self._link.respond([str(self._control(request[_HEADER_TOKENS:]))])
+                        continue
+                    try:
+                        pid = self._spawn(request)
+                    except OSError:
+                        pid = -1
+                    self._link.respond([str(pid)])
+
+            self._reap()
+
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(ExecutorLoop(sys.argv[1], sys.argv[2]).run())
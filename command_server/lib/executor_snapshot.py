@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""
+Saves and restores the state an executor's jobs inherit: exported environment variables,
+working directory, umask and resource limits.
+
+The executor loops save a snapshot just before reporting that they are ready, when the
+server passes a path in $COMMAND_SERVER_SNAPSHOT. The server later starts
+
+    python3 executor_snapshot.py restore <snapshot> <executor args>
+
+in place of the executor, which applies the snapshot and runs executor_loop.py without
+repeating the executor's setup. A snapshot that can't be applied is deleted, so the next
+reload does the full setup again.
+
+Like executor_loop.py, this only depends on the standard library.
+"""
+
+import json
+import os
+import resource
+import sys
+
+SNAPSHOT_VAR = "COMMAND_SERVER_SNAPSHOT"
+
+_RLIMITS = {
+    name: getattr(resource, name)
+    for name in dir(resource)
+    if name.startswith("RLIMIT_") and isinstance(getattr(resource, name), int)
+}
+
+
+def _umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def save(path: str) -> None:
+    env = dict(os.environ)
+    env.pop(SNAPSHOT_VAR, None)
+
+    snapshot = {
+        "env": env,
+        "cwd": os.getcwd(),
+        "umask": _umask(),
+        "rlimits": {name: resource.getrlimit(limit) for name, limit in _RLIMITS.items()},
+    }
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o600)
+    with os.fdopen(fd, "w") as file:
+        json.dump(snapshot, file)
+    os.replace(tmp_path, path)
+
+
+def restore(path: str) -> None:
+    with open(path) as file:
+        snapshot = json.load(file)
+
+    os.chdir(snapshot["cwd"])
+    os.umask(snapshot["umask"])
+    for name, (soft, hard) in snapshot["rlimits"].items():
+        if name not in _RLIMITS:
+            continue
+        try:
+            resource.setrlimit(_RLIMITS[name], (soft, hard))
+        except (ValueError, OSError):
+            # Raising a hard limit needs privileges the original executor may have had
+            pass
+
+    os.environ.clear()
+    os.environ.update(snapshot["env"])
+
+
+def _restore_and_run(path: str, first_arg: str, second_arg: str) -> int:
+    try:
+        restore(path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"command-server: can't restore {path}: {e!r}", file=sys.stderr)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        return 1
+
+    from executor_loop import ExecutorLoop
+
+    return ExecutorLoop(first_arg, second_arg).run()
+
+
+if __name__ == "__main__":
+    match sys.argv[1:]:
+        case ["save", path]:
+            save(path)
+            sys.exit(0)
+        case ["restore", path, first_arg, second_arg, *_]:
+            sys.exit(_restore_and_run(path, first_arg, second_arg))
+        case _:
+            print(
+                "usage: executor_snapshot.py save <snapshot>\n"
+                "       executor_snapshot.py restore <snapshot> <executor args>",
+                file=sys.stderr,
+            )
+            sys.exit(2)
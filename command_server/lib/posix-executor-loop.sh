@@ -23,6 +23,17 @@ read_token () {
     REPLY="${REPLY%?}"
 }
 
+# Whether the pid is one of this loop's jobs, each of which is a child of a subshell below
+is_job () {
+    case "$1" in
+        ''|*[!0-9]*) return 1 ;;
+    esac
+    # ps pads the pids it prints with spaces, which arithmetic expansion drops
+    JOB_PARENT="$(ps -o ppid= -p "$1")" || return 1
+    JOB_GRANDPARENT="$(ps -o ppid= -p "$((JOB_PARENT))")" || return 1
+    [ "$((JOB_GRANDPARENT))" -eq "$$" ]
+}
+
 EXECUTE_COMMAND="$1"
 INPUT="$2"
 OUTPUT="$3"
@@ -31,6 +42,12 @@ exec < /dev/null > /dev/null 2>&1
 
 exec 4> "$OUTPUT"
 
+# The server asked for the environment to be saved, for later reloads to restore
+if [ -n "${COMMAND_SERVER_SNAPSHOT-}" ]; then
+    python3 "$COMMAND_SERVER_LIB/executor_snapshot.py" save "$COMMAND_SERVER_SNAPSHOT"
+    unset COMMAND_SERVER_SNAPSHOT
+fi
+
 # Alert that loading was successful, and we can process requests
 echo 0 >&4
 
@@ -42,7 +59,20 @@ while true; do
     read_token; STDOUT="$REPLY"
     read_token; STDERR="$REPLY"
     read_token; STATUS_PIPE="$REPLY"
-    read_token; NUM_ARGS="$REPLY"
+    read_token; NUM_ARGS="${REPLY%%:*}"
+
+    # Large args are passed as the paths of files to read them from, listed by index
+    # after the number of args, e.g. 3:0,2
+    FILE_ARGS=","
+    case "$REPLY" in
+        *:*) FILE_ARGS=",${REPLY#*:}," ;;
+    esac
+
+    # A request with no working dir or args is a health check from the server
+    if [ -z "$WORKING_DIR" ] && [ "$NUM_ARGS" -eq 0 ]; then
+        echo 0 >&4
+        continue
+    fi
 
     printf '%s\n' "$WORKING_DIR" "$STDIN" "$STDOUT" "$STDERR" "$STATUS_PIPE" "$NUM_ARGS"
 
@@ -50,10 +80,28 @@ while true; do
     set --
     while [ "$i" -lt "$NUM_ARGS" ]; do
         read_token
+        case "$FILE_ARGS" in
+            *",$i,"*)
+                REPLY="$(cat "$REPLY"; echo x)"
+                REPLY="${REPLY%?}"
+                ;;
+        esac
         set -- "$@" "$REPLY"
         : "$((i = i + 1))"
     done
 
+    # Any other request with no working dir is a control message, answered with 0 if it
+    # was carried out and -1 if not. The server signals jobs this way when they aren't in
+    # its pid namespace.
+    if [ -z "$WORKING_DIR" ]; then
+        if [ "$#" -eq 3 ] && [ "$1" = signal ] && is_job "$2" && kill -"$3" "$2"; then
+            echo 0 >&4
+        else
+            echo -1 >&4
+        fi
+        continue
+    fi
+
     printf '%s\n' "$@"
 
     (
@@ -68,7 +116,13 @@ while true; do
         wait "$CHILD_PID" > /dev/null 2>&1
         RESULT="$?"
 
-        printf '%s\n' "$RESULT" >&9
+        # The second line of `times` is the CPU time of waited-for children. It has to go
+        # through a file, since a command substitution would run it in another process.
+        times > "$STATUS_PIPE.times"
+        { read -r _ _; read -r USER_CPU SYS_CPU; } < "$STATUS_PIPE.times"
+        rm -f "$STATUS_PIPE.times"
+
+        printf '%s\n' "$RESULT" "user_cpu=$USER_CPU" "sys_cpu=$SYS_CPU" >&9
     ) &
 
     if [ "$?" -ne 0 ]; then
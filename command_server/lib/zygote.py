@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""
+Executor loop which imports a list of modules once, and runs Python jobs in a fork of
+itself instead of starting a new interpreter for each.
+
+    exec python3 "$COMMAND_SERVER_LIB/zygote.py" "$1" "$2" <module>...
+
+A job is run in the fork when it is `<python> -m <module> [args...]` or
+`<python> <script> [args...]`, and <python> (looked up on $PATH from the job's working
+dir) is this interpreter, so that it would have found the same packages. Any other job is
+executed as usual by executor_loop.py.
+
+Forked jobs share whatever state the preloaded modules set up on import, such as the working
+dir or environment they saw, and the preloaded modules must not start threads.
+
+Like executor_loop.py, this only depends on the standard library.
+"""
+
+import atexit
+import importlib
+import os
+import runpy
+import shutil
+import signal
+import sys
+import traceback
+
+from executor_loop import ExecutorLoop
+
+
+def _same_interpreter(command: str) -> bool:
+    path = shutil.which(command)
+    if path is None:
+        return False
+
+    # A venv's interpreter links to the base one, but has its own packages
+    path = os.path.abspath(path)
+    return os.path.dirname(path) == os.path.dirname(sys.executable) and os.path.samefile(
+        path, sys.executable
+    )
+
+
+def _exit_code(e: SystemExit) -> int:
+    match e.code:
+        case None:
+            return 0
+        case int(code):
+            return code
+        case message:
+            print(message, file=sys.stderr)
+            return 1
+
+
+def _run_python(module: str | None, script: str | None, argv: list[str]) -> int:
+    signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+
+    # Set up sys.path and sys.argv as the interpreter would have
+    sys.argv = argv
+    try:
+        if module is not None:
+            sys.path[0] = os.getcwd()
+            runpy.run_module(module, run_name="__main__", alter_sys=True)
+        elif script is not None:
+            sys.path[0] = os.path.dirname(os.path.realpath(script))
+            runpy.run_path(script, run_name="__main__")
+        exit_code = 0
+    except SystemExit as e:
+        exit_code = _exit_code(e)
+    except BaseException as e:
+        # Leave this function out of the traceback, as the interpreter would
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next if e.__traceback__ else None)
+        exit_code = 1
+
+    try:
+        atexit._run_exitfuncs()
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    return exit_code
+
+
+def _python_job(args: list[str]) -> tuple[str | None, str | None, list[str]] | None:
+    """
+    The module or script a job runs, and its sys.argv, if it can run in a fork
+    """
+
+    match args:
+        case [interpreter, "-m", module, *rest]:
+            target = (module, None, [interpreter, *rest])
+        case [interpreter, script, *rest] if not script.startswith("-"):
+            target = (None, script, [script, *rest])
+        case _:
+            return None
+
+    return target if _same_interpreter(args[0]) else None
+
+
+class ZygoteLoop(ExecutorLoop):
+    def _exec(self, args: list[str]) -> None:
+        if (target := _python_job(args)) is None:
+            super()._exec(args)
+            return
+
+        self._close_loop_fds()
+        os._exit(_run_python(*target))
+
+
+def _preload(modules: list[str]) -> None:
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            # Jobs using it will import it themselves, and report the error there
+            print(f"command-server: can't preload {module}: {e!r}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: zygote.py <executor args> <module>...", file=sys.stderr)
+        sys.exit(2)
+
+    _preload(sys.argv[3:])
+    sys.exit(ZygoteLoop(sys.argv[1], sys.argv[2]).run())
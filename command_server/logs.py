@@ -0,0 +1,144 @@
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+from collections.abc import Callable
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
+
+from .server_config import CommandServerConfig
+
+# Attributes every LogRecord has, anything else was passed through `extra`
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+_listener: QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with any `extra` fields (e.g. job_id, executor_id) as keys
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per logger, so a burst of records from one category can't flood the log.
+    Warnings and above always pass. Once a logger's records pass again after some were
+    dropped, a warning saying how many goes to `emit` first.
+    """
+
+    def __init__(self, rate: float, burst: int, emit: Callable[[logging.LogRecord], None]) -> None:
+        super().__init__()
+        self._rate = rate
+        self._burst = burst
+        self._emit = emit
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._suppressed: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(record.name, (float(self._burst), now))
+            tokens = min(float(self._burst), tokens + (now - last) * self._rate)
+            if tokens < 1:
+                self._buckets[record.name] = (tokens, now)
+                self._suppressed[record.name] = self._suppressed.get(record.name, 0) + 1
+                return False
+
+            self._buckets[record.name] = (tokens - 1, now)
+            suppressed = self._suppressed.pop(record.name, 0)
+
+        if suppressed:
+            self._emit(
+                logging.makeLogRecord(
+                    {
+                        "name": record.name,
+                        "levelno": logging.WARNING,
+                        "levelname": logging.getLevelName(logging.WARNING),
+                        "msg": f"Dropped {suppressed} records over the rate limit",
+                        "suppressed": suppressed,
+                    }
+                )
+            )
+        return True
+
+
+class _LoopQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Args are merged now, since they may change once this returns, but the rest of
+        # the formatting (and the write) happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(config: CommandServerConfig) -> None:
+    """
+    (Re)configures the root logger, replacing any handlers installed previously. Records
+    are queued and written to the log file by a background thread, so the event loop never
+    blocks on the file.
+    """
+
+    global _listener
+
+    file_handler = logging.FileHandler(config.log_file)
+    if config.log_format == "json":
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(_TEXT_FORMAT))
+
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    queue_handler = _LoopQueueHandler(log_queue)
+    if config.log_rate_limit:
+        queue_handler.addFilter(
+            RateLimitFilter(config.log_rate_limit, config.log_rate_burst, queue_handler.enqueue)
+        )
+
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+
+    # Swap in the new handler before flushing the old queue, so nothing is dropped
+    logging.basicConfig(level=config.log_level, handlers=[queue_handler], force=True)
+    stop_logging()
+    _listener = listener
+
+
+def stop_logging() -> None:
+    """
+    Flushes queued records and closes the log file
+    """
+
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from .api import LoopLagResult, LoopStall
+from .server_config import LoopMonitorConfig
+
+_LOGGER = logging.getLogger("loop-monitor")
+
+# Upper bounds of the histogram's buckets, in seconds
+_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, math.inf)
+# Stalls kept for command_server.loop-lag
+_HISTORY = 32
+
+
+def _describe_task(task: asyncio.Task | None) -> str | None:
+    if task is None:
+        return None
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', repr(coro))})"
+
+
+class LoopMonitor:
+    """
+    Measures how late a timer on the event loop runs, which is how long anything else
+    scheduled on it (e.g. every client's requests) waits behind whatever is hogging it.
+
+    A watchdog thread notices a stall while it happens, and logs the stack the loop is
+    stuck in. That costs nothing on the loop itself, unlike asyncio's debug mode, which
+    times every callback.
+    """
+
+    def __init__(self, config: LoopMonitorConfig) -> None:
+        self.config = config
+        self.samples = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.histogram = [0] * len(_BUCKETS)
+        self.stalls: deque[LoopStall] = deque(maxlen=_HISTORY)
+        # When the timer should next run, and how many times it has
+        self._due = time.monotonic()
+        self._beats = 0
+        # The stall the watchdog caught, and the beat it held up
+        self._caught: tuple[int, LoopStall] | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._stop: threading.Event | None = None
+
+    def start(self) -> None:
+        if not self.config.enabled or self._task is not None:
+            return
+
+        loop = asyncio.get_running_loop()
+        self._due = time.monotonic() + self.config.interval_s
+        self._task = asyncio.create_task(self._run())
+        self._stop = threading.Event()
+        threading.Thread(
+            target=self._watch,
+            args=(loop, threading.get_ident(), self.config.threshold_s, self._stop),
+            name="loop-monitor",
+            daemon=True,
+        ).start()
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._stop is not None:
+            # The watchdog exits the next time it wakes
+            self._stop.set()
+            self._stop = None
+
+    def configure(self, config: LoopMonitorConfig) -> None:
+        self.stop()
+        self.config = config
+        self.start()
+
+    def reset(self) -> None:
+        self.samples = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.histogram = [0] * len(_BUCKETS)
+        self.stalls.clear()
+
+    def _record(self, lag_s: float, beat: int) -> None:
+        self.samples += 1
+        self.total_s += lag_s
+        self.max_s = max(self.max_s, lag_s)
+        self.histogram[next(i for i, bound in enumerate(_BUCKETS) if lag_s <= bound)] += 1
+
+        if lag_s > self.config.threshold_s:
+            caught = self._caught
+            if caught is not None and caught[0] == beat:
+                stall = caught[1]
+                stall.lag_s = lag_s
+            else:
+                stall = LoopStall(at=time.time(), lag_s=lag_s, task=None, stack=[])
+            self.stalls.append(stall)
+
+    async def _run(self) -> None:
+        while True:
+            self._due = time.monotonic() + self.config.interval_s
+            await asyncio.sleep(self.config.interval_s)
+            self._record(max(time.monotonic() - self._due, 0.0), self._beats)
+            self._beats += 1
+
+    def _watch(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        loop_thread: int,
+        threshold_s: float,
+        stop: threading.Event,
+    ) -> None:
+        reported = -1
+        while not stop.wait(threshold_s / 4):
+            beat = self._beats
+            late_s = time.monotonic() - self._due
+            if late_s <= threshold_s or beat == reported:
+                continue
+
+            reported = beat
+            frame = sys._current_frames().get(loop_thread)
+            stack = [
+                f"{summary.filename}:{summary.lineno} in {summary.name}"
+                for summary in (traceback.extract_stack(frame) if frame is not None else [])
+            ]
+            task = _describe_task(asyncio.current_task(loop))
+            self._caught = (beat, LoopStall(at=time.time(), lag_s=late_s, task=task, stack=stack))
+            _LOGGER.warning(
+                "Event loop stalled for %.3fs so far, in %s:\n  %s",
+                late_s,
+                task or "a callback",
+                "\n  ".join(stack),
+            )
+
+    def result(self) -> LoopLagResult:
+        return LoopLagResult(
+            enabled=self.config.enabled,
+            interval_s=self.config.interval_s,
+            threshold_s=self.config.threshold_s,
+            samples=self.samples,
+            mean_s=self.total_s / self.samples if self.samples else 0.0,
+            max_s=self.max_s,
+            histogram={f"{bound:g}": count for bound, count in zip(_BUCKETS, self.histogram)},
+            stalls=list(self.stalls),
+        )
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import mmap
+import os
+import tempfile
+from dataclasses import dataclass
+
+from result import Err, Ok, Result
+
+from .api import OutputStream
+from .files import (
+    AsyncFile,
+    FifoCreateFailed,
+    FileOpenFailed,
+    TempFifo,
+    mkfifo,
+    run_dir_path,
+)
+
+_LOGGER = logging.getLogger("output")
+
+
+class OutputBuffer:
+    """
+    Keeps the most recent `max_bytes` of a stream, addressed by absolute offset in the
+    stream. Output is held in memory until it grows past `memory_bytes`, after which it
+    moves to a ring in a memory-mapped temp file so large outputs don't sit on the heap.
+    """
+
+    def __init__(self, memory_bytes: int, max_bytes: int) -> None:
+        self._memory_bytes = memory_bytes
+        self._max_bytes = max_bytes
+        self._memory = bytearray()
+        self._ring: mmap.mmap | None = None
+        self.start_offset = 0
+        self.end_offset = 0
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def append(self, data: bytes) -> None:
+        if self._ring is None and self.end_offset + len(data) - self.start_offset > min(
+            self._memory_bytes, self._max_bytes
+        ):
+            if self._memory_bytes < self._max_bytes:
+                self._spill()
+
+        if self._ring is None:
+            self._memory += data
+            self.end_offset += len(data)
+            if len(self._memory) > self._max_bytes:
+                del self._memory[: len(self._memory) - self._max_bytes]
+            self.start_offset = self.end_offset - len(self._memory)
+        else:
+            # The stream advances by the whole chunk, but only its tail survives
+            self.end_offset += len(data)
+            data = data[-self._max_bytes :]
+            position = (self.end_offset - len(data)) % self._max_bytes
+            first = min(len(data), self._max_bytes - position)
+            self._ring[position : position + first] = data[:first]
+            self._ring[0 : len(data) - first] = data[first:]
+            self.start_offset = max(self.start_offset, self.end_offset - self._max_bytes)
+
+        self._notify()
+
+    def read(self, offset: int, max_bytes: int) -> tuple[int, bytes]:
+        """
+        Reads up to max_bytes from offset, returning the offset the data actually starts at
+        (later than requested if that part was dropped). Negative offsets count from the end.
+        """
+
+        if offset < 0:
+            offset = self.end_offset + offset
+        offset = min(max(offset, self.start_offset), self.end_offset)
+        length = min(max_bytes, self.end_offset - offset)
+
+        if self._ring is None:
+            start = offset - self.start_offset
+            return offset, bytes(self._memory[start : start + length])
+
+        position = offset % self._max_bytes
+        first = min(length, self._max_bytes - position)
+        return offset, self._ring[position : position + first] + self._ring[0 : length - first]
+
+    async def wait_for(self, offset: int) -> None:
+        """
+        Waits until there is data past offset, or the stream is closed
+        """
+
+        while not self.closed and self.end_offset <= offset:
+            await self._changed.wait()
+
+    async def wait_closed(self) -> None:
+        while not self.closed:
+            await self._changed.wait()
+
+    def close(self) -> None:
+        self.closed = True
+        self._notify()
+
+    def release(self) -> None:
+        self.close()
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+        self._memory = bytearray()
+        self.start_offset = self.end_offset
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _spill(self) -> None:
+        # The file is unlinked straight away, the mapping keeps it alive
+        fd, path = tempfile.mkstemp(dir=run_dir_path(""), suffix=".output")
+        try:
+            os.unlink(path)
+            os.ftruncate(fd, self._max_bytes)
+            self._ring = mmap.mmap(fd, self._max_bytes)
+        finally:
+            os.close(fd)
+
+        memory, self._memory = self._memory, bytearray()
+        self.end_offset = self.start_offset
+        self.append(bytes(memory))
+
+
+@dataclass
+class _CapturedStream:
+    fifo: TempFifo
+    read_fd: int
+    keepalive_fd: int | None
+    buffer: OutputBuffer
+
+
+class JobOutput:
+    """
+    Server-owned FIFOs that a job writes its stdout and stderr to, drained into buffers.
+
+    The server holds a writer on each FIFO until the job exits, so reads never see EOF
+    before the job has opened its side.
+    """
+
+    def __init__(self, streams: dict[OutputStream, _CapturedStream]) -> None:
+        self._streams = streams
+        loop = asyncio.get_running_loop()
+        for stream in streams.values():
+            loop.add_reader(stream.read_fd, self._drain, stream)
+
+    def path(self, stream: OutputStream) -> str:
+        return str(self._streams[stream].fifo.path)
+
+    def buffer(self, stream: OutputStream) -> OutputBuffer:
+        return self._streams[stream].buffer
+
+    @property
+    def held_fds(self) -> int:
+        return sum(
+            int(stream.read_fd >= 0) + int(stream.keepalive_fd is not None)
+            for stream in self._streams.values()
+        )
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(
+            stream.buffer.end_offset - stream.buffer.start_offset
+            for stream in self._streams.values()
+        )
+
+    def job_exited(self) -> None:
+        for stream in self._streams.values():
+            self._close_keepalive(stream)
+
+    def release(self) -> None:
+        """
+        Stops capturing and frees the buffered output
+        """
+
+        for stream in self._streams.values():
+            self._close_stream(stream)
+            stream.buffer.release()
+
+    def _drain(self, stream: _CapturedStream) -> None:
+        try:
+            data = os.read(stream.read_fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            _LOGGER.error("Failed to read output from %s: %r", stream.fifo.path, e)
+            data = b""
+
+        if data:
+            stream.buffer.append(data)
+        else:
+            self._close_stream(stream)
+
+    def _close_keepalive(self, stream: _CapturedStream) -> None:
+        if stream.keepalive_fd is not None:
+            os.close(stream.keepalive_fd)
+            stream.keepalive_fd = None
+
+    def _close_stream(self, stream: _CapturedStream) -> None:
+        self._close_keepalive(stream)
+        if stream.read_fd >= 0:
+            asyncio.get_running_loop().remove_reader(stream.read_fd)
+            os.close(stream.read_fd)
+            stream.read_fd = -1
+            stream.buffer.close()
+            asyncio.get_running_loop().create_task(stream.fifo.unlink())
+
+
+async def _capture_stream(
+    stream: OutputStream, memory_bytes: int, max_bytes: int
+) -> Result[_CapturedStream, FifoCreateFailed | FileOpenFailed]:
+    match await mkfifo(f"job_{stream.value}"):
+        case Ok(fifo):
+            pass
+        case Err() as err:
+            return err
+
+    try:
+        # Neither open blocks, since the read side is opened first
+        read_fd = os.open(fifo.path, os.O_RDONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+        keepalive_fd = os.open(fifo.path, os.O_WRONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+    except OSError as e:
+        await fifo.unlink()
+        return Err(FileOpenFailed(fifo.path, e))
+
+    return Ok(_CapturedStream(fifo, read_fd, keepalive_fd, OutputBuffer(memory_bytes, max_bytes)))
+
+
+async def make_job_output(
+    memory_bytes: int, max_bytes: int
+) -> Result[JobOutput, FifoCreateFailed | FileOpenFailed]:
+    streams: dict[OutputStream, _CapturedStream] = dict()
+    for stream in OutputStream:
+        match await _capture_stream(stream, memory_bytes, max_bytes):
+            case Ok(captured):
+                streams[stream] = captured
+            case Err() as err:
+                for captured in streams.values():
+                    os.close(captured.read_fd)
+                    if captured.keepalive_fd is not None:
+                        os.close(captured.keepalive_fd)
+                    await captured.fifo.unlink()
+                return err
+
+    return Ok(JobOutput(streams))
+
+
+async def write_all(file: AsyncFile, data: bytes) -> int:
+    """
+    Writes as much of data as the file accepts, returning the number of bytes written
+    """
+
+    written = 0
+    try:
+        while written < len(data):
+            written += await file.write(data[written:])
+    except OSError as e:
+        _LOGGER.info("Stopped writing output: %r", e)
+    return written
+
+
+async def copy_output(buffer: OutputBuffer, offset: int, file: AsyncFile) -> int:
+    """
+    Copies buffered output from offset to the file until the stream ends or the file can't
+    be written to, returning the offset reached
+    """
+
+    if offset < 0:
+        offset = max(buffer.end_offset + offset, buffer.start_offset)
+
+    while True:
+        await buffer.wait_for(offset)
+        offset, data = buffer.read(offset, 65536)
+        if not data:
+            return offset
+
+        written = await write_all(file, data)
+        offset += written
+        if written < len(data):
+            return offset
@@ -0,0 +1,173 @@
+import ctypes
+import errno
+import glob
+import logging
+import os
+import platform
+from collections.abc import Callable
+
+from result import Err, Ok, Result
+
+from .errors import InvalidScheduling
+from .server_config import (
+    JobScheduling,
+    PlacementConfig,
+    check_nice,
+    parse_cpu_list,
+    parse_ioprio,
+)
+
+_LOGGER = logging.getLogger("placement")
+
+# ioprio_set(2) has no wrapper in the os module (or glibc)
+_IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "i686": 289,
+    "aarch64": 30,
+    "riscv64": 30,
+    "ppc64le": 273,
+    "s390x": 282,
+}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+
+_libc: ctypes.CDLL | None = None
+
+
+def job_scheduling(
+    cpu_set: list[int] | None,
+    nice: int | None,
+    ioprio: str | None,
+    defaults: JobScheduling,
+) -> Result[JobScheduling, InvalidScheduling]:
+    """
+    The scheduling attributes a job asked for, on top of its profile's
+    """
+
+    try:
+        if cpu_set is not None and (not cpu_set or min(cpu_set) < 0):
+            raise ValueError("cpu_set needs at least one CPU, and no negative ones")
+        if nice is not None:
+            check_nice(nice)
+        if ioprio is not None:
+            parse_ioprio(ioprio)
+    except ValueError as e:
+        return Err(InvalidScheduling(str(e)))
+
+    return Ok(
+        defaults.override(
+            JobScheduling(
+                cpu_set=frozenset(cpu_set) if cpu_set is not None else None,
+                nice=nice,
+                ioprio=ioprio,
+            )
+        )
+    )
+
+
+def _ioprio_set(tid: int, ioprio: str) -> None:
+    global _libc
+
+    number = _IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if number is None:
+        raise OSError(errno.ENOSYS, f"ioprio_set is not known on {platform.machine()}")
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+
+    io_class, level = parse_ioprio(ioprio)
+    value = io_class << _IOPRIO_CLASS_SHIFT | level
+    if _libc.syscall(number, _IOPRIO_WHO_PROCESS, tid, value) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def _setters(scheduling: JobScheduling) -> list[tuple[str, Callable[[int], None]]]:
+    setters: list[tuple[str, Callable[[int], None]]] = []
+    if (cpu_set := scheduling.cpu_set) is not None:
+        setters.append(("CPU affinity", lambda tid: os.sched_setaffinity(tid, cpu_set)))
+    if (nice := scheduling.nice) is not None:
+        setters.append(("nice value", lambda tid: os.setpriority(os.PRIO_PROCESS, tid, nice)))
+    if (ioprio := scheduling.ioprio) is not None:
+        setters.append(("I/O priority", lambda tid: _ioprio_set(tid, ioprio)))
+    return setters
+
+
+def apply(pid: int, scheduling: JobScheduling) -> None:
+    """
+    Sets the scheduling attributes of every thread of a job which was just started. The
+    job is already running, so failures are logged rather than failing it.
+    """
+
+    # Only reads procfs, so it doesn't block
+    try:
+        tids = [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        tids = [pid]
+
+    for attribute, set_one in _setters(scheduling):
+        for tid in tids:
+            try:
+                set_one(tid)
+            except ProcessLookupError:
+                # The thread (or the whole job) already exited
+                pass
+            except OSError as e:
+                _LOGGER.warning("Failed to set the %s of %d: %r", attribute, pid, e)
+                break
+
+
+def _read_cpu_list(path: str) -> frozenset[int]:
+    try:
+        with open(path) as f:
+            return parse_cpu_list(f.read())
+    except (OSError, ValueError):
+        return frozenset()
+
+
+def _numa_nodes(cpu_set: frozenset[int]) -> list[frozenset[int]]:
+    nodes = [
+        node & cpu_set
+        for node in map(_read_cpu_list, sorted(glob.glob("/sys/devices/system/node/node*/cpulist")))
+    ]
+    nodes = [node for node in nodes if node]
+
+    # CPUs sysfs doesn't place in a node (or all of them, without NUMA) share one
+    if rest := cpu_set.difference(*nodes):
+        nodes.append(rest)
+    return nodes
+
+
+def _sibling_rank(cpu: int) -> int:
+    # Spreading over the first thread of every core before the second keeps jobs from
+    # sharing a core while others sit idle
+    siblings = _read_cpu_list(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list")
+    return sorted(siblings).index(cpu) if cpu in siblings else 0
+
+
+class Placer:
+    """
+    Spreads jobs over the configured CPUs, pinning each one to the group (a CPU, or a NUMA
+    node's share of them) running the fewest
+    """
+
+    def __init__(self, config: PlacementConfig) -> None:
+        if config.policy == "node":
+            self.groups = _numa_nodes(config.cpu_set)
+        else:
+            self.groups = [
+                frozenset([cpu])
+                for cpu in sorted(config.cpu_set, key=lambda cpu: (_sibling_rank(cpu), cpu))
+            ]
+        self._running = [0] * len(self.groups)
+
+    def place(self) -> tuple[int, frozenset[int]]:
+        """
+        Takes a place in the least loaded group, returning it and its CPUs
+        """
+
+        group = min(range(len(self.groups)), key=self._running.__getitem__)
+        self._running[group] += 1
+        return group, self.groups[group]
+
+    def release(self, group: int) -> None:
+        self._running[group] -= 1
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import math
+import os
+import pathlib
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+
+from .api import ConcurrencyDecision
+from .scheduler import JobScheduler
+from .server_config import PressureConfig
+
+_LOGGER = logging.getLogger("pressure")
+
+# Decisions kept for command_server.concurrency
+_HISTORY = 64
+
+PressureReader = Callable[[Iterable[str]], dict[str, float]]
+
+
+class PressureFiles:
+    """
+    Reads the "some" avg10 of pressure stall information files, from /proc/pressure/<resource>
+    or a cgroup v2 dir's <resource>.pressure. Any dir laid out like either works, such as
+    one a test writes its own readings to.
+    """
+
+    def __init__(self, dir: pathlib.Path) -> None:
+        self.dir = dir
+        self._failed: set[str] = set()
+
+    def path(self, resource: str) -> pathlib.Path:
+        cgroup_path = self.dir.joinpath(f"{resource}.pressure")
+        return cgroup_path if cgroup_path.exists() else self.dir.joinpath(resource)
+
+    def _read_one(self, resource: str) -> float:
+        # Only reads procfs or cgroupfs, so it doesn't block
+        for line in self.path(resource).read_text().splitlines():
+            kind, *values = line.split()
+            if kind == "some":
+                return float(dict(value.split("=", 1) for value in values)["avg10"])
+        raise ValueError('no "some" line')
+
+    def read(self, resources: Iterable[str]) -> dict[str, float]:
+        pressure: dict[str, float] = {}
+        for resource in resources:
+            try:
+                pressure[resource] = self._read_one(resource)
+                self._failed.discard(resource)
+            except (OSError, KeyError, ValueError) as e:
+                if resource not in self._failed:
+                    _LOGGER.warning("Failed to read %s pressure: %r", resource, e)
+                    self._failed.add(resource)
+        return pressure
+
+
+class ConcurrencyController:
+    """
+    Sets the scheduler's max_running from pressure stall information, AIMD style. While any
+    watched resource is above its threshold, the limit is cut by the decrease factor each
+    interval, and queued starts wait for running jobs to exit rather than filling it. Once
+    pressure falls, the limit grows by the increase each interval in which it is what keeps
+    starts queued, up to max_concurrency.
+    """
+
+    def __init__(
+        self,
+        config: PressureConfig,
+        scheduler: JobScheduler,
+        max_concurrency: int | None,
+        read: PressureReader | None = None,
+        limit: float | None = None,
+    ) -> None:
+        self.config = config
+        self._scheduler = scheduler
+        self._ceiling = max_concurrency if max_concurrency is not None else math.inf
+        self._read = read or PressureFiles(config.source).read
+        self.limit = min(
+            limit if limit is not None else float(max_concurrency or os.cpu_count() or 1),
+            self._ceiling,
+        )
+        self.decisions: deque[ConcurrencyDecision] = deque(maxlen=_HISTORY)
+        scheduler.max_running = int(self.limit)
+
+    def tick(self, pressure: dict[str, float]) -> ConcurrencyDecision:
+        """
+        Adjusts the limit for one interval's readings
+        """
+
+        running = self._scheduler.running
+        over = any(
+            pressure.get(resource, 0.0) > threshold
+            for resource, threshold in self.config.thresholds.items()
+        )
+        if over:
+            action = "decrease"
+            self.limit = max(self.limit * self.config.decrease, float(self.config.min_concurrency))
+            max_running = max(min(int(self.limit), running), self.config.min_concurrency)
+        elif running >= int(self.limit) and sum(self._scheduler.queued.values()) > 0:
+            action = "increase"
+            self.limit = min(self.limit + self.config.increase, self._ceiling)
+            max_running = int(self.limit)
+        else:
+            action = "hold"
+            max_running = int(self.limit)
+
+        decision = ConcurrencyDecision(time.time(), pressure, action, self.limit, max_running)
+        if action != "hold" or max_running != self._scheduler.max_running:
+            _LOGGER.debug("%s to %d with pressure %r", action, max_running, pressure)
+            self.decisions.append(decision)
+        self._scheduler.max_running = max_running
+        return decision
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.interval_s)
+            self.tick(self._read(self.config.thresholds))
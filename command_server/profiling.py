@@ -0,0 +1,159 @@
+import asyncio
+import gc
+import logging
+import signal
+import time
+import tracemalloc
+from collections import Counter
+from types import FrameType
+
+from result import Err, Ok, Result
+
+from .api import AllocationSite, MemorySnapshotResult, ProfileResult
+from .errors import ProfilingFailed
+
+_LOGGER = logging.getLogger("profiling")
+
+# Longest a single profile or allocation trace may run
+MAX_DURATION_S = 300.0
+# Shortest sampling interval, which keeps the sampler's own overhead to a few percent
+MIN_INTERVAL_S = 0.001
+
+# Modules whose types are always counted in memory snapshots
+_SERVER_PACKAGE = __name__.partition(".")[0]
+
+
+def _check_duration(duration_s: float) -> Result[None, ProfilingFailed]:
+    if not 0 < duration_s <= MAX_DURATION_S:
+        return Err(ProfilingFailed(f"duration_s must be in (0, {MAX_DURATION_S:g}]"))
+    return Ok(None)
+
+
+def _collapse(frame: FrameType | None) -> str:
+    names: list[str] = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Sampler:
+    """
+    Samples the event loop thread's stack on SIGPROF, which an interval timer sends every
+    interval of CPU time the process uses. Only one can run at a time.
+    """
+
+    running = False
+
+    def __init__(self) -> None:
+        self.stacks: Counter[str] = Counter()
+
+    def _sample(self, _: int, frame: FrameType | None) -> None:
+        # Python handlers run on the main thread, which is the loop's, at the frame it
+        # was interrupted in
+        self.stacks[_collapse(frame)] += 1
+
+    async def run(self, duration_s: float, interval_s: float) -> None:
+        _Sampler.running = True
+        previous = signal.signal(signal.SIGPROF, self._sample)
+        try:
+            signal.setitimer(signal.ITIMER_PROF, interval_s, interval_s)
+            await asyncio.sleep(duration_s)
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, previous)
+            _Sampler.running = False
+
+
+async def profile(duration_s: float, interval_s: float) -> Result[ProfileResult, ProfilingFailed]:
+    """
+    Samples where the server spends its CPU time for duration_s. Unlike a deterministic
+    profiler, this costs nothing between samples, so it is fine to run on a busy server.
+    """
+
+    match _check_duration(duration_s):
+        case Err() as err:
+            return err
+    if interval_s < MIN_INTERVAL_S:
+        return Err(ProfilingFailed(f"interval_s must be at least {MIN_INTERVAL_S:g}"))
+    if _Sampler.running:
+        return Err(ProfilingFailed("A profile is already running"))
+
+    sampler = _Sampler()
+    start = time.monotonic()
+    try:
+        await sampler.run(duration_s, interval_s)
+    except (OSError, ValueError) as e:
+        # e.g. signal handlers can only be set from the main thread
+        _LOGGER.error("Failed to profile: %r", e)
+        return Err(ProfilingFailed(repr(e)))
+
+    return Ok(
+        ProfileResult(
+            duration_s=time.monotonic() - start,
+            samples=sampler.stacks.total(),
+            stacks=dict(sampler.stacks),
+        )
+    )
+
+
+def _count_objects(limit: int) -> dict[str, int]:
+    counts: Counter[str] = Counter()
+    for obj in gc.get_objects():
+        obj_type = type(obj)
+        counts[f"{obj_type.__module__}.{obj_type.__qualname__}"] += 1
+
+    top = dict(counts.most_common(limit))
+    top.update(
+        (name, count) for name, count in counts.items() if name.startswith(f"{_SERVER_PACKAGE}.")
+    )
+    return top
+
+
+async def memory_snapshot(
+    duration_s: float, limit: int
+) -> Result[MemorySnapshotResult, ProfilingFailed]:
+    """
+    Reports the biggest allocation sites, and how many objects there are of each type.
+    Unless tracemalloc is already tracing (e.g. from PYTHONTRACEMALLOC), it traces for
+    duration_s only, so the sites are those of the allocations made meanwhile which are
+    still alive, i.e. what the server's memory is growing by.
+    """
+
+    if limit < 1:
+        return Err(ProfilingFailed("limit must be at least 1"))
+
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    else:
+        match _check_duration(duration_s):
+            case Err() as err:
+                return err
+
+        tracemalloc.start()
+        try:
+            await asyncio.sleep(duration_s)
+            snapshot = tracemalloc.take_snapshot()
+            traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    sites = [
+        AllocationSite(
+            site=f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            size_bytes=stat.size,
+            count=stat.count,
+        )
+        for stat in snapshot.statistics("lineno")[:limit]
+    ]
+
+    return Ok(
+        MemorySnapshotResult(
+            traced_bytes=traced_bytes,
+            peak_bytes=peak_bytes,
+            sites=sites,
+            objects=_count_objects(limit),
+        )
+    )
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import dataclass
+from typing import Any, Protocol, TypeVar
+
+from result import Ok, Result
+
+from .api import JobPriority
+
+_LOGGER = logging.getLogger("scheduler")
+
+_E = TypeVar("_E")
+
+
+class Dispatched(Protocol):
+    """
+    What a start produces: a job, or a pipeline of jobs which share one slot
+    """
+
+    def add_done_callback(self, callback: Callable[[Any], None]) -> None: ...
+
+
+_D = TypeVar("_D", bound=Dispatched)
+
+
+@dataclass
+class _Waiter:
+    key: str
+    connection: Hashable
+    future: asyncio.Future[None]
+
+
+class _ClassQueue:
+    """
+    The starts queued in one priority class, by the connection they came from. Connections
+    take turns, and each one's starts go in arrival order, so a client with many queued
+    starts can't hold up the others in its class.
+    """
+
+    def __init__(self) -> None:
+        # In turn order: the connection dispatched from last goes to the back
+        self._by_connection: dict[Hashable, deque[_Waiter]] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, waiter: _Waiter) -> None:
+        self._by_connection.setdefault(waiter.connection, deque()).append(waiter)
+        self._size += 1
+
+    def remove(self, waiter: _Waiter) -> bool:
+        queue = self._by_connection.get(waiter.connection)
+        if queue is None or waiter not in queue:
+            return False
+        queue.remove(waiter)
+        self._size -= 1
+        if not queue:
+            del self._by_connection[waiter.connection]
+        return True
+
+    def next_waiter(self, busy_keys: set[str]) -> _Waiter | None:
+        for queue in self._by_connection.values():
+            for waiter in queue:
+                if waiter.key not in busy_keys:
+                    return waiter
+        return None
+
+    def pop(self, waiter: _Waiter) -> None:
+        self.remove(waiter)
+        # Its connection's turn is over
+        queue = self._by_connection.pop(waiter.connection, None)
+        if queue is not None:
+            self._by_connection[waiter.connection] = queue
+
+
+class JobScheduler:
+    """
+    Orders job starts before they are dispatched to an executor.
+
+    Priority classes share dispatches in proportion to their weights (stride scheduling),
+    and the connections with starts queued in a class take turns. Each connection's starts
+    go in arrival order. Only one start per key (profile) is in
+    flight at a time, since the executor protocol handles one request at a time, and at
+    most max_running jobs may be running or starting at once.
+    """
+
+    def __init__(self, weights: dict[JobPriority, int], max_running: int | None) -> None:
+        self._weights = weights
+        self._max_running = max_running
+        self._queues: dict[JobPriority, _ClassQueue] = {p: _ClassQueue() for p in JobPriority}
+        self._passes: dict[JobPriority, float] = {p: 0.0 for p in JobPriority}
+        self._virtual_time = 0.0
+        self._busy_keys: set[str] = set()
+        self._starting = 0
+        self._running = 0
+
+    @property
+    def max_running(self) -> int | None:
+        return self._max_running
+
+    @max_running.setter
+    def max_running(self, max_running: int | None) -> None:
+        self._max_running = max_running
+        self._pump()
+
+    @property
+    def weights(self) -> dict[JobPriority, int]:
+        return self._weights
+
+    @weights.setter
+    def weights(self, weights: dict[JobPriority, int]) -> None:
+        self._weights = weights
+        self._pump()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> dict[JobPriority, int]:
+        return {priority: len(queue) for priority, queue in self._queues.items()}
+
+    async def dispatch(
+        self,
+        key: str,
+        priority: JobPriority,
+        start: Callable[[], Awaitable[Result[_D, _E]]],
+        connection: Hashable = None,
+    ) -> Result[_D, _E]:
+        """
+        Waits for this start's turn, then runs it. Successfully started jobs hold their
+        slot until they exit. Starts for the same connection (any hashable which
+        identifies it) queue behind each other.
+        """
+
+        waiter = _Waiter(key, connection, asyncio.get_running_loop().create_future())
+        queue = self._queues[priority]
+        if not queue:
+            self._passes[priority] = max(self._passes[priority], self._virtual_time)
+        queue.append(waiter)
+        self._pump()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # Unless it was still queued, it had been given a slot
+            if not queue.remove(waiter) and waiter.future.done() and not waiter.future.cancelled():
+                self._finish_start(key, None)
+            raise
+
+        job: Dispatched | None = None
+        try:
+            result = await start()
+            match result:
+                case Ok(started_job):
+                    job = started_job
+            return result
+        finally:
+            self._finish_start(key, job)
+
+    def _finish_start(self, key: str, job: Dispatched | None) -> None:
+        self._starting -= 1
+        self._busy_keys.discard(key)
+        if job is not None:
+            self._running += 1
+            job.add_done_callback(self._job_done)
+        self._pump()
+
+    def _job_done(self, _: Dispatched) -> None:
+        self._running -= 1
+        self._pump()
+
+    def _has_capacity(self) -> bool:
+        return self._max_running is None or self._running + self._starting < self._max_running
+
+    def _pump(self) -> None:
+        while self._has_capacity():
+            chosen: tuple[JobPriority, _Waiter] | None = None
+            for priority, queue in self._queues.items():
+                waiter = queue.next_waiter(self._busy_keys)
+                if waiter is None:
+                    continue
+                if chosen is None or self._passes[priority] < self._passes[chosen[0]]:
+                    chosen = (priority, waiter)
+
+            if chosen is None:
+                return
+
+            priority, waiter = chosen
+            self._queues[priority].pop(waiter)
+            self._virtual_time = self._passes[priority]
+            self._passes[priority] += 1 / max(self._weights.get(priority, 1), 1)
+
+            self._starting += 1
+            self._busy_keys.add(waiter.key)
+            waiter.future.set_result(None)
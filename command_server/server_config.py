@@ -1,18 +1,34 @@
+import hashlib
 import logging
 import os
 import pathlib
 import shlex
 from argparse import ArgumentParser, Namespace
 from configparser import ConfigParser
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields, is_dataclass
+from typing import Any
 
 from result import Err, Ok, Result
 
-from .api import ExecutorConfigOverrides, Signal
-from .errors import InvalidExecutorConfig
+from .api import ExecutorConfigOverrides, JobPriority, Signal
+from .errors import InvalidExecutorConfig, InvalidServerConfig
+from .files import run_dir_path
 
 _LOGGER = logging.getLogger(__name__)
 
+DEFAULT_PROFILE = "default"
+
+# Set by the front process of a --workers server in the environment of each worker: its
+# index, and the fd of its end of the socketpair connections are handed over on
+WORKER_VAR = "COMMAND_SERVER_WORKER"
+WORKER_FD_VAR = "COMMAND_SERVER_WORKER_FD"
+
+DEFAULT_PRIORITY_WEIGHTS = {
+    JobPriority.INTERACTIVE: 16,
+    JobPriority.NORMAL: 4,
+    JobPriority.BATCH: 1,
+}
+
 
 @dataclass
 class SignalTranslator:
@@ -24,20 +40,122 @@ class SignalTranslator:
         return sig
 
 
+TRANSPORT_KINDS = frozenset(["fifo", "tcp", "vsock"])
+
+
+@dataclass
+class TransportConfig:
+    # fifo, tcp or vsock
+    kind: str = "fifo"
+    # What the server listens on for the executor to connect to: host:port for tcp, and
+    # the port for vsock
+    listen: str = "127.0.0.1:0"
+    # The host executors connect to for tcp, e.g. when listening on all interfaces for a
+    # guest which reaches the server at another address. Defaults to the listen host
+    advertise: str | None = None
+
+
+# I/O scheduling classes of ioprio_set(2), by the names ionice(1) gives them
+IOPRIO_CLASSES = {"rt": 1, "be": 2, "idle": 3}
+
+PLACEMENT_POLICIES = frozenset(["core", "node"])
+
+
+def parse_cpu_list(text: str) -> frozenset[int]:
+    """
+    Parses a set of CPUs in the kernel's list format, e.g. 0-3,8
+    """
+
+    cpus: set[int] = set()
+    for part in text.split(","):
+        if part.strip():
+            first, sep, last = part.partition("-")
+            cpus.update(range(int(first), int(last if sep else first) + 1))
+    if not cpus:
+        raise ValueError("no CPUs given")
+    return frozenset(cpus)
+
+
+def parse_ioprio(text: str) -> tuple[int, int]:
+    """
+    Parses an I/O priority as "idle", or "be/<level>" or "rt/<level>" with levels 0-7,
+    into its class and level
+    """
+
+    name, sep, level_str = text.partition("/")
+    if name not in IOPRIO_CLASSES:
+        raise ValueError(f"unknown I/O scheduling class {name}")
+    if name == "idle":
+        if sep:
+            raise ValueError("the idle class has no levels")
+        return IOPRIO_CLASSES[name], 0
+
+    level = int(level_str) if sep else 4
+    if not 0 <= level <= 7:
+        raise ValueError(f"I/O priority level {level} is not in 0-7")
+    return IOPRIO_CLASSES[name], level
+
+
+def check_nice(nice: int) -> int:
+    if not -20 <= nice <= 19:
+        raise ValueError(f"nice value {nice} is not in -20-19")
+    return nice
+
+
+@dataclass
+class JobScheduling:
+    # Scheduling attributes applied to a job once it has started, None to leave it with
+    # the executor's
+    cpu_set: frozenset[int] | None = None
+    nice: int | None = None
+    ioprio: str | None = None
+
+    def override(self, other: "JobScheduling") -> "JobScheduling":
+        """
+        These attributes, with the ones set in other replacing them
+        """
+
+        return JobScheduling(
+            cpu_set=other.cpu_set if other.cpu_set is not None else self.cpu_set,
+            nice=other.nice if other.nice is not None else self.nice,
+            ioprio=other.ioprio if other.ioprio is not None else self.ioprio,
+        )
+
+
+@dataclass
+class PlacementConfig:
+    # core to pin each job to a single CPU, or node to the CPUs of a NUMA node
+    policy: str
+    cpu_set: frozenset[int]
+
+
 @dataclass
 class ExecutorConfig:
+    profile: str
     cwd: pathlib.Path
     command: str
     args: list[str]
     signal_translator: SignalTranslator
+    # Files whose contents key the environment snapshot, or None if snapshots are off
+    snapshot_inputs: list[pathlib.Path] | None = None
+    transport: TransportConfig = field(default_factory=TransportConfig)
+    # Job args of at least this many bytes are passed to the executor as files, or None to
+    # pass every arg inline
+    arg_file_bytes: int | None = None
 
 
 @dataclass
 class BaseExecutorConfig:
+    profile: str
     cwd: pathlib.Path | None
     command: str
     args: list[str]
     signal_translator: SignalTranslator
+    snapshot_inputs: list[pathlib.Path] | None = None
+    transport: TransportConfig = field(default_factory=TransportConfig)
+    arg_file_bytes: int | None = None
+    # Defaults for the profile's jobs
+    job_scheduling: JobScheduling = field(default_factory=JobScheduling)
 
     def apply_overrides(
         self,
@@ -51,20 +169,161 @@ class BaseExecutorConfig:
 
         return Ok(
             ExecutorConfig(
+                profile=self.profile,
                 cwd=cwd,
                 command=self.command,
                 args=args,
                 signal_translator=self.signal_translator,
+                snapshot_inputs=self.snapshot_inputs,
+                transport=self.transport,
+                arg_file_bytes=self.arg_file_bytes,
             )
         )
 
 
+@dataclass
+class CgroupConfig:
+    parent: pathlib.Path
+    cpu_max: str | None
+    memory_max: str | None
+
+
+@dataclass
+class CaptureConfig:
+    memory_bytes: int
+    max_bytes: int
+    # How much output of finished jobs is kept to be read back
+    retain_count: int
+    retain_bytes: int
+    retain_s: float
+
+
+@dataclass
+class CacheConfig:
+    max_entries: int
+    max_bytes: int
+    ttl_s: float
+
+
+@dataclass
+class TracingConfig:
+    enabled: bool
+    capacity: int
+
+
+@dataclass
+class LoopMonitorConfig:
+    enabled: bool
+    interval_s: float
+    # Lag past which the loop counts as stalled, and what it is stuck in gets logged
+    threshold_s: float
+
+
+@dataclass
+class SupervisorConfig:
+    restart: bool
+    ping_interval_s: float
+    ping_timeout_s: float
+    backoff_initial_s: float
+    backoff_max_s: float
+    start_wait_s: float
+
+
+PRESSURE_RESOURCES = ("cpu", "memory", "io")
+
+
+@dataclass
+class PressureConfig:
+    # /proc/pressure, or a cgroup v2 dir with <resource>.pressure files
+    source: pathlib.Path
+    interval_s: float
+    # "some" avg10 percentages above which the limit is cut, by resource
+    thresholds: dict[str, float]
+    min_concurrency: int
+    increase: float
+    decrease: float
+
+
 @dataclass
 class CommandServerConfig:
     log_level: int
     log_file: str
+    log_format: str
+    log_rate_limit: float | None
+    log_rate_burst: int
     socket_path: pathlib.Path
-    base_executor_config: BaseExecutorConfig
+    max_concurrency: int | None
+    pressure: PressureConfig | None
+    priority_weights: dict[JobPriority, int]
+    cgroup: CgroupConfig | None
+    placement: PlacementConfig | None
+    capture: CaptureConfig
+    cache: CacheConfig
+    tracing: TracingConfig
+    supervisor: SupervisorConfig
+    loop_monitor: LoopMonitorConfig
+    journal_file: pathlib.Path | None
+    executor_configs: dict[str, BaseExecutorConfig]
+    argv: list[str]
+    # Fds kept free for everything other than job starts
+    fd_reserve: int = 64
+    # How long opening a client's stdio waits for the client to open its end
+    open_timeout_s: float = 30.0
+    # Finished jobs (and pipelines) kept to answer for, by number and age
+    max_finished_jobs: int = 1000
+    finished_job_ttl_s: float = 86400.0
+    # Number of worker processes, 1 to serve everything from this process
+    workers: int = 1
+    # Index of this process if it is one of the workers
+    worker: int | None = None
+
+
+# Changes to these fields can't be applied to a running server
+RESTART_FIELDS = frozenset(["socket_path", "journal_file", "workers"])
+
+
+def _diff(prefix: str, old: Any, new: Any) -> list[str]:
+    changed: list[str] = []
+    if isinstance(old, dict) and isinstance(new, dict) and all(isinstance(k, str) for k in old):
+        for key in old.keys() | new.keys():
+            if key not in old or key not in new:
+                changed.append(f"{prefix}.{key}")
+            else:
+                changed += _diff(f"{prefix}.{key}", old[key], new[key])
+        return sorted(changed)
+
+    if type(old) is not type(new) or not is_dataclass(old):
+        return [prefix] if old != new else []
+
+    for f in fields(old):
+        if f.name == "argv":
+            continue
+        name = f"{prefix}.{f.name}" if prefix else f.name
+        changed += _diff(name, getattr(old, f.name), getattr(new, f.name))
+    return changed
+
+
+def diff_config(old: CommandServerConfig, new: CommandServerConfig) -> list[str]:
+    """
+    Returns the dotted names of all fields which differ between the two configs
+    """
+
+    return _diff("", old, new)
+
+
+def profiles_needing_executor(old: CommandServerConfig, new: CommandServerConfig) -> list[str]:
+    """
+    Returns the profiles whose changes can only be applied by starting a new executor
+    """
+
+    def key(config: BaseExecutorConfig):
+        return (config.cwd, config.command, config.args, config.transport, config.arg_file_bytes)
+
+    return [
+        profile
+        for profile, config in new.executor_configs.items()
+        if profile in old.executor_configs and key(old.executor_configs[profile]) != key(config)
+    ]
 
 
 @dataclass
@@ -88,6 +347,7 @@ class _ArgNamespace(Namespace):
     log_file: pathlib.Path | None
     log_level: str | None
     socket: pathlib.Path | None
+    workers: int | None
     executor_args: list[str]
 
 
@@ -104,6 +364,11 @@ def _parse_args(argv: list[str]) -> _ArgNamespace:
         type=pathlib.Path,
         help="Log file",
     )
+    arg_parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes to spread connections over, defaults to 1",
+    )
     arg_parser.add_argument(
         "socket",
         type=pathlib.Path,
@@ -125,38 +390,105 @@ def _parse_args(argv: list[str]) -> _ArgNamespace:
 
 
 @dataclass
-class _ConfigFile:
-    # [core]
-    max_concurrency: int | None = None
-    log_level: str | None = None
-    log_file: pathlib.Path | None = None
-
-    # [executor]
+class _ExecutorSection:
+    # [executor] or [executor.<profile>]
     working_dir: pathlib.Path | None = None
     command: str | None = None
     args: list[str] | None = None
+    snapshot: bool = False
+    snapshot_inputs: list[pathlib.Path] = field(default_factory=list)
+    transport: TransportConfig = field(default_factory=TransportConfig)
+    arg_file_bytes: int | None = None
+    job_scheduling: JobScheduling = field(default_factory=JobScheduling)
 
-    # [signal_translations]
+    # [signal_translations] merged with [signal_translations.<profile>]
     signal_translations: SignalTranslator | None = None
 
 
-def _parse_file(path: pathlib.Path | None):
-    if not path:
-        return _ConfigFile()
-
-    config_parser = ConfigParser()
-    config_parser.read(path)
-    config_dir = _ConfigFilePath(path.parent)
-
-    signal_translations: SignalTranslator | None = None
-    if config_parser.has_section("signal_translations"):
-        signal_mapping: dict[Signal, Signal] = dict()
-        for key, value in config_parser["signal_translations"].items():
-            signal_mapping[Signal[key.upper()]] = Signal[value.upper()]
-        signal_translations = SignalTranslator(signal_mapping)
-
+@dataclass
+class _ConfigFile:
+    # [core]
+    max_concurrency: int | None = None
+    log_level: str | None = None
+    log_file: pathlib.Path | None = None
+    log_format: str | None = None
+    log_rate_limit: float | None = None
+    log_rate_burst: int | None = None
+    journal: bool = True
+    journal_file: pathlib.Path | None = None
+    fd_reserve: int | None = None
+    open_timeout_s: float | None = None
+    max_finished_jobs: int | None = None
+    finished_job_ttl_s: float | None = None
+
+    # [priority_weights]
+    priority_weights: dict[JobPriority, int] = field(default_factory=dict)
+
+    # [cgroups]
+    cgroup: CgroupConfig | None = None
+
+    # [placement]
+    placement: PlacementConfig | None = None
+
+    # [pressure]
+    pressure: PressureConfig | None = None
+
+    # [capture]
+    capture_memory_bytes: int | None = None
+    capture_max_bytes: int | None = None
+    capture_retain_count: int | None = None
+    capture_retain_bytes: int | None = None
+    capture_retain_s: float | None = None
+
+    # [cache]
+    cache_max_entries: int | None = None
+    cache_max_bytes: int | None = None
+    cache_ttl_s: float | None = None
+
+    # [tracing]
+    tracing_enabled: bool = False
+    tracing_capacity: int | None = None
+
+    # [supervisor]
+    supervisor_restart: bool = True
+    supervisor_ping_interval_s: float | None = None
+    supervisor_ping_timeout_s: float | None = None
+    supervisor_backoff_initial_s: float | None = None
+    supervisor_backoff_max_s: float | None = None
+    supervisor_start_wait_s: float | None = None
+
+    # [loop_monitor]
+    loop_monitor_enabled: bool = False
+    loop_monitor_interval_s: float | None = None
+    loop_monitor_threshold_s: float | None = None
+
+    executors: dict[str, _ExecutorSection] = field(default_factory=dict)
+
+
+def _parse_signal_translations(
+    config_parser: ConfigParser, profile: str
+) -> SignalTranslator | None:
+    signal_mapping: dict[Signal, Signal] = dict()
+    for section in ["signal_translations", f"signal_translations.{profile}"]:
+        if config_parser.has_section(section):
+            for key, value in config_parser[section].items():
+                signal_mapping[Signal[key.upper()]] = Signal[value.upper()]
+
+    if not signal_mapping:
+        return None
+    return SignalTranslator(signal_mapping)
+
+
+def _get_cpu_list(config_parser: ConfigParser, section: str) -> frozenset[int] | None:
+    cpu_list = config_parser.get(section, "cpu_set", fallback=None)
+    return parse_cpu_list(cpu_list) if cpu_list is not None else None
+
+
+def _parse_executor_section(
+    config_parser: ConfigParser, config_dir: _ConfigFilePath, section: str, profile: str
+) -> _ExecutorSection:
     command: str | None
-    match config_parser.get("executor", "command", fallback=None):
+    match config_parser.get(section, "command", fallback=None):
         case str() as command_str:
             if command_str.startswith("./"):
                 command = str(config_dir.maybe_relative(command_str).absolute())  # type: ignore
@@ -166,22 +498,196 @@ def _parse_file(path: pathlib.Path | None):
             command = None
 
     args: list[str] | None
-    match config_parser.get("executor", "args", fallback=None):
+    match config_parser.get(section, "args", fallback=None):
         case str() as args_str:
             args = shlex.split(args_str)
         case _:
             args = None
 
-    return _ConfigFile(
-        signal_translations=signal_translations,
+    snapshot_inputs: list[pathlib.Path] = []
+    for input_str in shlex.split(config_parser.get(section, "snapshot_inputs", fallback="")):
+        input_path = config_dir.maybe_relative(input_str)
+        if input_path is not None:
+            snapshot_inputs.append(input_path.absolute())
+
+    transport = TransportConfig(
+        kind=config_parser.get(section, "transport", fallback=TransportConfig.kind),
+        listen=config_parser.get(section, "transport_listen", fallback=TransportConfig.listen),
+        advertise=config_parser.get(section, "transport_advertise", fallback=None),
+    )
+    if transport.kind not in TRANSPORT_KINDS:
+        raise RuntimeError(
+            f"Unknown transport {transport.kind} for profile {profile}, expected one of"
+            f" {', '.join(sorted(TRANSPORT_KINDS))}"
+        )
+
+    try:
+        nice = config_parser.getint(section, "nice", fallback=None)
+        job_scheduling = JobScheduling(
+            cpu_set=_get_cpu_list(config_parser, section),
+            nice=check_nice(nice) if nice is not None else None,
+            ioprio=config_parser.get(section, "ioprio", fallback=None),
+        )
+        if job_scheduling.ioprio is not None:
+            parse_ioprio(job_scheduling.ioprio)
+    except ValueError as e:
+        raise RuntimeError(f"Invalid job scheduling for profile {profile}: {e}")
+
+    arg_file_bytes = config_parser.getint(section, "arg_file_bytes", fallback=None)
+    if arg_file_bytes is not None and arg_file_bytes < 1:
+        raise RuntimeError(f"arg_file_bytes for profile {profile} must be positive")
+
+    return _ExecutorSection(
+        arg_file_bytes=arg_file_bytes,
+        job_scheduling=job_scheduling,
+        signal_translations=_parse_signal_translations(config_parser, profile),
         command=command,
         args=args,
+        snapshot=config_parser.getboolean(section, "snapshot", fallback=False),
+        snapshot_inputs=snapshot_inputs,
+        transport=transport,
+        working_dir=config_dir.maybe_relative(
+            config_parser.get(section, "working_dir", fallback=None)
+        ),
+    )
+
+
+def _parse_pressure_section(
+    config_parser: ConfigParser, config_dir: _ConfigFilePath
+) -> PressureConfig:
+    pressure = PressureConfig(
+        source=config_dir.maybe_relative(config_parser.get("pressure", "source", fallback=None))
+        or pathlib.Path("/proc/pressure"),
+        interval_s=config_parser.getfloat("pressure", "interval_s", fallback=2.0),
+        thresholds={
+            resource: config_parser.getfloat("pressure", resource)
+            for resource in PRESSURE_RESOURCES
+            if config_parser.has_option("pressure", resource)
+        },
+        min_concurrency=config_parser.getint("pressure", "min_concurrency", fallback=1),
+        increase=config_parser.getfloat("pressure", "increase", fallback=1.0),
+        decrease=config_parser.getfloat("pressure", "decrease", fallback=0.5),
+    )
+
+    if not pressure.thresholds:
+        raise RuntimeError(
+            f"[pressure] needs a threshold for at least one of {', '.join(PRESSURE_RESOURCES)}"
+        )
+    if pressure.interval_s <= 0 or pressure.increase <= 0 or pressure.min_concurrency < 1:
+        raise RuntimeError(
+            "[pressure] interval_s and increase must be positive, and min_concurrency at least 1"
+        )
+    if not 0 < pressure.decrease < 1:
+        raise RuntimeError(f"[pressure] decrease must be between 0 and 1, got {pressure.decrease}")
+    return pressure
+
+
+def _parse_file(path: pathlib.Path | None):
+    if not path:
+        return _ConfigFile()
+
+    config_parser = ConfigParser()
+    config_parser.read(path)
+    config_dir = _ConfigFilePath(path.parent)
+
+    executors: dict[str, _ExecutorSection] = dict()
+    for section in config_parser.sections():
+        if section == "executor":
+            profile = DEFAULT_PROFILE
+        elif section.startswith("executor."):
+            profile = section.removeprefix("executor.")
+        else:
+            continue
+
+        if profile in executors:
+            raise RuntimeError(f"Executor profile {profile} is defined more than once")
+        executors[profile] = _parse_executor_section(config_parser, config_dir, section, profile)
+
+    priority_weights: dict[JobPriority, int] = dict()
+    if config_parser.has_section("priority_weights"):
+        for key in config_parser["priority_weights"]:
+            priority_weights[JobPriority[key.upper()]] = config_parser.getint(
+                "priority_weights", key
+            )
+
+    cgroup: CgroupConfig | None = None
+    if config_parser.has_section("cgroups"):
+        cgroup = CgroupConfig(
+            parent=pathlib.Path(config_parser.get("cgroups", "parent")),
+            cpu_max=config_parser.get("cgroups", "cpu_max", fallback=None),
+            memory_max=config_parser.get("cgroups", "memory_max", fallback=None),
+        )
+
+    placement: PlacementConfig | None = None
+    if config_parser.has_section("placement"):
+        policy = config_parser.get("placement", "policy", fallback="core")
+        if policy not in PLACEMENT_POLICIES:
+            raise RuntimeError(
+                f"Unknown placement policy {policy}, expected one of"
+                f" {', '.join(sorted(PLACEMENT_POLICIES))}"
+            )
+        try:
+            cpu_set = _get_cpu_list(config_parser, "placement")
+        except ValueError as e:
+            raise RuntimeError(f"Invalid placement cpu_set: {e}")
+        placement = PlacementConfig(
+            policy=policy,
+            cpu_set=cpu_set if cpu_set is not None else frozenset(os.sched_getaffinity(0)),
+        )
+
+    pressure: PressureConfig | None = None
+    if config_parser.has_section("pressure"):
+        pressure = _parse_pressure_section(config_parser, config_dir)
+
+    return _ConfigFile(
+        executors=executors,
+        priority_weights=priority_weights,
+        cgroup=cgroup,
+        placement=placement,
+        pressure=pressure,
+        capture_memory_bytes=config_parser.getint("capture", "memory_bytes", fallback=None),
+        capture_max_bytes=config_parser.getint("capture", "max_bytes", fallback=None),
+        capture_retain_count=config_parser.getint("capture", "retain_count", fallback=None),
+        capture_retain_bytes=config_parser.getint("capture", "retain_bytes", fallback=None),
+        capture_retain_s=config_parser.getfloat("capture", "retain_s", fallback=None),
+        cache_max_entries=config_parser.getint("cache", "max_entries", fallback=None),
+        cache_max_bytes=config_parser.getint("cache", "max_bytes", fallback=None),
+        cache_ttl_s=config_parser.getfloat("cache", "ttl_s", fallback=None),
+        tracing_enabled=config_parser.getboolean("tracing", "enabled", fallback=False),
+        tracing_capacity=config_parser.getint("tracing", "capacity", fallback=None),
+        supervisor_restart=config_parser.getboolean("supervisor", "restart", fallback=True),
+        supervisor_ping_interval_s=config_parser.getfloat(
+            "supervisor", "ping_interval_s", fallback=None
+        ),
+        supervisor_ping_timeout_s=config_parser.getfloat(
+            "supervisor", "ping_timeout_s", fallback=None
+        ),
+        supervisor_backoff_initial_s=config_parser.getfloat(
+            "supervisor", "backoff_initial_s", fallback=None
+        ),
+        supervisor_backoff_max_s=config_parser.getfloat(
+            "supervisor", "backoff_max_s", fallback=None
+        ),
+        supervisor_start_wait_s=config_parser.getfloat("supervisor", "start_wait_s", fallback=None),
+        loop_monitor_enabled=config_parser.getboolean("loop_monitor", "enabled", fallback=False),
+        loop_monitor_interval_s=config_parser.getfloat("loop_monitor", "interval_s", fallback=None),
+        loop_monitor_threshold_s=config_parser.getfloat(
+            "loop_monitor", "threshold_s", fallback=None
+        ),
         max_concurrency=config_parser.getint("core", "max_concurrency", fallback=None),
         log_level=config_parser.get("core", "log_level", fallback=None),
         log_file=config_dir.maybe_relative(config_parser.get("core", "log_file", fallback=None)),
-        working_dir=config_dir.maybe_relative(
-            config_parser.get("executor", "working_dir", fallback=None)
+        log_format=config_parser.get("core", "log_format", fallback=None),
+        log_rate_limit=config_parser.getfloat("core", "log_rate_limit", fallback=None),
+        log_rate_burst=config_parser.getint("core", "log_rate_burst", fallback=None),
+        journal=config_parser.getboolean("core", "journal", fallback=True),
+        journal_file=config_dir.maybe_relative(
+            config_parser.get("core", "journal_file", fallback=None)
         ),
+        fd_reserve=config_parser.getint("core", "fd_reserve", fallback=None),
+        open_timeout_s=config_parser.getfloat("core", "open_timeout_s", fallback=None),
+        max_finished_jobs=config_parser.getint("core", "max_finished_jobs", fallback=None),
+        finished_job_ttl_s=config_parser.getfloat("core", "finished_job_ttl_s", fallback=None),
     )
 
 
@@ -193,17 +699,135 @@ def parse_config(argv: list[str]) -> CommandServerConfig:
     if not socket_path:
         raise RuntimeError("No socket address specified in args or config file")
 
-    if not file.command:
-        raise RuntimeError("No executor command specified in config file")
+    if not file.executors:
+        raise RuntimeError("No executor sections specified in config file")
+
+    if file.log_format not in (None, "text", "json"):
+        raise RuntimeError(f"Unknown log_format {file.log_format}, expected text or json")
+
+    if any(
+        value is not None and value <= 0
+        for value in (file.loop_monitor_interval_s, file.loop_monitor_threshold_s)
+    ):
+        raise RuntimeError("[loop_monitor] interval_s and threshold_s must be positive")
+
+    if (file.max_finished_jobs is not None and file.max_finished_jobs < 0) or (
+        file.finished_job_ttl_s is not None and file.finished_job_ttl_s <= 0
+    ):
+        raise RuntimeError(
+            "max_finished_jobs can't be negative, and finished_job_ttl_s must be positive"
+        )
+
+    workers = args.workers if args.workers is not None else 1
+    if workers < 1:
+        raise RuntimeError(f"--workers must be at least 1, got {workers}")
+
+    worker: int | None = None
+    if WORKER_VAR in os.environ:
+        worker = int(os.environ[WORKER_VAR])
+
+    journal_file: pathlib.Path | None = None
+    if file.journal:
+        socket_hash = hashlib.sha256(str(socket_path.absolute()).encode()).hexdigest()[:16]
+        journal_file = file.journal_file or run_dir_path(f"journal.{socket_hash}.jsonl")
+        if worker is not None:
+            # Each worker journals (and re-adopts) only its own jobs
+            journal_file = journal_file.with_name(
+                f"{journal_file.stem}.{worker}{journal_file.suffix}"
+            )
+
+    executor_configs: dict[str, BaseExecutorConfig] = dict()
+    for profile, section in file.executors.items():
+        if not section.command:
+            raise RuntimeError(f"No executor command specified for profile {profile}")
+
+        # Command line executor args only apply to the default profile
+        executor_args = args.executor_args if profile == DEFAULT_PROFILE else None
+
+        executor_configs[profile] = BaseExecutorConfig(
+            profile=profile,
+            cwd=pathlib.Path(section.working_dir or os.getcwd()),
+            command=section.command,
+            args=executor_args or section.args or [],
+            signal_translator=section.signal_translations or SignalTranslator(dict()),
+            snapshot_inputs=section.snapshot_inputs if section.snapshot else None,
+            transport=section.transport,
+            arg_file_bytes=section.arg_file_bytes,
+            job_scheduling=section.job_scheduling,
+        )
 
     return CommandServerConfig(
         socket_path=socket_path,
         log_level=logging.getLevelNamesMapping()[args.log_level or file.log_level or "WARNING"],
         log_file=str(args.log_file or file.log_file or "/dev/null"),
-        base_executor_config=BaseExecutorConfig(
-            cwd=pathlib.Path(file.working_dir or os.getcwd()),
-            command=file.command,
-            args=args.executor_args or file.args or [],
-            signal_translator=file.signal_translations or SignalTranslator(dict()),
+        log_format=file.log_format or "text",
+        log_rate_limit=file.log_rate_limit,
+        log_rate_burst=file.log_rate_burst or 1000,
+        max_concurrency=file.max_concurrency,
+        pressure=file.pressure,
+        fd_reserve=file.fd_reserve if file.fd_reserve is not None else 64,
+        open_timeout_s=file.open_timeout_s if file.open_timeout_s is not None else 30.0,
+        max_finished_jobs=file.max_finished_jobs if file.max_finished_jobs is not None else 1000,
+        finished_job_ttl_s=file.finished_job_ttl_s or 86400.0,
+        priority_weights=DEFAULT_PRIORITY_WEIGHTS | file.priority_weights,
+        cgroup=file.cgroup,
+        placement=file.placement,
+        capture=CaptureConfig(
+            memory_bytes=file.capture_memory_bytes or 64 * 1024,
+            max_bytes=file.capture_max_bytes or 16 * 1024 * 1024,
+            retain_count=(
+                file.capture_retain_count if file.capture_retain_count is not None else 64
+            ),
+            retain_bytes=(
+                file.capture_retain_bytes
+                if file.capture_retain_bytes is not None
+                else 256 * 1024 * 1024
+            ),
+            retain_s=file.capture_retain_s if file.capture_retain_s is not None else 3600.0,
+        ),
+        cache=CacheConfig(
+            max_entries=file.cache_max_entries or 1024,
+            max_bytes=file.cache_max_bytes or 64 * 1024 * 1024,
+            ttl_s=file.cache_ttl_s if file.cache_ttl_s is not None else 300.0,
+        ),
+        tracing=TracingConfig(
+            enabled=file.tracing_enabled,
+            capacity=file.tracing_capacity or 10_000,
+        ),
+        supervisor=SupervisorConfig(
+            restart=file.supervisor_restart,
+            ping_interval_s=(
+                file.supervisor_ping_interval_s
+                if file.supervisor_ping_interval_s is not None
+                else 30.0
+            ),
+            ping_timeout_s=file.supervisor_ping_timeout_s or 10.0,
+            backoff_initial_s=file.supervisor_backoff_initial_s or 1.0,
+            backoff_max_s=file.supervisor_backoff_max_s or 60.0,
+            start_wait_s=(
+                file.supervisor_start_wait_s if file.supervisor_start_wait_s is not None else 10.0
+            ),
         ),
+        loop_monitor=LoopMonitorConfig(
+            enabled=file.loop_monitor_enabled,
+            interval_s=file.loop_monitor_interval_s or 0.1,
+            threshold_s=file.loop_monitor_threshold_s or 0.1,
+        ),
+        journal_file=journal_file,
+        argv=argv,
+        executor_configs=executor_configs,
+        workers=workers,
+        worker=worker,
     )
+
+
+def reload_config(config: CommandServerConfig) -> Result[CommandServerConfig, InvalidServerConfig]:
+    """
+    Re-reads the config file (and command line) that the running config was built from
+    """
+
+    try:
+        return Ok(parse_config(config.argv))
+    except (Exception, SystemExit) as e:
+        _LOGGER.error("Failed to reload config: %r", e)
+        return Err(InvalidServerConfig(repr(e)))
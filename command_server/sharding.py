@@ -0,0 +1,514 @@
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import stat
+from collections.abc import Callable
+from dataclasses import replace
+from typing import Any
+
+from jrpc.data import JsonRpcError
+from jrpc.service import MethodDescriptor, MethodSet, implements, make_method_set
+from result import Err, Ok, Result
+
+from . import workers
+from .api import (
+    AllocationSite,
+    AttachJobParams,
+    AttachJobResult,
+    CancelReloadParams,
+    CancelReloadResult,
+    ConcurrencyParams,
+    ConcurrencyResult,
+    DumpTraceParams,
+    DumpTraceResult,
+    ExecutorStatus,
+    FdUsageParams,
+    FdUsageResult,
+    JobMethod,
+    ListExecutorsParams,
+    ListExecutorsResult,
+    ListJobsParams,
+    ListJobsResult,
+    LoopLagParams,
+    LoopLagResult,
+    MemorySnapshotParams,
+    MemorySnapshotResult,
+    ProfileParams,
+    ProfileResult,
+    ReadOutputParams,
+    ReadOutputResult,
+    ReloadConfigParams,
+    ReloadConfigResult,
+    ReloadExecutorParams,
+    ReloadExecutorResult,
+    SignalJobParams,
+    SignalJobResult,
+    StartJobParams,
+    StartJobResult,
+    StartPipelineParams,
+    StartPipelineResult,
+    Stdio,
+    StopServerParams,
+    StopServerResult,
+    WaitForJobParams,
+    WaitForJobResult,
+    WaitForReloadParams,
+    WaitForReloadResult,
+)
+from .errors import ERROR_CONVERTER, JobApiError, JobApiErrorCode, WorkerNotRunning
+from .files import run_dir_path
+from .impl import JobApiImpl
+
+_LOGGER = logging.getLogger("sharding")
+
+# Stdio of the executors a reload starts in the workers other than the client's, so that
+# only one executor reads the client's stdin and writes its output
+_NULL_STDIO = Stdio("/dev/null", "/dev/null", "/dev/null")
+
+# JobApiImpl methods the other workers may call, and the API methods whose converters
+# their params and results go through
+_PEER_METHODS: dict[str, MethodDescriptor] = {
+    "reload_executor": JobMethod.RELOAD_EXECUTOR,
+    "reload_config": JobMethod.RELOAD_CONFIG,
+    "cancel_reload": JobMethod.CANCEL_RELOAD,
+    "wait_for_reload": JobMethod.WAIT_FOR_RELOAD,
+    "read_output": JobMethod.READ_OUTPUT,
+    "attach_job": JobMethod.ATTACH_JOB,
+    "signal_job": JobMethod.SIGNAL_JOB,
+    "wait_for_job": JobMethod.WAIT_FOR_JOB,
+    "list_jobs": JobMethod.LIST_JOBS,
+    "list_executors": JobMethod.LIST_EXECUTORS,
+    "fd_usage": JobMethod.FD_USAGE,
+    "concurrency": JobMethod.CONCURRENCY,
+    "profile": JobMethod.PROFILE,
+    "memory_snapshot": JobMethod.MEMORY_SNAPSHOT,
+    "loop_lag": JobMethod.LOOP_LAG,
+}
+
+
+def _peer_dir() -> pathlib.Path:
+    # Workers are children of the front process, so its pid tells servers apart
+    return run_dir_path(f"workers.{os.getppid()}")
+
+
+def _peer_socket_path(index: int) -> pathlib.Path:
+    return _peer_dir().joinpath(f"{index}.sock")
+
+
+def _make_peer_dir() -> None:
+    """
+    Makes the directory the peer sockets go in, which only the server's user can enter, so
+    the sockets are never reachable by anyone else, not even between bind and chmod
+    """
+
+    path = _peer_dir()
+    path.mkdir(mode=0o700, exist_ok=True)
+    st = path.lstat()
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise RuntimeError(f"{path} is not a directory owned by the server's user")
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        path.chmod(0o700)
+
+
+async def _write_message(writer: asyncio.StreamWriter, message: Any) -> None:
+    data = json.dumps(message).encode()
+    writer.write(len(data).to_bytes(4, "big") + data)
+    await writer.drain()
+
+
+async def _read_message(reader: asyncio.StreamReader) -> Any:
+    size = int.from_bytes(await reader.readexactly(4), "big")
+    return json.loads(await reader.readexactly(size))
+
+
+def _dump_result(method: MethodDescriptor, result: Result[Any, JobApiError]) -> dict[str, Any]:
+    match result:
+        case Ok(value):
+            return {"result": method.result_converter.dump(value)}
+        case Err(error):
+            rpc_error = ERROR_CONVERTER.dump(error)
+            return {
+                "error": {
+                    "code": rpc_error.code,
+                    "message": rpc_error.message,
+                    "data": rpc_error.data,
+                }
+            }
+
+
+def _load_result(method: MethodDescriptor, message: Any) -> Result[Any, JobApiError]:
+    if not isinstance(message, dict):
+        raise ValueError(f"Malformed peer response: {message!r}")
+    if "error" in message:
+        error = message["error"]
+        return Err(
+            ERROR_CONVERTER.load(JsonRpcError(error["code"], error["message"], error["data"]))
+        )
+    if (result := method.result_converter.load(message.get("result"))) is None:
+        raise ValueError(f"Malformed {method.name} result: {message!r}")
+    return Ok(result)
+
+
+async def serve_peers(impl: JobApiImpl, index: int) -> asyncio.Server:
+    """
+    Serves the worker's impl to the other workers, on a socket only the server's user can
+    connect to
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await _read_message(reader)
+            name = request["method"]
+            if name not in _PEER_METHODS:
+                raise ValueError(f"Unknown peer method {name}")
+            method = _PEER_METHODS[name]
+            if (params := method.params_converter.load(request["params"])) is None:
+                raise ValueError(f"Malformed {method.name} params: {request['params']!r}")
+            await _write_message(writer, _dump_result(method, await getattr(impl, name)(params)))
+        except (asyncio.IncompleteReadError, OSError, ValueError, KeyError, TypeError) as e:
+            _LOGGER.warning("Failed to answer a peer request: %r", e)
+        finally:
+            writer.close()
+
+    _make_peer_dir()
+    path = _peer_socket_path(index)
+    path.unlink(missing_ok=True)
+    return await asyncio.start_unix_server(handle, path=path)
+
+
+def stop_serving_peers(server: asyncio.Server, index: int) -> None:
+    server.close()
+    _peer_socket_path(index).unlink(missing_ok=True)
+    try:
+        _peer_dir().rmdir()
+    except OSError:
+        # Other workers are still serving
+        pass
+
+
+class ShardedJobApi:
+    """
+    The API a worker serves to clients. Requests about another worker's jobs or executors
+    are forwarded to it, and requests about the whole server go to every worker.
+    """
+
+    def __init__(
+        self,
+        impl: JobApiImpl,
+        index: int,
+        num_workers: int,
+        request_stop: Callable[[], None],
+    ) -> None:
+        self.impl = impl
+        self.index = index
+        self.num_workers = num_workers
+        self._request_stop = request_stop
+
+    async def _call(self, index: int, method: str, params: Any) -> Result[Any, JobApiError]:
+        if index == self.index:
+            return await getattr(self.impl, method)(params)
+
+        try:
+            reader, writer = await asyncio.open_unix_connection(_peer_socket_path(index))
+        except OSError:
+            return Err(JobApiError.from_data(WorkerNotRunning(index)))
+
+        descriptor = _PEER_METHODS[method]
+        try:
+            await _write_message(
+                writer, {"method": method, "params": descriptor.params_converter.dump(params)}
+            )
+            return _load_result(descriptor, await _read_message(reader))
+        except (asyncio.IncompleteReadError, OSError):
+            return Err(JobApiError.from_data(WorkerNotRunning(index)))
+        except (ValueError, KeyError, TypeError) as e:
+            _LOGGER.error("Bad response to %s from worker %d: %r", method, index, e)
+            return Err(JobApiError.from_data(WorkerNotRunning(index)))
+        finally:
+            writer.close()
+
+    async def _call_owner(
+        self, id: str | None, method: str, params: Any
+    ) -> Result[Any, JobApiError]:
+        owner = workers.owner_of(id) if id is not None else None
+        return await self._call(self.index if owner is None else owner, method, params)
+
+    async def _call_all(
+        self, method: str, params: Any, local_params: Any = None
+    ) -> list[Result[Any, JobApiError]]:
+        """
+        Calls every worker, this one with local_params instead if they're given
+        """
+
+        results = await asyncio.gather(
+            *(
+                self._call(
+                    index,
+                    method,
+                    local_params if index == self.index and local_params is not None else params,
+                )
+                for index in range(self.num_workers)
+            )
+        )
+        for index, result in enumerate(results):
+            match result:
+                case Err(error) if index != self.index:
+                    _LOGGER.warning("%s failed on worker %d: %s", method, index, error.message)
+        return results
+
+    @implements(JobMethod.RELOAD_EXECUTOR)
+    async def reload_executor(
+        self, params: ReloadExecutorParams
+    ) -> Result[ReloadExecutorResult, JobApiError]:
+        # Every worker runs its own executor for the profile. Only this worker's gets the
+        # client's stdio.
+        others = replace(params, stdio=_NULL_STDIO)
+        return (await self._call_all("reload_executor", others, params))[self.index]
+
+    @implements(JobMethod.RELOAD_CONFIG)
+    async def reload_config(
+        self, params: ReloadConfigParams
+    ) -> Result[ReloadConfigResult, JobApiError]:
+        return (await self._call_all("reload_config", params))[self.index]
+
+    @implements(JobMethod.CANCEL_RELOAD)
+    async def cancel_reload(
+        self, params: CancelReloadParams
+    ) -> Result[CancelReloadResult, JobApiError]:
+        match await self._call_owner(params.id, "cancel_reload", params):
+            case Ok(cancelled):
+                pass
+            case Err() as err:
+                return err
+
+        # The reload started an executor in every worker, so cancel the others' too. Only
+        # the owner knows the reload by id, the others by the profile they're loading.
+        others: list[tuple[int, CancelReloadParams]] = []
+        listings = await self._call_all("list_executors", ListExecutorsParams(False))
+        for index, result in enumerate(listings):
+            match result:
+                case Ok(listed):
+                    others.extend(
+                        (index, replace(params, id=executor.id))
+                        for executor in listed.executors.values()
+                        if executor.id != params.id
+                        and executor.profile == cancelled.executor.profile
+                        and executor.state.status == ExecutorStatus.LOADING
+                    )
+        for (_, other), result in zip(
+            others,
+            await asyncio.gather(
+                *(self._call(index, "cancel_reload", other) for index, other in others)
+            ),
+        ):
+            match result:
+                case Err(error) if error.code != JobApiErrorCode.EXECUTOR_ALREADY_LOADED:
+                    _LOGGER.warning("Failed to cancel reload %s: %s", other.id, error.message)
+
+        return Ok(cancelled)
+
+    @implements(JobMethod.WAIT_FOR_RELOAD)
+    async def wait_for_reload(
+        self, params: WaitForReloadParams
+    ) -> Result[WaitForReloadResult, JobApiError]:
+        owner = workers.owner_of(params.id) if params.id is not None else None
+        owner = self.index if owner is None else owner
+        match await self._call(owner, "wait_for_reload", params):
+            case Ok(ready):
+                pass
+            case Err() as err:
+                return err
+
+        # The reload started an executor in every worker, so wait for the others too. Ones
+        # that already finished loading have nothing to wait for.
+        others = WaitForReloadParams(None, ready.executor.profile)
+        for result in await asyncio.gather(
+            *(
+                self._call(index, "wait_for_reload", others)
+                for index in range(self.num_workers)
+                if index != owner
+            )
+        ):
+            match result:
+                case Err(error) if error.code != JobApiErrorCode.EXECUTOR_NOT_FOUND:
+                    return result
+
+        return Ok(ready)
+
+    @implements(JobMethod.START_JOB)
+    async def start_job(self, params: StartJobParams) -> Result[StartJobResult, JobApiError]:
+        return await self.impl.start_job(params)
+
+    @implements(JobMethod.START_PIPELINE)
+    async def start_pipeline(
+        self, params: StartPipelineParams
+    ) -> Result[StartPipelineResult, JobApiError]:
+        return await self.impl.start_pipeline(params)
+
+    @implements(JobMethod.READ_OUTPUT)
+    async def read_output(self, params: ReadOutputParams) -> Result[ReadOutputResult, JobApiError]:
+        return await self._call_owner(params.id, "read_output", params)
+
+    @implements(JobMethod.ATTACH_JOB)
+    async def attach_job(self, params: AttachJobParams) -> Result[AttachJobResult, JobApiError]:
+        return await self._call_owner(params.id, "attach_job", params)
+
+    @implements(JobMethod.SIGNAL_JOB)
+    async def signal_job(self, params: SignalJobParams) -> Result[SignalJobResult, JobApiError]:
+        return await self._call_owner(params.id, "signal_job", params)
+
+    @implements(JobMethod.WAIT_FOR_JOB)
+    async def wait_for_job(self, params: WaitForJobParams) -> Result[WaitForJobResult, JobApiError]:
+        return await self._call_owner(params.id, "wait_for_job", params)
+
+    @implements(JobMethod.STOP_SERVER)
+    async def stop_server(self, _: StopServerParams) -> Result[StopServerResult, JobApiError]:
+        self._request_stop()
+        return Ok(StopServerResult())
+
+    @implements(JobMethod.DUMP_TRACE)
+    async def dump_trace(self, params: DumpTraceParams) -> Result[DumpTraceResult, JobApiError]:
+        # Spans are recorded per process, SIGUSR1 to the server dumps every worker's
+        return await self.impl.dump_trace(params)
+
+    @implements(JobMethod.LIST_JOBS)
+    async def list_jobs(self, params: ListJobsParams) -> Result[ListJobsResult, JobApiError]:
+        jobs = {}
+        for result in await self._call_all("list_jobs", params):
+            match result:
+                case Ok(worker_jobs):
+                    jobs.update(worker_jobs.jobs)
+        return Ok(ListJobsResult(jobs))
+
+    @implements(JobMethod.LIST_EXECUTORS)
+    async def list_executors(
+        self, params: ListExecutorsParams
+    ) -> Result[ListExecutorsResult, JobApiError]:
+        executors = {}
+        for result in await self._call_all("list_executors", params):
+            match result:
+                case Ok(worker_executors):
+                    executors.update(worker_executors.executors)
+        return Ok(ListExecutorsResult(executors))
+
+    @implements(JobMethod.FD_USAGE)
+    async def fd_usage(self, params: FdUsageParams) -> Result[FdUsageResult, JobApiError]:
+        # Each worker has its own fds and limit, so the totals are over all of them
+        usage = FdUsageResult(open_fds=0, limit=0, reserve=0, jobs=0, executors=0)
+        for result in await self._call_all("fd_usage", params):
+            match result:
+                case Ok(worker_usage):
+                    usage.open_fds += worker_usage.open_fds
+                    usage.limit += worker_usage.limit
+                    usage.reserve += worker_usage.reserve
+                    usage.jobs += worker_usage.jobs
+                    usage.executors += worker_usage.executors
+        return Ok(usage)
+
+    @implements(JobMethod.CONCURRENCY)
+    async def concurrency(
+        self, params: ConcurrencyParams
+    ) -> Result[ConcurrencyResult, JobApiError]:
+        # Each worker limits its own starts, so the limit over all of them is the sum
+        total = ConcurrencyResult(max_running=0, running=0, queued=0, adaptive=False, decisions=[])
+        for result in await self._call_all("concurrency", params):
+            match result:
+                case Ok(worker):
+                    if total.max_running is not None:
+                        total.max_running = (
+                            total.max_running + worker.max_running
+                            if worker.max_running is not None
+                            else None
+                        )
+                    total.running += worker.running
+                    total.queued += worker.queued
+                    total.adaptive |= worker.adaptive
+                    total.decisions += worker.decisions
+        total.decisions.sort(key=lambda decision: decision.at)
+        return Ok(total)
+
+    @implements(JobMethod.LOOP_LAG)
+    async def loop_lag(self, params: LoopLagParams) -> Result[LoopLagResult, JobApiError]:
+        # Each worker has its own loop, so the histograms are over all of them
+        results = await self._call_all("loop_lag", params)
+        match results[self.index]:
+            case Ok(own):
+                pass
+            case Err() as err:
+                return err
+
+        total = LoopLagResult(
+            enabled=own.enabled,
+            interval_s=own.interval_s,
+            threshold_s=own.threshold_s,
+            samples=0,
+            mean_s=0.0,
+            max_s=0.0,
+            histogram=dict.fromkeys(own.histogram, 0),
+            stalls=[],
+        )
+        for result in results:
+            match result:
+                case Ok(worker):
+                    total.mean_s += worker.mean_s * worker.samples
+                    total.samples += worker.samples
+                    total.max_s = max(total.max_s, worker.max_s)
+                    for bound, count in worker.histogram.items():
+                        total.histogram[bound] = total.histogram.get(bound, 0) + count
+                    total.stalls += worker.stalls
+        total.mean_s = total.mean_s / total.samples if total.samples else 0.0
+        total.stalls.sort(key=lambda stall: stall.at)
+        return Ok(total)
+
+    @implements(JobMethod.PROFILE)
+    async def profile(self, params: ProfileParams) -> Result[ProfileResult, JobApiError]:
+        # Every worker samples itself over the same window, and their stacks are summed
+        results = await self._call_all("profile", params)
+        match results[self.index]:
+            case Ok(own):
+                pass
+            case Err() as err:
+                return err
+
+        total = ProfileResult(duration_s=own.duration_s, samples=0, stacks={})
+        for result in results:
+            match result:
+                case Ok(worker):
+                    total.samples += worker.samples
+                    for stack, count in worker.stacks.items():
+                        total.stacks[stack] = total.stacks.get(stack, 0) + count
+        return Ok(total)
+
+    @implements(JobMethod.MEMORY_SNAPSHOT)
+    async def memory_snapshot(
+        self, params: MemorySnapshotParams
+    ) -> Result[MemorySnapshotResult, JobApiError]:
+        results = await self._call_all("memory_snapshot", params)
+        match results[self.index]:
+            case Err() as err:
+                return err
+
+        total = MemorySnapshotResult(traced_bytes=0, peak_bytes=0, sites=[], objects={})
+        sites: dict[str, AllocationSite] = {}
+        for result in results:
+            match result:
+                case Ok(worker):
+                    total.traced_bytes += worker.traced_bytes
+                    total.peak_bytes += worker.peak_bytes
+                    for site in worker.sites:
+                        if site.site in sites:
+                            sites[site.site].size_bytes += site.size_bytes
+                            sites[site.site].count += site.count
+                        else:
+                            sites[site.site] = site
+                    for name, count in worker.objects.items():
+                        total.objects[name] = total.objects.get(name, 0) + count
+        total.sites = sorted(sites.values(), key=lambda site: site.size_bytes, reverse=True)[
+            : params.limit
+        ]
+        return Ok(total)
+
+    def method_set(self) -> MethodSet:
+        return make_method_set(ShardedJobApi, self)
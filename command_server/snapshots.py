@@ -0,0 +1,94 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import sys
+from dataclasses import dataclass
+
+from .files import run_dir_path
+from .lib.executor_snapshot import SNAPSHOT_VAR
+from .server_config import WORKER_VAR, ExecutorConfig
+
+_LOGGER = logging.getLogger("snapshots")
+
+_RESTORE_SCRIPT = pathlib.Path(__file__).parent.joinpath("lib", "executor_snapshot.py")
+_PYTHON_LOOP = _RESTORE_SCRIPT.with_name("executor_loop.py")
+
+# Set per worker or per load, rather than part of the environment being snapshotted
+_UNKEYED_VARS = frozenset([SNAPSHOT_VAR, WORKER_VAR])
+
+_KEY_SUFFIX = re.compile(r"[0-9a-f]{64}\.json")
+
+
+@dataclass
+class ExecutorSnapshot:
+    path: pathlib.Path
+    exists: bool
+
+    def restore_command(self, executor_args: list[str]) -> list[str]:
+        """
+        Command to run in place of the executor, which applies the snapshot
+        """
+
+        return [sys.executable, str(_RESTORE_SCRIPT), "restore", str(self.path), *executor_args]
+
+    def save_env(self) -> dict[str, str]:
+        """
+        Environment for a full executor load, which asks its loop to save the snapshot
+        """
+
+        return os.environ | {SNAPSHOT_VAR: str(self.path)}
+
+
+def uses_python_loop(config: ExecutorConfig) -> bool:
+    """
+    Whether the executor is the bundled Python loop, which is what a restored executor runs
+    """
+
+    command = [config.command, *config.args]
+    return any(
+        pathlib.Path(config.cwd, arg).resolve() == _PYTHON_LOOP.resolve() for arg in command[:2]
+    )
+
+
+def _snapshot_key(config: ExecutorConfig) -> str:
+    digest = hashlib.sha256()
+    digest.update(json.dumps([config.command, str(config.cwd), config.args]).encode())
+    # The executor inherits the server's environment, which its setup may build on
+    env = sorted((name, value) for name, value in os.environ.items() if name not in _UNKEYED_VARS)
+    digest.update(json.dumps(env).encode())
+    for input_path in config.snapshot_inputs or []:
+        digest.update(b"\0" + str(input_path).encode() + b"\0")
+        try:
+            with open(input_path, "rb") as file:
+                digest.update(hashlib.file_digest(file, "sha256").digest())
+        except OSError:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+def _find_snapshot(config: ExecutorConfig) -> ExecutorSnapshot:
+    prefix = f"snapshot.{config.profile}."
+    path = run_dir_path(f"{prefix}{_snapshot_key(config)}.json")
+    if path.exists():
+        return ExecutorSnapshot(path, exists=True)
+
+    # Snapshots for this profile's old configs or inputs can never be used again
+    for stale_path in path.parent.glob(f"{prefix}*.json"):
+        if _KEY_SUFFIX.fullmatch(stale_path.name.removeprefix(prefix)):
+            _LOGGER.debug("Removing stale snapshot %s", stale_path)
+            stale_path.unlink(missing_ok=True)
+
+    return ExecutorSnapshot(path, exists=False)
+
+
+async def find_snapshot(config: ExecutorConfig) -> ExecutorSnapshot:
+    """
+    Looks up the snapshot matching the executor config and the current contents of its
+    snapshot inputs
+    """
+
+    return await asyncio.get_running_loop().run_in_executor(None, _find_snapshot, config)
@@ -1,11 +1,14 @@
 import asyncio
 import logging
 import os
+import pathlib
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from typing import Self
 
 from result import Err, Ok, Result
 
+from . import tracing
 from .files import AsyncFile, FileOpenFailed, Mode, TempFifo, try_open
 
 _LOGGER = logging.getLogger("token-io")
@@ -15,8 +18,73 @@ _RUNDIR = os.getenv("XDG_RUNTIME_DIR", f"{_HOME}/.cache") + "/command-server"
 os.makedirs(_RUNDIR, exist_ok=True)
 
 
+def escape(token: str) -> str:
+    """
+    Escapes newlines and backslashes.
+    """
+
+    return token.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def unescape(token: str) -> str:
+    """
+    Using backslash as the escape character, this method
+    unescapes the token in a fairly forgiving way:
+        - backslash -> backslash
+        - n -> newline
+        - end of line -> backslash
+        - any other char -> that char
+    """
+
+    result = ""
+    i = 0
+    while i < len(token):
+        c = token[i]
+        i += 1
+        if c != "\\" or i >= len(token):
+            result += c
+        else:
+            c = token[i]
+            i += 1
+            if c == "n":
+                result += "\n"
+            else:
+                result += c
+    return result
+
+
+def encode_tokens(tokens: list[str]) -> bytes:
+    return ("\n".join([escape(token) for token in tokens]) + "\n").encode()
+
+
+class TokenSource(ABC):
+    """
+    Something tokens are read from, e.g. a job's exit FIFO
+    """
+
+    # Set if the tokens come from a FIFO, which a restarted server can reopen
+    fifo: TempFifo | None
+
+    @abstractmethod
+    async def read(self) -> str:
+        """
+        Blocking read for a single token, defaulting to empty string
+        """
+
+    async def read_int(self) -> Result[int, str]:
+        token = await self.read()
+        try:
+            return Ok(int(token))
+        except ValueError:
+            return Err(token)
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+
 @dataclass
-class TokenReader:
+class TokenReader(TokenSource):
     fifo: TempFifo
     file: AsyncFile
 
@@ -30,27 +98,25 @@ class TokenReader:
 
         newline_ind = self._buffer.find("\n")
         while newline_ind < 0:
-            chunk = await self.file.read()
+            with (
+                tracing.span("token_io.read", fifo=self.fifo.path)
+                if tracing.TRACER.enabled
+                else tracing.NULL_SPAN
+            ):
+                chunk = await self.file.read()
             if chunk:
                 self._buffer += chunk.decode()
                 newline_ind = self._buffer.find("\n")
             else:
                 # nothing left to read, return what we have
-                result = self._unescape(self._buffer)
+                result = unescape(self._buffer)
                 self._buffer = ""
                 return result
 
-        result = self._unescape(self._buffer[0:newline_ind])
+        result = unescape(self._buffer[0:newline_ind])
         self._buffer = self._buffer[newline_ind + 1 :]
         return result
 
-    async def read_int(self) -> Result[int, str]:
-        token = await self.read()
-        try:
-            return Ok(int(token))
-        except ValueError:
-            return Err(token)
-
     async def close(self) -> None:
         async with asyncio.TaskGroup() as tg:
             tg.create_task(self.file.close())
@@ -62,38 +128,30 @@ class TokenReader:
     async def __aexit__(self, type, value, tb) -> None:
         await self.close()
 
-    def _unescape(self, token: str) -> str:
-        """
-        Using backslash as the escape character, this method
-        unescapes the token in a fairly forgiving way:
-            - backslash -> backslash
-            - n -> newline
-            - end of line -> backslash
-            - any other char -> that char
-        """
-
-        result = ""
-        i = 0
-        while i < len(token):
-            c = token[i]
-            i += 1
-            if c != "\\" or i >= len(token):
-                result += c
-            else:
-                c = token[i]
-                i += 1
-                if c == "n":
-                    result += "\n"
-                else:
-                    result += c
-        return result
-
 
 async def open_pipe_reader(fifo: TempFifo) -> Result[TokenReader, FileOpenFailed]:
-    _LOGGER.debug(f"Opening {fifo.path=} for reading")
+    _LOGGER.debug("Opening fifo.path=%s for reading", fifo.path)
     return (await try_open(fifo.path, Mode.R)).map(lambda f: TokenReader(fifo, f))
 
 
+def _open_orphaned(path: pathlib.Path) -> int:
+    return os.open(path, os.O_RDONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+
+
+async def reopen_pipe_reader(fifo: TempFifo) -> Result[TokenReader, FileOpenFailed]:
+    """
+    Opens a fifo left behind by a previous server without waiting for a writer. If no
+    writer is left, reads hit EOF straight away instead of blocking.
+    """
+
+    _LOGGER.debug("Reopening fifo.path=%s for reading", fifo.path)
+    try:
+        fd = await asyncio.get_running_loop().run_in_executor(None, _open_orphaned, fifo.path)
+        return Ok(TokenReader(fifo, AsyncFile(fd, pollable=True)))
+    except Exception as open_exception:
+        return Err(FileOpenFailed(fifo.path, open_exception))
+
+
 @dataclass
 class TokenWriter:
     fifo: TempFifo
@@ -104,23 +162,23 @@ class TokenWriter:
         Blocking write for a list of tokens.
         """
 
-        _LOGGER.debug(f"Writing {tokens=}")
+        _LOGGER.debug("Writing tokens=%r", tokens)
 
-        data_str = "\n".join([self._escape(token) for token in tokens]) + "\n"
-        await self.file.write(data_str.encode())
+        with (
+            tracing.span("token_io.write", fifo=self.fifo.path, tokens=len(tokens))
+            if tracing.TRACER.enabled
+            else tracing.NULL_SPAN
+        ):
+            data = encode_tokens(tokens)
+            # Non-blocking FIFOs may take only part of it
+            while data:
+                data = data[await self.file.write(data) :]
 
     async def close(self) -> None:
         async with asyncio.TaskGroup() as tg:
             tg.create_task(self.file.close())
             tg.create_task(self.fifo.unlink())
 
-    def _escape(self, token: str) -> str:
-        """
-        Escapes newlines and backslashes.
-        """
-
-        return token.replace("\\", "\\\\").replace("\n", "\\n")
-
     async def __aenter__(self) -> Self:
         return self
 
@@ -128,6 +186,8 @@ class TokenWriter:
         await self.close()
 
 
-async def open_pipe_writer(fifo: TempFifo) -> Result[TokenWriter, FileOpenFailed]:
-    _LOGGER.debug(f"Opening {fifo.path=} for writing")
-    return (await try_open(fifo.path, Mode.W)).map(lambda f: TokenWriter(fifo, f))
+async def open_pipe_writer(
+    fifo: TempFifo, abort: asyncio.Event | None = None
+) -> Result[TokenWriter, FileOpenFailed]:
+    _LOGGER.debug("Opening fifo.path=%s for writing", fifo.path)
+    return (await try_open(fifo.path, Mode.W, abort=abort)).map(lambda f: TokenWriter(fifo, f))
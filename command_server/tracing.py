@@ -0,0 +1,146 @@
+import itertools
+import json
+import os
+import pathlib
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any
+
+# Handed out by span() and request() while tracing is disabled, so they cost a flag check.
+# Hot paths check TRACER.enabled themselves and use it directly, so that they don't build
+# the span's args either
+NULL_SPAN = nullcontext()
+
+_request: ContextVar["_Request | None"] = ContextVar("trace_request", default=None)
+
+
+@dataclass
+class _Request:
+    id: int
+    method: str
+
+
+@dataclass
+class _Event:
+    name: str
+    request: _Request | None
+    start_ns: int
+    duration_ns: int
+    args: dict[str, Any]
+
+
+class Tracer:
+    """
+    Records spans into a bounded ring, dumped as Chrome trace-event JSON (which loads in
+    chrome://tracing or Perfetto). Each request gets its own row, keyed by request id.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._events: deque[_Event] = deque(maxlen=10_000)
+        self._request_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool, capacity: int) -> None:
+        self.enabled = enabled
+        if capacity != self._events.maxlen:
+            with self._lock:
+                self._events = deque(self._events, maxlen=capacity)
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def record(self, name: str, start_ns: int, args: dict[str, Any]) -> None:
+        event = _Event(name, _request.get(), start_ns, time.perf_counter_ns() - start_ns, args)
+        with self._lock:
+            self._events.append(event)
+
+    def next_request(self, method: str) -> _Request:
+        return _Request(next(self._request_ids), method)
+
+    def dump(self, path: pathlib.Path, clear: bool = False) -> int:
+        """
+        Writes the recorded spans to path, returning how many there were
+        """
+
+        with self._lock:
+            events = list(self._events)
+            if clear:
+                self._events.clear()
+
+        pid = os.getpid()
+        # perf_counter has an arbitrary epoch, shift it so timestamps are wall clock
+        offset_ns = time.time_ns() - time.perf_counter_ns()
+        trace_events: list[dict[str, Any]] = []
+        for event in events:
+            args = dict(event.args)
+            if event.request is not None:
+                args["request_id"] = event.request.id
+                args["method"] = event.request.method
+            trace_events.append(
+                {
+                    "name": event.name,
+                    "ph": "X",
+                    "ts": (event.start_ns + offset_ns) / 1000,
+                    "dur": event.duration_ns / 1000,
+                    "pid": pid,
+                    "tid": event.request.id if event.request is not None else 0,
+                    "args": args,
+                }
+            )
+
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as file:
+            # Span args are stored as given, so building them is cheap on the hot path
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file, default=str)
+        os.replace(tmp_path, path)
+        return len(trace_events)
+
+
+TRACER = Tracer()
+
+
+@contextmanager
+def _span(name: str, args: dict[str, Any]) -> Iterator[None]:
+    start_ns = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        TRACER.record(name, start_ns, args)
+
+
+def span(name: str, /, **args: Any):
+    """
+    Times the enclosed block as part of the current request
+    """
+
+    if not TRACER.enabled:
+        return NULL_SPAN
+    return _span(name, args)
+
+
+@contextmanager
+def _traced_request(method: str) -> Iterator[None]:
+    token = _request.set(TRACER.next_request(method))
+    start_ns = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        TRACER.record(method, start_ns, {})
+        _request.reset(token)
+
+
+def request(method: str):
+    """
+    Starts a new request: spans in the enclosed block (including in tasks it creates) are
+    tagged with its id
+    """
+
+    if not TRACER.enabled:
+        return NULL_SPAN
+    return _traced_request(method)
@@ -0,0 +1,448 @@
+import asyncio
+import ipaddress
+import itertools
+import logging
+import secrets
+import socket
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from result import Err, Ok, Result
+
+from . import token_io
+from .errors import FileError, FileErrorType
+from .files import FifoCreateFailed, FileOpenFailed, TempFifo, mkfifo
+from .server_config import TransportConfig
+from .token_io import TokenReader, TokenSource, TokenWriter, encode_tokens, unescape
+
+_LOGGER = logging.getLogger("transport")
+
+# The channel executor responses (the ready status, pids and control replies) are sent on
+_RESPONSE_CHANNEL = ""
+
+
+@dataclass
+class TransportFailed:
+    address: str
+    exception: Exception
+
+    def to_file_error(self) -> FileError:
+        return FileError(FileErrorType.CREATE_FAILED, self.address, repr(self.exception))
+
+
+class JobChannel(ABC):
+    """
+    Where the executor reports the exit of a single job. The request token goes in the
+    status slot of the job's request.
+    """
+
+    request_token: str
+
+    @abstractmethod
+    async def open(self) -> Result[TokenSource, FileOpenFailed]:
+        """
+        Opens the channel for reading, once the request has been sent
+        """
+
+    @abstractmethod
+    async def discard(self) -> None:
+        """
+        Cleans up a channel whose request was never sent
+        """
+
+
+class ExecutorTransport(ABC):
+    """
+    Carries requests to an executor, and its responses and job exits back to the server
+    """
+
+    # Whether the executor's pids are in the server's pid namespace, so jobs can be
+    # signalled and put in cgroups directly
+    local: bool
+
+    def __init__(self, config: TransportConfig) -> None:
+        self.config = config
+
+    @property
+    @abstractmethod
+    def executor_args(self) -> list[str]:
+        """
+        The first two positional args of the executor, which tell it how to reach the server
+        """
+
+    @abstractmethod
+    async def connect(self) -> Result[None, FileOpenFailed | TransportFailed]:
+        """
+        Waits for the executor to open its end
+        """
+
+    @abstractmethod
+    async def send(self, tokens: list[str]) -> None:
+        """
+        Sends a request, raising OSError if the executor is gone
+        """
+
+    @abstractmethod
+    async def read_response(self) -> Result[int, str]:
+        pass
+
+    @abstractmethod
+    async def open_job_channel(self) -> Result[JobChannel, FifoCreateFailed]:
+        pass
+
+    @property
+    @abstractmethod
+    def held_fds(self) -> int:
+        """
+        Number of fds the transport holds open in the server, not counting job channels
+        """
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+
+class _FifoJobChannel(JobChannel):
+    def __init__(self, fifo: TempFifo) -> None:
+        self.fifo = fifo
+        self.request_token = str(fifo.path)
+
+    async def open(self) -> Result[TokenSource, FileOpenFailed]:
+        match await token_io.open_pipe_reader(self.fifo):
+            case Ok(reader):
+                return Ok(reader)
+            case Err() as err:
+                await self.fifo.unlink()
+                return err
+
+    async def discard(self) -> None:
+        await self.fifo.unlink()
+
+
+class FifoTransport(ExecutorTransport):
+    """
+    Requests and responses over a pair of FIFOs in the run dir, and each job's exit over a
+    FIFO of its own
+    """
+
+    local = True
+
+    def __init__(
+        self, config: TransportConfig, request_fifo: TempFifo, response_fifo: TempFifo
+    ) -> None:
+        super().__init__(config)
+        self.request_fifo = request_fifo
+        self.response_fifo = response_fifo
+        self._reader: TokenReader | None = None
+        self._writer: TokenWriter | None = None
+        # Stops connect waiting for an executor which exited without opening its end
+        self._closed = asyncio.Event()
+
+    @property
+    def executor_args(self) -> list[str]:
+        return [str(self.request_fifo.path), str(self.response_fifo.path)]
+
+    async def connect(self) -> Result[None, FileOpenFailed | TransportFailed]:
+        match await token_io.open_pipe_reader(self.response_fifo):
+            case Ok(reader):
+                self._reader = reader
+            case Err() as err:
+                return err
+
+        match await token_io.open_pipe_writer(self.request_fifo, abort=self._closed):
+            case Ok(writer):
+                self._writer = writer
+            case Err() as err:
+                return err
+
+        return Ok(None)
+
+    async def send(self, tokens: list[str]) -> None:
+        if self._writer is None:
+            raise BrokenPipeError("Executor FIFO is not open")
+        await self._writer.write(tokens)
+
+    async def read_response(self) -> Result[int, str]:
+        if self._reader is None:
+            return Err("")
+        return await self._reader.read_int()
+
+    async def open_job_channel(self) -> Result[JobChannel, FifoCreateFailed]:
+        return (await mkfifo("job_exit")).map(_FifoJobChannel)
+
+    @property
+    def held_fds(self) -> int:
+        return sum(
+            1 for pipe in (self._reader, self._writer) if pipe is not None and not pipe.file.closed
+        )
+
+    async def close(self) -> None:
+        self._closed.set()
+        async with asyncio.TaskGroup() as tg:
+            if self._writer is not None:
+                tg.create_task(self._writer.close())
+            if self._reader is not None:
+                tg.create_task(self._reader.close())
+            tg.create_task(self.request_fifo.unlink())
+            tg.create_task(self.response_fifo.unlink())
+
+
+async def make_fifo_transport(config: TransportConfig) -> Result[FifoTransport, FifoCreateFailed]:
+    match await mkfifo("executor_writer"):
+        case Ok(request_fifo):
+            pass
+        case Err() as err:
+            return err
+
+    match await mkfifo("executor_reader"):
+        case Ok(response_fifo):
+            pass
+        case Err() as err:
+            await request_fifo.unlink()
+            return err
+
+    return Ok(FifoTransport(config, request_fifo, response_fifo))
+
+
+class _StreamChannel(TokenSource, JobChannel):
+    """
+    Tokens sent to one channel of a stream transport
+    """
+
+    fifo = None
+
+    def __init__(self, request_token: str) -> None:
+        self.request_token = request_token
+        self._messages: asyncio.Queue[list[str] | None] = asyncio.Queue()
+        self._tokens: deque[str] = deque()
+        self._eof = False
+        self._closed_callback: Callable[[_StreamChannel], None] | None = None
+
+    def deliver(self, tokens: list[str] | None) -> None:
+        """
+        Queues a message, or the end of the channel if None
+        """
+
+        self._messages.put_nowait(tokens)
+
+    async def read(self) -> str:
+        while not self._tokens:
+            if self._eof:
+                return ""
+            message = await self._messages.get()
+            if message is None:
+                self._eof = True
+            else:
+                self._tokens.extend(message)
+        return self._tokens.popleft()
+
+    async def open(self) -> Result[TokenSource, FileOpenFailed]:
+        return Ok(self)
+
+    async def discard(self) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._closed_callback is not None:
+            self._closed_callback(self)
+            self._closed_callback = None
+
+
+class StreamTransport(ExecutorTransport):
+    """
+    One stream connection (TCP or vsock) which the executor makes back to the server.
+    Requests are sent as they are over FIFOs, and everything the executor sends is framed
+    as a message on a channel:
+
+        <channel>
+        <num-tokens>
+        <token>...
+
+    Responses go on the empty channel, and a job's exit on the channel named in its
+    request. The executor sends the key it was given as the first line, so that nothing
+    else can connect in its place.
+    """
+
+    local = False
+
+    def __init__(self, config: TransportConfig, server: asyncio.Server, address: str) -> None:
+        super().__init__(config)
+        self.address = address
+        self._server = server
+        self._key = secrets.token_hex(16)
+        self._connection: asyncio.Future[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = (
+            asyncio.get_running_loop().create_future()
+        )
+        self._writer: asyncio.StreamWriter | None = None
+        self._responses = _StreamChannel(_RESPONSE_CHANNEL)
+        self._channels: dict[str, _StreamChannel] = {}
+        self._channel_ids = itertools.count(1)
+        self._demux_task: asyncio.Task[None] | None = None
+
+    @property
+    def executor_args(self) -> list[str]:
+        return [self.address, self._key]
+
+    async def accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            key = await _read_token(reader)
+        except (EOFError, OSError):
+            key = None
+
+        if key != self._key or self._connection.done():
+            _LOGGER.warning("Rejected connection to %s", self.address)
+            writer.close()
+            return
+
+        self._connection.set_result((reader, writer))
+
+    async def connect(self) -> Result[None, FileOpenFailed | TransportFailed]:
+        try:
+            reader, self._writer = await self._connection
+        except ConnectionError as e:
+            return Err(TransportFailed(self.address, e))
+        finally:
+            # Only the executor connects
+            self._server.close()
+
+        self._demux_task = asyncio.create_task(self._demux(reader))
+        return Ok(None)
+
+    async def send(self, tokens: list[str]) -> None:
+        if self._writer is None or self._writer.is_closing():
+            raise BrokenPipeError(f"Not connected to {self.address}")
+        self._writer.write(encode_tokens(tokens))
+        await self._writer.drain()
+
+    async def read_response(self) -> Result[int, str]:
+        return await self._responses.read_int()
+
+    async def open_job_channel(self) -> Result[JobChannel, FifoCreateFailed]:
+        channel = _StreamChannel(str(next(self._channel_ids)))
+        channel._closed_callback = self._remove_channel
+        self._channels[channel.request_token] = channel
+        if self._demux_task is not None and self._demux_task.done():
+            channel.deliver(None)
+        return Ok(channel)
+
+    @property
+    def held_fds(self) -> int:
+        listening = len(self._server.sockets) if self._server.is_serving() else 0
+        connected = self._writer is not None and not self._writer.is_closing()
+        return listening + int(connected)
+
+    def _remove_channel(self, channel: _StreamChannel) -> None:
+        self._channels.pop(channel.request_token, None)
+
+    async def _demux(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                channel_token = await _read_token(reader)
+                tokens = [await _read_token(reader) for _ in range(int(await _read_token(reader)))]
+                if channel_token == _RESPONSE_CHANNEL:
+                    self._responses.deliver(tokens)
+                elif (channel := self._channels.pop(channel_token, None)) is not None:
+                    # Each job channel carries a single message
+                    channel.deliver(tokens)
+                    channel.deliver(None)
+                else:
+                    _LOGGER.warning("Message for unknown channel %r", channel_token)
+        except (EOFError, OSError, ValueError) as e:
+            _LOGGER.info("Connection to %s ended: %r", self.address, e)
+        finally:
+            self._responses.deliver(None)
+            for channel in self._channels.values():
+                channel.deliver(None)
+            self._channels.clear()
+
+    async def close(self) -> None:
+        self._server.close()
+        if not self._connection.done():
+            self._connection.set_exception(ConnectionAbortedError("Executor exited"))
+        if self._writer is not None:
+            self._writer.close()
+        if self._demux_task is not None:
+            self._demux_task.cancel()
+            try:
+                await self._demux_task
+            except asyncio.CancelledError:
+                pass
+
+
+async def _read_token(reader: asyncio.StreamReader) -> str:
+    line = await reader.readline()
+    if not line.endswith(b"\n"):
+        raise EOFError()
+    return unescape(line[:-1].decode())
+
+
+def _split_host_port(address: str) -> tuple[str, int]:
+    """
+    Splits host:port, where an IPv6 host is bracketed, e.g. [::1]:8000
+    """
+
+    host, sep, port = address.rpartition(":")
+    if not sep:
+        raise ValueError(f"Expected host:port, got {address!r}")
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    elif ":" in host:
+        raise ValueError(f"IPv6 hosts must be bracketed, got {address!r}")
+    return host, int(port)
+
+
+def _is_wildcard(host: str) -> bool:
+    try:
+        return not host or ipaddress.ip_address(host).is_unspecified
+    except ValueError:
+        return False
+
+
+def _format_host(host: str) -> str:
+    return f"[{host}]" if ":" in host else host
+
+
+async def make_stream_transport(
+    config: TransportConfig,
+) -> Result[StreamTransport, TransportFailed]:
+    transport: StreamTransport | None = None
+
+    async def accept(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if transport is None:
+            writer.close()
+            return
+        await transport.accept(reader, writer)
+
+    try:
+        if config.kind == "vsock":
+            sock = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+            sock.bind((socket.VMADDR_CID_ANY, int(config.listen.rpartition(":")[2])))
+            server = await asyncio.start_server(accept, sock=sock)
+            # Executors in a VM reach the host at its well-known CID
+            address = f"vsock:{socket.VMADDR_CID_HOST}:{sock.getsockname()[1]}"
+        else:
+            host, port = _split_host_port(config.listen)
+            # Executors can't connect to a wildcard address, so they need to be told another
+            if config.advertise is None and _is_wildcard(host):
+                raise ValueError(f"Listening on {config.listen!r} needs a transport_advertise host")
+            server = await asyncio.start_server(accept, host or None, port)
+            bound_host, bound_port = server.sockets[0].getsockname()[:2]
+            advertised = (
+                config.advertise.strip("[]") if config.advertise is not None else bound_host
+            )
+            address = f"tcp:{_format_host(advertised)}:{bound_port}"
+    except (OSError, ValueError, AttributeError) as e:
+        return Err(TransportFailed(config.listen, e))
+
+    transport = StreamTransport(config, server, address)
+    return Ok(transport)
+
+
+async def make_transport(
+    config: TransportConfig,
+) -> Result[ExecutorTransport, FifoCreateFailed | TransportFailed]:
+    if config.kind == "fifo":
+        return await make_fifo_transport(config)
+    return await make_stream_transport(config)
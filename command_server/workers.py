@@ -0,0 +1,289 @@
+import asyncio
+import itertools
+import logging
+import os
+import signal
+import socket
+import sys
+import uuid
+from asyncio import FIRST_COMPLETED, Event, Future
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from .server_config import WORKER_FD_VAR, WORKER_VAR, CommandServerConfig
+
+_LOGGER = logging.getLogger("workers")
+
+# Sent by a worker to ask the front process to stop the whole server
+_STOP_MESSAGE = b"stop"
+
+_id_prefix = ""
+
+ConnectionCallback = Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]]
+
+
+def set_worker(index: int) -> None:
+    """
+    Makes every id generated by this process name the worker it belongs to
+    """
+
+    global _id_prefix
+    _id_prefix = f"w{index}-"
+
+
+def new_id() -> str:
+    """
+    A new job or executor id
+    """
+
+    return f"{_id_prefix}{uuid.uuid4()}"
+
+
+def owner_of(id: str) -> int | None:
+    """
+    Index of the worker which generated the id, or None if it came from a single-process
+    server
+    """
+
+    prefix, sep, _ = id.partition("-")
+    if not sep or not prefix.startswith("w") or not prefix[1:].isdigit():
+        return None
+    return int(prefix[1:])
+
+
+async def _wait_for_fd(sock: socket.socket, writable: bool) -> None:
+    loop = asyncio.get_running_loop()
+    ready: Future[None] = loop.create_future()
+
+    def on_ready() -> None:
+        if not ready.done():
+            ready.set_result(None)
+
+    if writable:
+        loop.add_writer(sock, on_ready)
+    else:
+        loop.add_reader(sock, on_ready)
+    try:
+        await ready
+    finally:
+        if writable:
+            loop.remove_writer(sock)
+        else:
+            loop.remove_reader(sock)
+
+
+@dataclass
+class _Worker:
+    index: int
+    process: asyncio.subprocess.Process | None = None
+    channel: socket.socket | None = None
+
+
+class _Front:
+    """
+    Keeps the worker processes running, and hands each of them connections in turn
+    """
+
+    def __init__(self, config: CommandServerConfig, stop_event: Event) -> None:
+        self.config = config
+        self.stop_event = stop_event
+        self.workers = [_Worker(index) for index in range(config.workers)]
+        self._turns = itertools.cycle(self.workers)
+        self._stopping = False
+
+    async def _spawn(self, worker: _Worker) -> asyncio.subprocess.Process:
+        front_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        front_end.setblocking(False)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "command_server.command_server",
+                *self.config.argv[1:],
+                stdin=asyncio.subprocess.DEVNULL,
+                pass_fds=[worker_end.fileno()],
+                env=os.environ | {
+                    WORKER_VAR: str(worker.index),
+                    WORKER_FD_VAR: str(worker_end.fileno()),
+                },
+            )
+        except OSError:
+            front_end.close()
+            raise
+        finally:
+            worker_end.close()
+
+        worker.process = process
+        worker.channel = front_end
+        asyncio.get_running_loop().add_reader(front_end, self._read_message, worker)
+        return process
+
+    def _close_channel(self, worker: _Worker) -> None:
+        if worker.channel is not None:
+            asyncio.get_running_loop().remove_reader(worker.channel)
+            worker.channel.close()
+            worker.channel = None
+
+    def _read_message(self, worker: _Worker) -> None:
+        assert worker.channel is not None
+        try:
+            message = worker.channel.recv(64)
+        except BlockingIOError:
+            return
+        except OSError:
+            message = b""
+
+        if message == _STOP_MESSAGE:
+            _LOGGER.info("Worker %d asked to stop the server", worker.index)
+            self.stop_event.set()
+        elif not message:
+            self._close_channel(worker)
+
+    async def run_worker(self, worker: _Worker) -> None:
+        """
+        Runs the worker until the server stops, restarting it if it exits. A restarted
+        worker re-adopts its running jobs from its journal.
+        """
+
+        while not self._stopping:
+            try:
+                process = await self._spawn(worker)
+            except OSError as e:
+                _LOGGER.error("Failed to start worker %d: %r", worker.index, e)
+            else:
+                _LOGGER.info("Started worker %d (%d)", worker.index, process.pid)
+                exit_code = await process.wait()
+                self._close_channel(worker)
+                if self._stopping:
+                    return
+                _LOGGER.error("Worker %d exited with %d, restarting", worker.index, exit_code)
+
+            await asyncio.sleep(self.config.supervisor.backoff_initial_s)
+
+    async def accept(self, listener: socket.socket) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            connection, _ = await loop.sock_accept(listener)
+            with connection:
+                await self._hand_off(connection)
+
+    async def _hand_off(self, connection: socket.socket) -> None:
+        for _ in self.workers:
+            worker = next(self._turns)
+            if worker.channel is None:
+                continue
+
+            try:
+                while True:
+                    try:
+                        socket.send_fds(worker.channel, [b"c"], [connection.fileno()])
+                        return
+                    except BlockingIOError:
+                        await _wait_for_fd(worker.channel, writable=True)
+            except OSError as e:
+                _LOGGER.warning("Failed to hand a connection to worker %d: %r", worker.index, e)
+
+        _LOGGER.error("No worker is running to take the connection")
+
+    def forward_signal(self, sig: int) -> None:
+        for worker in self.workers:
+            if worker.process is not None and worker.process.returncode is None:
+                worker.process.send_signal(sig)
+
+    def stop(self) -> None:
+        self._stopping = True
+        self.forward_signal(signal.SIGTERM)
+
+
+async def run_front(config: CommandServerConfig, term_future: Future[int]) -> int:
+    """
+    Serves the socket by handing its connections to config.workers worker processes, which
+    each run the server's API
+    """
+
+    loop = asyncio.get_running_loop()
+    stop_event = Event()
+    front = _Front(config, stop_event)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.setblocking(False)
+    listener.bind(str(config.socket_path))
+    listener.listen(128)
+
+    # Each worker reloads its own config and dumps its own trace
+    for forwarded in (signal.SIGHUP, signal.SIGUSR1):
+        loop.add_signal_handler(forwarded, front.forward_signal, forwarded)
+
+    worker_tasks = [asyncio.create_task(front.run_worker(worker)) for worker in front.workers]
+    accept_task = asyncio.create_task(front.accept(listener))
+    try:
+        _LOGGER.info("Server listening on %s with %d workers", config.socket_path, config.workers)
+        await asyncio.wait(
+            [asyncio.create_task(stop_event.wait()), term_future],
+            return_when=FIRST_COMPLETED,
+        )
+    finally:
+        _LOGGER.info("Server shutting down")
+        accept_task.cancel()
+        listener.close()
+        front.stop()
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+        try:
+            os.unlink(config.socket_path)
+        except Exception:
+            # swallow
+            pass
+
+    if term_future.done():
+        return term_future.result()
+    return 0
+
+
+class WorkerChannel:
+    """
+    A worker's end of the socketpair to the front process
+    """
+
+    def __init__(self, fd: int) -> None:
+        self._socket = socket.socket(fileno=fd)
+        self._socket.setblocking(False)
+        self._connections: set[asyncio.Task[None]] = set()
+
+    @staticmethod
+    def from_env() -> "WorkerChannel":
+        return WorkerChannel(int(os.environ.pop(WORKER_FD_VAR)))
+
+    async def serve(self, callback: ConnectionCallback) -> None:
+        """
+        Serves the connections handed over by the front process, until it goes away
+        """
+
+        while True:
+            try:
+                message, fds, _, _ = socket.recv_fds(self._socket, 64, 16)
+            except BlockingIOError:
+                await _wait_for_fd(self._socket, writable=False)
+                continue
+
+            if not message:
+                _LOGGER.warning("Front process went away")
+                return
+
+            for fd in fds:
+                task = asyncio.create_task(self._serve_connection(fd, callback))
+                self._connections.add(task)
+                task.add_done_callback(self._connections.discard)
+
+    async def _serve_connection(self, fd: int, callback: ConnectionCallback) -> None:
+        reader, writer = await asyncio.open_unix_connection(sock=socket.socket(fileno=fd))
+        await callback(reader, writer)
+
+    def request_stop(self) -> None:
+        """
+        Asks the front process to stop every worker
+        """
+
+        try:
+            self._socket.send(_STOP_MESSAGE)
+        except OSError as e:
+            _LOGGER.error("Failed to ask the front process to stop: %r", e)
@@ -0,0 +1,17 @@
+from collections.abc import Callable
+
+
+class FakeJob:
+    """
+    Stands in for a started job, which finishes when told to
+    """
+
+    def __init__(self) -> None:
+        self._callbacks: list[Callable[["FakeJob"], None]] = []
+
+    def add_done_callback(self, callback: Callable[["FakeJob"], None]) -> None:
+        self._callbacks.append(callback)
+
+    def finish(self) -> None:
+        for callback in self._callbacks:
+            callback(self)
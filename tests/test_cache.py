@@ -0,0 +1,30 @@
+from command_server.cache import ResultCache
+from command_server.server_config import CacheConfig
+
+
+def test_remove_executor_keeps_other_executors() -> None:
+    cache = ResultCache(CacheConfig(max_entries=10, max_bytes=1000, ttl_s=60))
+    cache.put(("a", "/", ("true",)), 0, b"out", b"")
+    cache.put(("a", "/", ("false",)), 1, b"", b"err")
+    cache.put(("b", "/", ("true",)), 0, b"out", b"")
+
+    cache.remove_executor("a")
+    assert len(cache) == 1
+    assert cache.get(("a", "/", ("true",))) is None
+    assert cache.get(("b", "/", ("true",))) is not None
+
+
+def test_evicts_least_recently_used() -> None:
+    cache = ResultCache(CacheConfig(max_entries=2, max_bytes=10, ttl_s=60))
+    cache.put(("a", "/", ("1",)), 0, b"1234", b"")
+    cache.put(("a", "/", ("2",)), 0, b"1234", b"")
+    assert cache.get(("a", "/", ("1",))) is not None
+
+    cache.put(("a", "/", ("3",)), 0, b"1234", b"")
+    assert cache.get(("a", "/", ("2",))) is None
+    assert cache.get(("a", "/", ("1",))) is not None
+
+    # Over max_bytes with the newest entry
+    cache.put(("a", "/", ("4",)), 0, b"123456", b"")
+    assert len(cache) == 2
+    assert cache.get(("a", "/", ("3",))) is None
@@ -0,0 +1,78 @@
+import asyncio
+import gc
+import weakref
+
+from command_server.deadlines import DeadlineQueue
+
+
+class _Held:
+    pass
+
+
+def test_fires_in_order() -> None:
+    async def run() -> list[int]:
+        queue = DeadlineQueue()
+        fired: list[int] = []
+        for i, delay in enumerate([0.03, 0.01, 0.02]):
+            queue.call_later(delay, lambda i=i: fired.append(i))
+        await asyncio.sleep(0.05)
+        assert len(queue) == 0
+        return fired
+
+    assert asyncio.run(run()) == [1, 2, 0]
+
+
+def test_cancel_drops_callback() -> None:
+    async def run() -> None:
+        queue = DeadlineQueue()
+        held = _Held()
+        ref = weakref.ref(held)
+        fired: list[_Held] = []
+        deadline = queue.call_later(60, lambda held=held: fired.append(held))
+        del held
+
+        deadline.cancel()
+        gc.collect()
+        assert deadline.cancelled
+        assert ref() is None
+        queue.close()
+
+    asyncio.run(run())
+
+
+def test_compacts_when_mostly_cancelled() -> None:
+    async def run() -> None:
+        queue = DeadlineQueue()
+        fired: list[int] = []
+        deadlines = [queue.call_later(60 + i, lambda i=i: fired.append(i)) for i in range(10)]
+        queue.call_later(0.01, lambda: fired.append(-1))
+
+        for deadline in deadlines[:5]:
+            deadline.cancel()
+        assert len(queue) == 11
+        deadlines[5].cancel()
+        assert len(queue) == 5
+
+        await asyncio.sleep(0.03)
+        assert fired == [-1]
+        assert len(queue) == 4
+        queue.close()
+
+    asyncio.run(run())
+
+
+def test_cancel_after_firing() -> None:
+    async def run() -> None:
+        queue = DeadlineQueue()
+        fired: list[int] = []
+        first = queue.call_later(0.01, lambda: fired.append(0))
+        queue.call_later(60, lambda: fired.append(1))
+        await asyncio.sleep(0.03)
+
+        # Already popped, so it doesn't count towards compaction
+        first.cancel()
+        assert fired == [0]
+        assert len(queue) == 1
+        queue.close()
+
+    asyncio.run(run())
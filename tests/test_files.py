@@ -0,0 +1,58 @@
+import asyncio
+import os
+import pathlib
+
+import pytest
+from result import Err, Ok
+
+from command_server.files import Mode, try_open_multiple
+
+
+def _fifo(tmp_path: pathlib.Path) -> pathlib.Path:
+    path = tmp_path / "stdin"
+    os.mkfifo(path)
+    return path
+
+
+def test_blocking_read_waits_for_writer(tmp_path: pathlib.Path) -> None:
+    path = _fifo(tmp_path)
+
+    async def run() -> bytes:
+        opening = asyncio.create_task(try_open_multiple((path, Mode.R), blocking=True))
+        await asyncio.sleep(0.05)
+        assert not opening.done()
+
+        writer_fd = os.open(path, os.O_WRONLY)
+        match await opening:
+            case Ok(files):
+                pass
+            case Err(err):
+                raise AssertionError(err)
+        os.write(writer_fd, b"input")
+        os.close(writer_fd)
+        async with files:
+            assert os.get_blocking(files.files[0].fd)
+            return os.read(files.files[0].fd, 16)
+
+    assert asyncio.run(run()) == b"input"
+
+
+@pytest.mark.parametrize("aborted", [False, True])
+def test_blocking_read_gives_up(tmp_path: pathlib.Path, aborted: bool) -> None:
+    path = _fifo(tmp_path)
+
+    async def run() -> Exception:
+        abort = asyncio.Event()
+        if aborted:
+            asyncio.get_running_loop().call_later(0.05, abort.set)
+        match await try_open_multiple(
+            (path, Mode.R), timeout_s=None if aborted else 0.05, abort=abort, blocking=True
+        ):
+            case Ok(files):
+                await files.close_all()
+                raise AssertionError("Opened without a writer")
+            case Err(err):
+                return err.exception
+
+    exception = asyncio.run(run())
+    assert isinstance(exception, ConnectionAbortedError if aborted else TimeoutError)
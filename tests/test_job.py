@@ -0,0 +1,65 @@
+import asyncio
+import pathlib
+
+from command_server.api import JobStatus
+from command_server.cgroups import JobCgroup
+from command_server.job import Job
+from command_server.server_config import SignalTranslator
+from command_server.token_io import TokenSource
+
+
+class _Tokens(TokenSource):
+    def __init__(self, tokens: list[str]) -> None:
+        self.fifo = None
+        self._tokens = tokens
+
+    async def read(self) -> str:
+        return self._tokens.pop(0) if self._tokens else ""
+
+    async def close(self) -> None:
+        pass
+
+
+class _BrokenCgroup(JobCgroup):
+    async def collect(self) -> dict[str, str]:
+        raise RuntimeError("cannot schedule new futures after shutdown")
+
+
+def _job(tokens: list[str]) -> Job:
+    return Job(
+        id="job",
+        profile="default",
+        executor_id="executor",
+        pid=1,
+        cwd="/",
+        args=["true"],
+        signal_translator=SignalTranslator({}),
+        exit_reader=_Tokens(tokens),
+    )
+
+
+def test_exit_is_reported_when_cgroup_attach_fails() -> None:
+    async def run() -> None:
+        async def attach() -> JobCgroup | None:
+            raise OSError("cgroup.procs is gone")
+
+        job = _job(["3", "user_cpu=0.5"])
+        job.attach_cgroup(attach())
+        assert await job.wait() == 3
+        assert job.state.status == JobStatus.DONE
+        assert job.usage.user_cpu_s == 0.5
+
+    asyncio.run(run())
+
+
+def test_exit_is_reported_when_cgroup_collect_fails() -> None:
+    async def run() -> None:
+        async def attach() -> JobCgroup | None:
+            return _BrokenCgroup(pathlib.Path("/nonexistent"))
+
+        job = _job(["0"])
+        job.attach_cgroup(attach())
+        assert await job.wait() == 0
+        assert job.info.state.exit_code == 0
+
+    asyncio.run(run())
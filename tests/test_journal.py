@@ -0,0 +1,92 @@
+import asyncio
+import json
+import pathlib
+
+from command_server.journal import JobJournal, JournalEntry, replay
+
+
+def _entry(id: str, finished: bool = False) -> JournalEntry:
+    return JournalEntry(
+        id=id,
+        profile="default",
+        executor_id="e",
+        pid=100,
+        cwd="/",
+        args=["true"],
+        exit_fifo="",
+        started_at=1.0,
+        finished=finished,
+        exit_code=0 if finished else None,
+        resources={"user_cpu": "0.5"} if finished else {},
+        finished_at=2.0 if finished else None,
+    )
+
+
+def test_replay(tmp_path: pathlib.Path) -> None:
+    async def run() -> None:
+        path = tmp_path.joinpath("jobs.jsonl")
+        journal = JobJournal(path, lambda: [])
+        assert journal.open() == {}
+        journal.record_start(_entry("a"))
+        journal.record_start(_entry("b"))
+        journal.record_exit(_entry("a", finished=True))
+        journal.close()
+
+        entries, num_records = replay(path)
+        assert num_records == 3
+        assert entries == {"a": _entry("a", finished=True), "b": _entry("b")}
+
+    asyncio.run(run())
+
+
+def test_replay_skips_corrupt_records(tmp_path: pathlib.Path) -> None:
+    path = tmp_path.joinpath("jobs.jsonl")
+    start = {"t": "start", **vars(_entry("a"))}
+    for key in ("finished", "exit_code", "timed_out", "resources", "finished_at"):
+        del start[key]
+    path.write_text(
+        json.dumps(start)
+        + "\n"
+        # An exit for a job whose start was lost
+        + json.dumps({"t": "exit", "id": "b", "exit_code": 1, "timed_out": False})
+        + "\n"
+        # Cut off by a crash
+        + '{"t": "exit", "id": "a", "exit_'
+    )
+
+    entries, num_records = replay(path)
+    assert num_records == 2
+    assert entries == {"a": _entry("a")}
+
+
+def test_replay_missing_file(tmp_path: pathlib.Path) -> None:
+    assert replay(tmp_path.joinpath("missing.jsonl")) == ({}, 0)
+
+
+def test_compaction_keeps_current_jobs(tmp_path: pathlib.Path) -> None:
+    async def run() -> None:
+        path = tmp_path.joinpath("jobs.jsonl")
+        current: dict[str, JournalEntry] = {}
+        journal = JobJournal(path, lambda: current.values(), min_compact_records=10)
+        journal.open()
+
+        for i in range(5):
+            current[str(i)] = _entry(str(i))
+            journal.record_start(current[str(i)])
+        for i in range(4):
+            journal.record_exit(_entry(str(i), finished=True))
+            del current[str(i)]
+        # The tenth record triggered a compaction
+        current["5"] = _entry("5")
+        journal.record_start(current["5"])
+        await asyncio.sleep(0.1)
+
+        journal.record_exit(_entry("5", finished=True))
+        journal.close()
+
+        entries, num_records = replay(path)
+        assert set(entries) == {"4", "5"}
+        assert entries["5"].finished
+        assert num_records < 10
+
+    asyncio.run(run())
@@ -0,0 +1,36 @@
+import logging
+
+import pytest
+
+from command_server import logs
+from command_server.logs import RateLimitFilter
+
+
+def _record(name: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.makeLogRecord({"name": name, "levelno": level, "msg": "hi"})
+
+
+def test_summarizes_dropped_records(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = 100.0
+    monkeypatch.setattr(logs.time, "monotonic", lambda: now)
+    emitted: list[logging.LogRecord] = []
+    rate_limit = RateLimitFilter(rate=1.0, burst=2, emit=emitted.append)
+
+    passed = [rate_limit.filter(_record("a")) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    # Other loggers and warnings have their own budget
+    assert rate_limit.filter(_record("b"))
+    assert rate_limit.filter(_record("a", logging.WARNING))
+    assert emitted == []
+
+    now += 1.0
+    assert rate_limit.filter(_record("a"))
+    [summary] = emitted
+    assert summary.name == "a"
+    assert summary.levelno == logging.WARNING
+    assert summary.suppressed == 3
+    assert "3" in summary.getMessage()
+
+    now += 1.0
+    assert rate_limit.filter(_record("a"))
+    assert len(emitted) == 1
@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from command_server.output import OutputBuffer
+
+
+def _check(buffer: OutputBuffer, stream: bytes, max_bytes: int) -> None:
+    assert buffer.end_offset == len(stream)
+    assert buffer.start_offset == max(0, len(stream) - max_bytes)
+    offset, data = buffer.read(0, len(stream) + 1)
+    assert offset == buffer.start_offset
+    assert data == stream[offset:]
+
+
+@pytest.mark.parametrize("memory_bytes", [8, 16, 64])
+def test_chunk_larger_than_max_bytes(memory_bytes: int) -> None:
+    buffer = OutputBuffer(memory_bytes, 16)
+    stream = b"abc"
+    buffer.append(stream)
+
+    chunk = bytes(range(40))
+    buffer.append(chunk)
+    stream += chunk
+    _check(buffer, stream, 16)
+
+    buffer.append(b"xyz")
+    stream += b"xyz"
+    _check(buffer, stream, 16)
+
+
+def test_random_appends_keep_offsets() -> None:
+    rng = random.Random(0)
+    for _ in range(500):
+        memory_bytes = rng.randint(1, 32)
+        max_bytes = rng.randint(1, 32)
+        buffer = OutputBuffer(memory_bytes, max_bytes)
+        stream = b""
+        for _ in range(rng.randint(1, 10)):
+            chunk = rng.randbytes(rng.randint(1, 3 * max_bytes))
+            buffer.append(chunk)
+            stream += chunk
+            _check(buffer, stream, max_bytes)
+        buffer.release()
+
+
+def test_read_from_end() -> None:
+    buffer = OutputBuffer(4, 8)
+    buffer.append(b"0123456789")
+    assert buffer.read(-3, 10) == (7, b"789")
+    assert buffer.read(0, 3) == (2, b"234")
+    buffer.release()
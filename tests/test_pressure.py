@@ -0,0 +1,117 @@
+import asyncio
+import pathlib
+
+from fakes import FakeJob
+from result import Ok
+
+from command_server.api import JobPriority
+from command_server.pressure import ConcurrencyController, PressureFiles
+from command_server.scheduler import JobScheduler
+from command_server.server_config import DEFAULT_PRIORITY_WEIGHTS, PressureConfig
+
+_PSI = (
+    "some avg10={} avg60=0.00 avg300=0.00 total=0\nfull avg10=0.00 avg60=0.00 avg300=0.00 total=0\n"
+)
+
+
+async def _start(scheduler: JobScheduler, key: str) -> FakeJob:
+    async def start() -> Ok[FakeJob]:
+        return Ok(FakeJob())
+
+    return (await scheduler.dispatch(key, JobPriority.NORMAL, start)).unwrap()
+
+
+def _config(tmp_path: pathlib.Path) -> PressureConfig:
+    return PressureConfig(
+        source=tmp_path,
+        interval_s=1.0,
+        thresholds={"cpu": 50.0},
+        min_concurrency=1,
+        increase=1.0,
+        decrease=0.5,
+    )
+
+
+def test_pressure_files_proc_layout(tmp_path: pathlib.Path) -> None:
+    tmp_path.joinpath("cpu").write_text(_PSI.format("12.50"))
+    tmp_path.joinpath("io").write_text("full avg10=1.00\n")
+    files = PressureFiles(tmp_path)
+
+    # io has no "some" line, and memory is missing, so neither is reported
+    assert files.read(["cpu", "io", "memory"]) == {"cpu": 12.5}
+
+
+def test_pressure_files_cgroup_layout(tmp_path: pathlib.Path) -> None:
+    tmp_path.joinpath("cpu.pressure").write_text(_PSI.format("3.00"))
+    tmp_path.joinpath("memory.pressure").write_text(_PSI.format("70.25"))
+    files = PressureFiles(tmp_path)
+
+    assert files.path("cpu") == tmp_path.joinpath("cpu.pressure")
+    assert files.read(["cpu", "memory"]) == {"cpu": 3.0, "memory": 70.25}
+
+
+def test_controller_increases_holds_and_decreases(tmp_path: pathlib.Path) -> None:
+    async def run() -> None:
+        scheduler = JobScheduler(DEFAULT_PRIORITY_WEIGHTS, None)
+        controller = ConcurrencyController(
+            _config(tmp_path), scheduler, max_concurrency=6, read=lambda _: {}, limit=4.0
+        )
+        assert scheduler.max_running == 4
+
+        jobs = [await _start(scheduler, f"p{i}") for i in range(4)]
+        queued = asyncio.create_task(_start(scheduler, "p4"))
+        await asyncio.sleep(0)
+        assert scheduler.queued[JobPriority.NORMAL] == 1
+
+        # At the limit with starts queued, and no pressure
+        decision = controller.tick({"cpu": 10.0})
+        assert (decision.action, decision.limit, decision.max_running) == ("increase", 5.0, 5)
+        jobs.append(await queued)
+        assert scheduler.running == 5
+
+        # Nothing queued
+        decision = controller.tick({"cpu": 10.0})
+        assert (decision.action, decision.limit, decision.max_running) == ("hold", 5.0, 5)
+
+        decision = controller.tick({"cpu": 90.0})
+        assert (decision.action, decision.limit, decision.max_running) == ("decrease", 2.5, 2)
+        assert scheduler.max_running == 2
+
+        # Held decisions aren't kept
+        assert [decision.action for decision in controller.decisions] == [
+            "increase",
+            "decrease",
+        ]
+
+        for job in jobs:
+            job.finish()
+        assert scheduler.running == 0
+
+    asyncio.run(run())
+
+
+def test_controller_bounds(tmp_path: pathlib.Path) -> None:
+    async def run() -> None:
+        scheduler = JobScheduler(DEFAULT_PRIORITY_WEIGHTS, None)
+        controller = ConcurrencyController(
+            _config(tmp_path), scheduler, max_concurrency=2, read=lambda _: {}, limit=2.0
+        )
+
+        for _ in range(5):
+            decision = controller.tick({"cpu": 100.0})
+        assert (decision.limit, decision.max_running) == (1.0, 1)
+
+        jobs = [await _start(scheduler, "p")]
+        queued = asyncio.create_task(_start(scheduler, "p"))
+        await asyncio.sleep(0)
+        for _ in range(3):
+            decision = controller.tick({})
+            await asyncio.sleep(0)
+        # Capped at max_concurrency
+        assert (decision.limit, decision.max_running) == (2.0, 2)
+        jobs.append(await queued)
+
+        for job in jobs:
+            job.finish()
+
+    asyncio.run(run())
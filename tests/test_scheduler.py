@@ -0,0 +1,135 @@
+import asyncio
+
+from fakes import FakeJob
+from result import Err, Ok, Result
+
+from command_server.api import JobPriority
+from command_server.scheduler import JobScheduler
+from command_server.server_config import DEFAULT_PRIORITY_WEIGHTS
+
+
+def test_max_running() -> None:
+    async def run() -> None:
+        scheduler = JobScheduler(DEFAULT_PRIORITY_WEIGHTS, 2)
+        started: list[str] = []
+
+        async def dispatch(name: str) -> FakeJob:
+            async def start() -> Result[FakeJob, str]:
+                started.append(name)
+                return Ok(FakeJob())
+
+            return (await scheduler.dispatch(name, JobPriority.NORMAL, start)).unwrap()
+
+        tasks = [asyncio.create_task(dispatch(name)) for name in "abc"]
+        await asyncio.sleep(0.01)
+        assert started == ["a", "b"]
+        assert scheduler.running == 2
+        assert scheduler.queued[JobPriority.NORMAL] == 1
+
+        (await tasks[0]).finish()
+        await asyncio.sleep(0.01)
+        assert started == ["a", "b", "c"]
+        assert scheduler.running == 2
+
+    asyncio.run(run())
+
+
+def test_failed_start_frees_its_slot() -> None:
+    async def run() -> None:
+        scheduler = JobScheduler(DEFAULT_PRIORITY_WEIGHTS, 1)
+
+        async def fail() -> Result[FakeJob, str]:
+            return Err("failed")
+
+        assert await scheduler.dispatch("a", JobPriority.NORMAL, fail) == Err("failed")
+        assert scheduler.running == 0
+
+        async def start() -> Result[FakeJob, str]:
+            return Ok(FakeJob())
+
+        assert (await scheduler.dispatch("a", JobPriority.NORMAL, start)).is_ok()
+        assert scheduler.running == 1
+
+    asyncio.run(run())
+
+
+def test_one_start_per_key() -> None:
+    async def run() -> None:
+        scheduler = JobScheduler(DEFAULT_PRIORITY_WEIGHTS, None)
+        release = asyncio.Event()
+        started: list[str] = []
+
+        async def dispatch(key: str, name: str) -> None:
+            async def start() -> Result[FakeJob, str]:
+                started.append(name)
+                await release.wait()
+                return Ok(FakeJob())
+
+            await scheduler.dispatch(key, JobPriority.NORMAL, start)
+
+        tasks = [
+            asyncio.create_task(dispatch(key, name))
+            for key, name in [("p", "a"), ("p", "b"), ("q", "c")]
+        ]
+        await asyncio.sleep(0.01)
+        # b waits for a's start to finish, c has a key of its own
+        assert started == ["a", "c"]
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert started == ["a", "c", "b"]
+
+    asyncio.run(run())
+
+
+def test_priorities_share_by_weight() -> None:
+    async def run() -> None:
+        scheduler = JobScheduler({JobPriority.INTERACTIVE: 3, JobPriority.BATCH: 1}, 0)
+        started: list[JobPriority] = []
+
+        async def dispatch(key: str, priority: JobPriority) -> None:
+            async def start() -> Result[FakeJob, str]:
+                started.append(priority)
+                return Err("not running anything")
+
+            await scheduler.dispatch(key, priority, start)
+
+        tasks = [
+            asyncio.create_task(dispatch(f"{priority}{i}", priority))
+            for priority in (JobPriority.BATCH, JobPriority.INTERACTIVE)
+            for i in range(4)
+        ]
+        await asyncio.sleep(0)
+        scheduler.max_running = 1
+        await asyncio.gather(*tasks)
+
+        # Three interactive starts for every batch one, while both are queued
+        assert started[:4].count(JobPriority.INTERACTIVE) == 3
+        assert sorted(started) == sorted([JobPriority.BATCH] * 4 + [JobPriority.INTERACTIVE] * 4)
+
+    asyncio.run(run())
+
+
+def test_connections_take_turns_within_a_class() -> None:
+    async def run() -> None:
+        scheduler = JobScheduler(DEFAULT_PRIORITY_WEIGHTS, 0)
+        started: list[str] = []
+
+        async def dispatch(key: str, connection: str) -> None:
+            async def start() -> Result[FakeJob, str]:
+                started.append(connection)
+                return Err("not running anything")
+
+            await scheduler.dispatch(key, JobPriority.NORMAL, start, connection)
+
+        # One connection floods the class before the other queues anything
+        tasks = [asyncio.create_task(dispatch(f"a{i}", "a")) for i in range(4)]
+        tasks += [asyncio.create_task(dispatch(f"b{i}", "b")) for i in range(2)]
+        await asyncio.sleep(0)
+        assert scheduler.queued[JobPriority.NORMAL] == 6
+        scheduler.max_running = 1
+        await asyncio.gather(*tasks)
+
+        assert started == ["a", "b", "a", "b", "a", "a"]
+
+    asyncio.run(run())
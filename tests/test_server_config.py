@@ -0,0 +1,40 @@
+import pytest
+
+from command_server.server_config import IOPRIO_CLASSES, parse_cpu_list, parse_ioprio
+
+
+@pytest.mark.parametrize(
+    "text, cpus",
+    [
+        ("0", {0}),
+        ("0-3,8", {0, 1, 2, 3, 8}),
+        ("2-3, 3-4,", {2, 3, 4}),
+    ],
+)
+def test_parse_cpu_list(text: str, cpus: set[int]) -> None:
+    assert parse_cpu_list(text) == frozenset(cpus)
+
+
+@pytest.mark.parametrize("text", ["", ",", "a", "1-b", "3-1"])
+def test_parse_cpu_list_rejects(text: str) -> None:
+    with pytest.raises(ValueError):
+        parse_cpu_list(text)
+
+
+@pytest.mark.parametrize(
+    "text, ioprio",
+    [
+        ("idle", (IOPRIO_CLASSES["idle"], 0)),
+        ("be", (IOPRIO_CLASSES["be"], 4)),
+        ("be/0", (IOPRIO_CLASSES["be"], 0)),
+        ("rt/7", (IOPRIO_CLASSES["rt"], 7)),
+    ],
+)
+def test_parse_ioprio(text: str, ioprio: tuple[int, int]) -> None:
+    assert parse_ioprio(text) == ioprio
+
+
+@pytest.mark.parametrize("text", ["", "none", "idle/1", "be/8", "rt/-1", "be/x"])
+def test_parse_ioprio_rejects(text: str) -> None:
+    with pytest.raises(ValueError):
+        parse_ioprio(text)
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from result import Err, Ok
+
+from command_server.server_config import TransportConfig
+from command_server.transport import _split_host_port, make_stream_transport
+
+
+@pytest.mark.parametrize(
+    "address, host_port",
+    [
+        ("127.0.0.1:0", ("127.0.0.1", 0)),
+        (":8000", ("", 8000)),
+        ("[::1]:8000", ("::1", 8000)),
+        ("[::]:0", ("::", 0)),
+    ],
+)
+def test_split_host_port(address: str, host_port: tuple[str, int]) -> None:
+    assert _split_host_port(address) == host_port
+
+
+@pytest.mark.parametrize("address", ["8000", "::1:8000", "localhost:http"])
+def test_split_host_port_rejects(address: str) -> None:
+    with pytest.raises(ValueError):
+        _split_host_port(address)
+
+
+def _address(config: TransportConfig) -> str | None:
+    async def run() -> str | None:
+        match await make_stream_transport(config):
+            case Ok(transport):
+                # Not transport.close(), which fails the connection no executor made
+                transport._server.close()
+                return transport.address
+            case Err():
+                return None
+
+    return asyncio.run(run())
+
+
+def test_wildcard_listen_needs_advertise() -> None:
+    assert _address(TransportConfig(kind="tcp", listen="0.0.0.0:0")) is None
+
+    address = _address(TransportConfig(kind="tcp", listen="0.0.0.0:0", advertise="10.0.2.2"))
+    assert address is not None and address.startswith("tcp:10.0.2.2:")
+
+
+def test_ipv6_address_is_bracketed() -> None:
+    address = _address(TransportConfig(kind="tcp", listen="[::1]:0"))
+    assert address is not None and address.startswith("tcp:[::1]:")
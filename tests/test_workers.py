@@ -0,0 +1,26 @@
+import pytest
+
+from command_server import workers
+
+
+@pytest.mark.parametrize(
+    "id, owner",
+    [
+        ("w0-4b1c", 0),
+        ("w12-4b1c-aa", 12),
+        ("4b1c-aa", None),
+        ("w-4b1c", None),
+        ("wx-4b1c", None),
+        ("w3", None),
+    ],
+)
+def test_owner_of(id: str, owner: int | None) -> None:
+    assert workers.owner_of(id) == owner
+
+
+def test_new_ids_name_their_worker(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(workers, "_id_prefix", "")
+    assert workers.owner_of(workers.new_id()) is None
+
+    workers.set_worker(7)
+    assert workers.owner_of(workers.new_id()) == 7